@@ -1,3 +1,6 @@
+import concurrency
+concurrency.monkey_patch()
+
 from flask import Flask
 from flask_cors import CORS
 from flask_socketio import SocketIO
@@ -6,13 +9,18 @@ from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
 from datetime import timedelta
 
+from cache_bus import cache_bus
 from database import init_db
+import read_cursors
 from routes.auth import auth_bp
 from routes.chats import chat_bp
 from routes.messages import message_bp
 from routes.teams import team_bp
 from routes.admin import admin_bp, init_socketio
+from routes.avatars import avatar_bp
 from sockets.events import register_socket_events
+import sockets.chat_rooms as chat_rooms
+from sockets.pubsub import socketio_queue_options
 
 app = Flask(__name__)
 app.secret_key = 'your-secret-key-here'
@@ -41,9 +49,11 @@ limiter = Limiter(
 socketio = SocketIO(
     app,
     cors_allowed_origins='http://localhost:3000',
-    async_mode='threading',
+    async_mode=concurrency.SOCKETIO_ASYNC_MODE,
     logger=False,
-    engineio_logger=False
+    engineio_logger=False,
+    # При SOCKETIO_MESSAGE_QUEUE события в комнаты расходятся через очередь всем воркерам
+    **socketio_queue_options()
 )
 
 init_db()
@@ -53,9 +63,17 @@ app.register_blueprint(chat_bp)
 app.register_blueprint(message_bp)
 app.register_blueprint(team_bp)
 app.register_blueprint(admin_bp)
+app.register_blueprint(avatar_bp)
+
+# Аватары кешируются браузером и грузятся пачками на каждой странице — не лимитируем
+limiter.exempt(avatar_bp)
 
 register_socket_events(socketio)
 init_socketio(socketio)
+read_cursors.init_socketio(socketio)
+chat_rooms.init_socketio(socketio)
+# Сбросы кешей и переводы сокетов по комнатам чатов приходят от соседних воркеров
+cache_bus.start(socketio)
 
 if __name__ == '__main__':
     socketio.run(app, debug=True, host='0.0.0.0', port=5000)
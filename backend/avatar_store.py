@@ -0,0 +1,129 @@
+import base64
+import binascii
+import hashlib
+import io
+import os
+import re
+import tempfile
+
+from flask import url_for
+
+try:
+    from PIL import Image
+except ImportError:  # Pillow не установлен — вместо миниатюры отдаётся оригинал
+    Image = None
+
+# Каталог с аватарами: <AVATAR_DIR>/<первые 2 символа хеша>/<sha256>
+AVATAR_DIR = os.environ.get(
+    'AVATAR_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'avatars')
+)
+AVATAR_MAX_BYTES = 5 * 1024 * 1024
+THUMBNAIL_SIZE = (128, 128)
+
+_HASH_RE = re.compile(r'^[0-9a-f]{64}$')
+
+# Сигнатуры форматов, которые принимаем. SVG и всё остальное отклоняем:
+# файл отдаётся браузеру как есть, и это не должен быть HTML/скрипт
+_SIGNATURES = (
+    (b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (b'\xff\xd8\xff', 'image/jpeg'),
+    (b'GIF87a', 'image/gif'),
+    (b'GIF89a', 'image/gif'),
+)
+
+
+class AvatarError(ValueError):
+    pass
+
+
+def sniff_mimetype(head):
+    for signature, mimetype in _SIGNATURES:
+        if head.startswith(signature):
+            return mimetype
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'image/webp'
+    return None
+
+
+def decode_image(avatar):
+    """Разбирает data URL или «голый» base64. Возвращает байты изображения."""
+    try:
+        base64_data = avatar.split(',')[1] if avatar.startswith('data:image') else avatar
+        data = base64.b64decode(base64_data)
+    except (IndexError, ValueError, binascii.Error, AttributeError):
+        raise AvatarError('Invalid image data')
+    if len(data) > AVATAR_MAX_BYTES:
+        raise AvatarError('Image size exceeds 5MB limit')
+    if not sniff_mimetype(data[:16]):
+        raise AvatarError('Invalid image data')
+    return data
+
+
+def is_valid_hash(avatar_hash):
+    return bool(avatar_hash and _HASH_RE.match(avatar_hash))
+
+
+def avatar_path(avatar_hash, thumb=False):
+    name = f'{avatar_hash}.thumb' if thumb else avatar_hash
+    return os.path.join(AVATAR_DIR, avatar_hash[:2], name)
+
+
+def save_avatar(avatar):
+    """Сохраняет изображение из base64 в хранилище и возвращает его sha256.
+
+    Одинаковые картинки хранятся один раз. Миниатюра создаётся сразу при
+    загрузке, чтобы не тратить на неё время при отдаче.
+    """
+    data = decode_image(avatar)
+    avatar_hash = hashlib.sha256(data).hexdigest()
+    path = avatar_path(avatar_hash)
+    if not os.path.exists(path):
+        _write_atomic(path, data)
+        thumbnail = _make_thumbnail(data)
+        if thumbnail:
+            _write_atomic(avatar_path(avatar_hash, thumb=True), thumbnail)
+    return avatar_hash
+
+
+def avatar_url(avatar_hash, thumb=False):
+    """Абсолютный URL аватара для ответа API (фронтенд живёт на другом origin)."""
+    if not avatar_hash:
+        return None
+    if thumb:
+        return url_for('avatars.get_avatar', avatar_hash=avatar_hash, size='thumb', _external=True)
+    return url_for('avatars.get_avatar', avatar_hash=avatar_hash, _external=True)
+
+
+def with_avatar_url(row, thumb=False):
+    """dict строки БД: колонка avatar_hash заменяется на поле avatar с URL."""
+    result = dict(row)
+    result['avatar'] = avatar_url(result.pop('avatar_hash', None), thumb=thumb)
+    return result
+
+
+def _make_thumbnail(data):
+    if Image is None:
+        return None
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            image.thumbnail(THUMBNAIL_SIZE)
+            if image.mode not in ('RGB', 'RGBA'):
+                image = image.convert('RGBA')
+            out = io.BytesIO()
+            image.save(out, format='PNG', optimize=True)
+            return out.getvalue()
+    except Exception:
+        return None
+
+
+def _write_atomic(path, data):
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
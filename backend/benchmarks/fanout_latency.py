@@ -0,0 +1,119 @@
+"""Задержка рассылки событий между воркерами через очередь Socket.IO.
+
+Запускает несколько процессов-подписчиков (как воркеры сервера), публикует
+из главного процесса поток сообщений через тот же менеджер, что использует
+SocketIO, и печатает перцентили задержки «опубликовано → получено воркером».
+
+Запуск из каталога backend:
+
+    python benchmarks/fanout_latency.py --queue sqlite:////tmp/fanout.db --workers 4
+    python benchmarks/fanout_latency.py --queue redis://localhost:6379/0 --workers 4
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import pickle
+import sys
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+CHANNEL = 'fanout-bench'
+
+
+def make_manager(url, write_only=False):
+    if url.startswith('sqlite:'):
+        from sockets.pubsub import SqlitePubSubManager
+        return SqlitePubSubManager(url, channel=CHANNEL, write_only=write_only)
+    import socketio
+    return socketio.RedisManager(url, channel=CHANNEL, write_only=write_only)
+
+
+def _decode(message):
+    if isinstance(message, dict):
+        return message
+    if isinstance(message, str):
+        message = message.encode()
+    try:
+        return pickle.loads(message)
+    except Exception:
+        return json.loads(message)
+
+
+def subscriber(url, ready, results):
+    latencies = []
+    announced = False
+    for message in make_manager(url)._listen():
+        data = _decode(message)
+        kind = data.get('bench')
+        if kind == 'ping' and not announced:
+            announced = True
+            ready.put(os.getpid())
+        elif kind == 'message':
+            latencies.append(time.time() - data['sent_at'])
+        elif kind == 'stop':
+            break
+    results.put(latencies)
+
+
+def percentile(values, p):
+    if not values:
+        return 0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--queue', default='sqlite:////tmp/fanout_bench.db', help='URL очереди (sqlite:/// или redis://)')
+    parser.add_argument('--workers', type=int, default=4, help='сколько процессов-подписчиков')
+    parser.add_argument('--messages', type=int, default=2000, help='сколько сообщений опубликовать')
+    parser.add_argument('--rate', type=float, default=1000, help='сообщений в секунду')
+    parser.add_argument('--size', type=int, default=200, help='размер полезной нагрузки, байт')
+    args = parser.parse_args()
+
+    ready, results = multiprocessing.Queue(), multiprocessing.Queue()
+    procs = [multiprocessing.Process(target=subscriber, args=(args.queue, ready, results), daemon=True)
+             for _ in range(args.workers)]
+    for proc in procs:
+        proc.start()
+
+    publisher = make_manager(args.queue, write_only=True)
+
+    # Подписчики начинают слушать не мгновенно: шлём ping, пока все не отзовутся
+    joined = 0
+    while joined < args.workers:
+        publisher._publish({'bench': 'ping'})
+        while not ready.empty():
+            ready.get()
+            joined += 1
+        time.sleep(0.05)
+
+    payload = 'x' * args.size
+    interval = 1 / args.rate
+    started = time.time()
+    for i in range(args.messages):
+        publisher._publish({'bench': 'message', 'sent_at': time.time(), 'payload': payload})
+        delay = started + (i + 1) * interval - time.time()
+        if delay > 0:
+            time.sleep(delay)
+    publisher._publish({'bench': 'stop'})
+
+    latencies = []
+    for _ in procs:
+        latencies += results.get()
+    for proc in procs:
+        proc.join(timeout=5)
+
+    expected = args.messages * args.workers
+    print(f'Очередь: {args.queue}, воркеров: {args.workers}, сообщений: {args.messages} ({args.rate:g}/с)')
+    print(f'Доставлено: {len(latencies)} из {expected}')
+    for p in (50, 95, 99):
+        print(f'  p{p}: {percentile(latencies, p) * 1000:.2f} мс')
+    print(f'  max: {max(latencies, default=0) * 1000:.2f} мс')
+
+
+if __name__ == '__main__':
+    main()
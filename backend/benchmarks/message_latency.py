@@ -0,0 +1,141 @@
+"""Задержка отправки сообщения на сервере: старый путь против кеша и RETURNING.
+
+Создаёт временную БД, заводит чаты с участниками и из нескольких потоков
+(как обработчики send_message) отправляет сообщения двумя способами:
+
+  before — SELECT участия из chat_members, вставка через message_writer,
+           повторный SELECT * вставленной строки ради created_at;
+  after  — membership_cache.get() и вставка с RETURNING id, created_at.
+
+Печатает перцентили задержки одного сообщения и пропускную способность.
+Задержка рассылки (emit) сюда не входит — она одинакова в обоих вариантах.
+
+Запуск из каталога backend:
+
+    python benchmarks/message_latency.py --threads 8 --messages 5000
+"""
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+
+def percentile(values, p):
+    if not values:
+        return 0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+def setup(chats, members):
+    from database import get_db, init_db
+
+    init_db()
+    with get_db() as conn:
+        user_ids = [
+            conn.execute(
+                'INSERT INTO users (username, password_hash) VALUES (?, ?)', (f'bench_{i}', '-')
+            ).lastrowid
+            for i in range(members)
+        ]
+        pairs = []
+        for c in range(chats):
+            chat_id = conn.execute(
+                'INSERT INTO chats (name, type, created_by) VALUES (?, ?, ?)', (f'bench {c}', 'group', user_ids[0])
+            ).lastrowid
+            for user_id in user_ids:
+                conn.execute('INSERT INTO chat_members (chat_id, user_id) VALUES (?, ?)', (chat_id, user_id))
+                pairs.append((chat_id, user_id))
+        conn.commit()
+    return pairs
+
+
+def send_before(chat_id, user_id, content):
+    from database import get_db
+    from message_writer import message_writer
+
+    with get_db() as conn:
+        member = conn.execute('''
+            SELECT t.id AS team_id
+            FROM chat_members cm
+            LEFT JOIN teams t ON t.chat_id = cm.chat_id
+            WHERE cm.chat_id = ? AND cm.user_id = ?
+        ''', (chat_id, user_id)).fetchone()
+        if not member:
+            raise RuntimeError('not a member')
+    message_id, _ = message_writer.insert(chat_id, user_id, content)
+    with get_db() as conn:
+        message = conn.execute('SELECT * FROM messages WHERE id = ?', (message_id,)).fetchone()
+    return message_id, message['created_at']
+
+
+def send_after(chat_id, user_id, content):
+    from membership_cache import membership_cache
+    from message_writer import message_writer
+
+    is_member, _ = membership_cache.get(chat_id, user_id)
+    if not is_member:
+        raise RuntimeError('not a member')
+    return message_writer.insert(chat_id, user_id, content)
+
+
+def run(send, pairs, threads, messages):
+    latencies = []
+    lock = threading.Lock()
+    per_thread = messages // threads
+
+    def worker(n):
+        local = []
+        for i in range(per_thread):
+            chat_id, user_id = pairs[(n * per_thread + i) % len(pairs)]
+            started = time.perf_counter()
+            send(chat_id, user_id, f'message {n}-{i}')
+            local.append(time.perf_counter() - started)
+        with lock:
+            latencies.extend(local)
+
+    started = time.perf_counter()
+    workers = [threading.Thread(target=worker, args=(n,)) for n in range(threads)]
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    return latencies, time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--threads', type=int, default=8, help='одновременных отправителей')
+    parser.add_argument('--messages', type=int, default=4000, help='сообщений на каждый вариант')
+    parser.add_argument('--chats', type=int, default=20)
+    parser.add_argument('--members', type=int, default=10, help='участников в каждом чате')
+    args = parser.parse_args()
+
+    tmp = tempfile.TemporaryDirectory()
+    # database читает путь при импорте — задаём его до первого импорта модулей бэкенда
+    os.environ['DATABASE_PATH'] = os.path.join(tmp.name, 'bench.db')
+    pairs = setup(args.chats, args.members)
+
+    from message_writer import message_writer
+
+    print(f'Потоков: {args.threads}, сообщений: {args.messages}, пар (чат, участник): {len(pairs)}')
+    print(f'{"вариант":<8} {"p50":>9} {"p95":>9} {"p99":>9} {"max":>9} {"сообщ/с":>9}')
+    for name, send in (('before', send_before), ('after', send_after)):
+        # Прогрев: пул соединений, поток записи и (для after) кеш участия
+        run(send, pairs, args.threads, len(pairs))
+        latencies, elapsed = run(send, pairs, args.threads, args.messages)
+        ms = [v * 1000 for v in latencies]
+        print(f'{name:<8} {percentile(ms, 50):>7.3f}мс {percentile(ms, 95):>7.3f}мс '
+              f'{percentile(ms, 99):>7.3f}мс {max(ms):>7.3f}мс {len(ms) / elapsed:>9.0f}')
+
+    message_writer.stop()
+    tmp.cleanup()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,162 @@
+"""Ёмкость и задержка realtime-слоя в разных SOCKETIO_ASYNC_MODE.
+
+Для каждого режима поднимает сервер (app.py) на временной БД, открывает
+--clients соединений Socket.IO и меряет: сколько соединений удалось открыть,
+время подключения, задержку ответа сервера под нагрузкой и память процесса.
+
+Запуск из каталога backend:
+
+    python benchmarks/socket_capacity.py --modes threading eventlet gevent --clients 2000
+
+Нужны python-socketio с asyncio-клиентом (aiohttp) и eventlet/gevent для
+соответствующих режимов. Для тысяч соединений поднимите лимит файлов: ulimit -n 65536.
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SERVER_CODE = '''
+import sys
+from app import app, socketio
+socketio.run(app, host='127.0.0.1', port=int(sys.argv[1]), allow_unsafe_werkzeug=True)
+'''
+
+
+def percentile(values, p):
+    if not values:
+        return 0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+def start_server(mode, port, db_path):
+    env = dict(os.environ, SOCKETIO_ASYNC_MODE=mode, DATABASE_PATH=db_path)
+    return subprocess.Popen(
+        [sys.executable, '-c', SERVER_CODE, str(port)], cwd=BACKEND_DIR, env=env,
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+
+
+def register_user(base_url, username, timeout=30):
+    """Ждёт, пока сервер поднимется, и возвращает JWT нового пользователя."""
+    body = json.dumps({'username': username, 'password': 'bench-pass', 'password2': 'bench-pass'}).encode()
+    deadline = time.time() + timeout
+    while True:
+        request = urllib.request.Request(
+            f'{base_url}/api/register', data=body, headers={'Content-Type': 'application/json'}
+        )
+        try:
+            with urllib.request.urlopen(request) as response:
+                return json.load(response)['token']
+        except (urllib.error.URLError, ConnectionError):
+            if time.time() > deadline:
+                raise
+            time.sleep(0.2)
+
+
+def rss_mb(pid):
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return 0
+
+
+async def load(base_url, token, clients_count, rounds, concurrency):
+    import socketio
+
+    connect_times, latencies = [], []
+    gate = asyncio.Semaphore(concurrency)
+
+    async def connect_one():
+        client = socketio.AsyncClient(reconnection=False)
+        async with gate:
+            started = time.perf_counter()
+            try:
+                await client.connect(base_url, auth={'token': token}, transports=['websocket'], wait_timeout=10)
+            except Exception:
+                return None
+            connect_times.append(time.perf_counter() - started)
+        return client
+
+    async def ping(client):
+        for _ in range(rounds):
+            started = time.perf_counter()
+            try:
+                await client.call('get_online_users', {'team_id': 0}, timeout=10)
+            except Exception:
+                continue
+            latencies.append(time.perf_counter() - started)
+
+    clients = [c for c in await asyncio.gather(*(connect_one() for _ in range(clients_count))) if c]
+    await asyncio.gather(*(ping(client) for client in clients))
+    return clients, connect_times, latencies
+
+
+async def close_all(clients):
+    await asyncio.gather(*(client.disconnect() for client in clients), return_exceptions=True)
+
+
+def bench_mode(mode, args, port):
+    db_path = os.path.join(tempfile.mkdtemp(), 'bench.db')
+    base_url = f'http://127.0.0.1:{port}'
+    server = start_server(mode, port, db_path)
+    try:
+        token = register_user(base_url, f'bench_{mode}')
+        idle_rss = rss_mb(server.pid)
+        clients, connect_times, latencies = asyncio.run(
+            load(base_url, token, args.clients, args.rounds, args.connect_concurrency)
+        )
+        loaded_rss = rss_mb(server.pid)
+        asyncio.run(close_all(clients))
+    finally:
+        server.terminate()
+        server.wait(timeout=10)
+
+    return {
+        'mode': mode,
+        'connected': len(clients),
+        'connect_p50_ms': percentile(connect_times, 50) * 1000,
+        'connect_p95_ms': percentile(connect_times, 95) * 1000,
+        'rtt_p50_ms': percentile(latencies, 50) * 1000,
+        'rtt_p95_ms': percentile(latencies, 95) * 1000,
+        'rtt_p99_ms': percentile(latencies, 99) * 1000,
+        'rss_idle_mb': idle_rss,
+        'rss_loaded_mb': loaded_rss,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--modes', nargs='+', default=['threading', 'eventlet'])
+    parser.add_argument('--clients', type=int, default=1000, help='сколько соединений открыть')
+    parser.add_argument('--rounds', type=int, default=5, help='сколько запросов отправляет каждый клиент')
+    parser.add_argument('--connect-concurrency', type=int, default=200, help='одновременных подключений')
+    parser.add_argument('--port', type=int, default=5055)
+    args = parser.parse_args()
+
+    results = [bench_mode(mode, args, args.port + i) for i, mode in enumerate(args.modes)]
+
+    print(f'Клиентов: {args.clients}, запросов на клиента: {args.rounds}')
+    print(f'{"режим":<10} {"подключено":>10} {"conn p50":>9} {"conn p95":>9} '
+          f'{"rtt p50":>8} {"rtt p95":>8} {"rtt p99":>8} {"RSS, МБ":>14}')
+    for r in results:
+        print(f'{r["mode"]:<10} {r["connected"]:>10} {r["connect_p50_ms"]:>7.1f}мс {r["connect_p95_ms"]:>7.1f}мс '
+              f'{r["rtt_p50_ms"]:>6.1f}мс {r["rtt_p95_ms"]:>6.1f}мс {r["rtt_p99_ms"]:>6.1f}мс '
+              f'{r["rss_idle_mb"]:>6.0f} → {r["rss_loaded_mb"]:<5.0f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+"""Размер и стоимость кодирования элементов доски: JSON против stroke_codec.
+
+Берёт записанные штрихи из журнала досок (--db, таблицы whiteboard_ops и
+whiteboard_data) или, если БД не указана, генерирует штрихи, похожие на
+рисование мышью. Печатает средний размер элемента, размер после deflate
+(как с permessage-deflate) и время кодирования и разбора на элемент.
+
+Запуск из каталога backend:
+
+    python benchmarks/stroke_codec.py --db messenger.db
+    python benchmarks/stroke_codec.py --strokes 5000
+"""
+import argparse
+import json
+import math
+import os
+import random
+import sqlite3
+import sys
+import time
+import zlib
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+from stroke_codec import decode_element, encode_element  # noqa: E402
+
+
+def load_recorded(db_path, limit):
+    conn = sqlite3.connect(db_path)
+    elements = []
+    for (data,) in conn.execute('SELECT data FROM whiteboard_data'):
+        elements += json.loads(data).get('elements', [])
+    for (element,) in conn.execute('SELECT element FROM whiteboard_ops WHERE element IS NOT NULL'):
+        elements.append(decode_element(element) if isinstance(element, bytes) else json.loads(element))
+    conn.close()
+    return elements[:limit]
+
+
+def synthetic_stroke(rng, i):
+    """Штрих пера: точки mousemove с шагом в несколько пикселей и дробными координатами."""
+    x, y = rng.uniform(0, 2000), rng.uniform(0, 1200)
+    angle = rng.uniform(0, 2 * math.pi)
+    points = []
+    for _ in range(rng.randint(20, 400)):
+        angle += rng.gauss(0, 0.3)
+        step = rng.uniform(1, 8)
+        # getMousePos масштабирует координаты — в JSON они дробные
+        x += math.cos(angle) * step * 1.0837
+        y += math.sin(angle) * step * 1.0837
+        points.append({'x': x, 'y': y})
+    return {
+        'id': f'{i:032x}', 'type': 'path', 'tool': 'pen',
+        'color': '#000000', 'lineWidth': 2, 'points': points,
+    }
+
+
+def measure(name, encode, decode, elements):
+    started = time.perf_counter()
+    encoded = [encode(e) for e in elements]
+    encode_time = time.perf_counter() - started
+    started = time.perf_counter()
+    for data in encoded:
+        decode(data)
+    decode_time = time.perf_counter() - started
+
+    sizes = [len(data) for data in encoded]
+    deflated = [len(zlib.compress(data)) for data in encoded]
+    return {
+        'name': name,
+        'avg': sum(sizes) / len(sizes),
+        'avg_deflate': sum(deflated) / len(deflated),
+        'total': sum(sizes),
+        'encode_us': encode_time / len(elements) * 1e6,
+        'decode_us': decode_time / len(elements) * 1e6,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--db', help='БД с записанными досками (по умолчанию — синтетические штрихи)')
+    parser.add_argument('--strokes', type=int, default=2000, help='сколько элементов взять')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    if args.db:
+        elements = load_recorded(args.db, args.strokes)
+        source = args.db
+    else:
+        rng = random.Random(args.seed)
+        elements = [synthetic_stroke(rng, i) for i in range(args.strokes)]
+        source = 'синтетические штрихи'
+    if not elements:
+        sys.exit('Нет элементов для замера')
+
+    points = sum(len(e.get('points') or ()) for e in elements)
+    print(f'Источник: {source}, элементов: {len(elements)}, точек: {points}')
+
+    results = [
+        measure('json', lambda e: json.dumps(e).encode(), json.loads, elements),
+        measure('binary', encode_element, decode_element, elements),
+    ]
+    try:
+        import msgpack
+        results.append(measure('msgpack', msgpack.packb, msgpack.unpackb, elements))
+    except ImportError:
+        pass
+
+    base = results[0]['total']
+    print(f'{"формат":<8} {"байт/элем":>10} {"deflate":>9} {"от JSON":>8} {"encode":>10} {"decode":>10}')
+    for r in results:
+        print(f'{r["name"]:<8} {r["avg"]:>10.0f} {r["avg_deflate"]:>9.0f} {r["total"] / base:>7.1%} '
+              f'{r["encode_us"]:>8.1f}мкс {r["decode_us"]:>8.1f}мкс')
+
+
+if __name__ == '__main__':
+    main()
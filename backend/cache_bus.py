@@ -0,0 +1,91 @@
+import json
+import pickle
+import threading
+import time
+import uuid
+
+from sockets.pubsub import SOCKETIO_MESSAGE_QUEUE, create_pubsub_manager
+
+# Отдельный канал в той же очереди, что и события Socket.IO
+CACHE_BUS_CHANNEL = 'cache-invalidation'
+
+
+def _decode(message):
+    if isinstance(message, dict):
+        return message
+    if isinstance(message, str):
+        message = message.encode()
+    try:
+        return pickle.loads(message)
+    except Exception:
+        return json.loads(message)
+
+
+class CacheBus:
+    """Рассылает инвалидацию кешей процесса (user_cache, membership_cache) всем воркерам.
+
+    Кеши решают, авторизован ли запрос, поэтому сброс на одном воркере должен
+    дойти до остальных, а не ждать TTL. Без SOCKETIO_MESSAGE_QUEUE воркер один
+    и сброс только локальный. С очередью сброс публикуется в канал
+    CACHE_BUS_CHANNEL, а фоновая задача каждого воркера применяет чужие.
+    Пока слушатель (пере)подключается, кеши сбрасываются целиком: пропущенную
+    инвалидацию уже не восстановить.
+
+    Зарегистрированный кеш реализует _drop(*args) и _drop_all(). Тем же путём
+    sockets.chat_rooms рассылает перевод сокетов по комнатам чатов.
+    """
+
+    def __init__(self, url=SOCKETIO_MESSAGE_QUEUE, channel=CACHE_BUS_CHANNEL):
+        self.url = url
+        self.channel = channel
+        self.origin = uuid.uuid4().hex
+        self._caches = {}
+        self._manager = None
+        self._lock = threading.Lock()
+        self._started = False
+
+    def register(self, name, cache):
+        self._caches[name] = cache
+
+    def publish(self, name, *args):
+        """Сбрасывает записи кеша name здесь и на всех воркерах; без args — кеш целиком."""
+        self._apply(name, args)
+        if self.url:
+            self._get_manager()._publish({'origin': self.origin, 'cache': name, 'args': list(args)})
+
+    def start(self, socketio):
+        if self.url and not self._started:
+            self._started = True
+            socketio.start_background_task(self._run, socketio)
+
+    def _get_manager(self):
+        with self._lock:
+            if self._manager is None:
+                self._manager = create_pubsub_manager(self.url, self.channel)
+            return self._manager
+
+    def _apply(self, name, args):
+        cache = self._caches[name]
+        if args:
+            cache._drop(*args)
+        else:
+            cache._drop_all()
+
+    def _run(self, socketio):
+        while True:
+            try:
+                listener = self._get_manager()._listen()
+                for cache in self._caches.values():
+                    cache._drop_all()
+                for message in listener:
+                    data = _decode(message)
+                    if data.get('origin') != self.origin and data.get('cache') in self._caches:
+                        self._apply(data['cache'], data['args'])
+            except Exception:
+                # Очередь недоступна — повторяем; кеши сбросятся при переподключении
+                with self._lock:
+                    self._manager = None
+                socketio.sleep(1)
+
+
+cache_bus = CacheBus()
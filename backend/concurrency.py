@@ -0,0 +1,41 @@
+import os
+
+# Модель конкурентности realtime-слоя: threading — поток ОС на соединение,
+# eventlet / gevent — кооперативные green-потоки (тысячи соединений на процесс)
+SOCKETIO_ASYNC_MODE = os.environ.get('SOCKETIO_ASYNC_MODE', 'threading')
+
+if SOCKETIO_ASYNC_MODE not in ('threading', 'eventlet', 'gevent'):
+    raise ValueError(f'Unknown SOCKETIO_ASYNC_MODE: {SOCKETIO_ASYNC_MODE}')
+
+
+def is_green():
+    return SOCKETIO_ASYNC_MODE != 'threading'
+
+
+def monkey_patch():
+    """Патчит стандартную библиотеку под eventlet/gevent.
+
+    Вызывается первой строкой app.py, до импорта Flask и наших модулей:
+    threading.Lock/local, queue и socket после этого кооперативные, так что
+    пул соединений, MessageWriter и ReadCursorBuffer работают без изменений.
+    """
+    if SOCKETIO_ASYNC_MODE == 'eventlet':
+        import eventlet
+        eventlet.monkey_patch()
+    elif SOCKETIO_ASYNC_MODE == 'gevent':
+        from gevent import monkey
+        monkey.patch_all()
+
+
+def run_in_threadpool(fn, *args, **kwargs):
+    """Выполняет блокирующий вызов в пуле потоков ОС, не останавливая цикл событий.
+
+    В режиме threading вызывает fn напрямую.
+    """
+    if SOCKETIO_ASYNC_MODE == 'eventlet':
+        from eventlet import tpool
+        return tpool.execute(fn, *args, **kwargs)
+    if SOCKETIO_ASYNC_MODE == 'gevent':
+        import gevent
+        return gevent.get_hub().threadpool.apply(fn, args, kwargs)
+    return fn(*args, **kwargs)
@@ -1,252 +1,186 @@
 import sqlite3
 import os
-from werkzeug.security import generate_password_hash
+import queue
+import threading
+from contextlib import contextmanager
+
+from concurrency import is_green, run_in_threadpool
 
 # Всегда используем путь относительно этого файла, независимо от рабочей директории
-DATABASE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'messenger.db')
+DATABASE = os.environ.get('DATABASE_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'messenger.db'))
 
 # Данные суперадмина — единственное место, где задаются логин/пароль
 SUPERADMIN_USERNAME = 'admin'
 SUPERADMIN_PASSWORD = 'admin123'
 
-def get_db():
-    conn = sqlite3.connect(DATABASE)
+# Настройки пула соединений (можно переопределить переменными окружения)
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 16))
+DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', 30))
+DB_BUSY_TIMEOUT_MS = int(os.environ.get('DB_BUSY_TIMEOUT_MS', 5000))
+DB_CACHE_SIZE_KB = int(os.environ.get('DB_CACHE_SIZE_KB', 16384))
+DB_MMAP_SIZE = int(os.environ.get('DB_MMAP_SIZE', 64 * 1024 * 1024))
+
+
+def _connect(path):
+    conn = sqlite3.connect(path, timeout=DB_BUSY_TIMEOUT_MS / 1000, check_same_thread=False)
     conn.row_factory = sqlite3.Row
-    conn.execute("PRAGMA foreign_keys = ON")
+    # WAL: читатели не блокируют писателя, а fsync нужен только на checkpoint
+    conn.execute('PRAGMA journal_mode = WAL')
+    conn.execute('PRAGMA synchronous = NORMAL')
+    conn.execute(f'PRAGMA busy_timeout = {DB_BUSY_TIMEOUT_MS}')
+    conn.execute(f'PRAGMA cache_size = -{DB_CACHE_SIZE_KB}')
+    conn.execute(f'PRAGMA mmap_size = {DB_MMAP_SIZE}')
+    conn.execute('PRAGMA foreign_keys = ON')
     return conn
 
-def init_db():
-    with get_db() as conn:
-        # Таблица пользователей
-        conn.execute('''
-            CREATE TABLE IF NOT EXISTS users (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                username TEXT UNIQUE NOT NULL,
-                password_hash TEXT NOT NULL,
-                avatar TEXT,
-                bio TEXT DEFAULT 'Добавьте описание о себе',
-                last_seen TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-
-        # Добавление новых полей в users, если их нет
+
+class _OffloadedCursor:
+    """Курсор, у которого чтение строк выполняется в пуле потоков ОС."""
+
+    __slots__ = ('_cursor',)
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def fetchone(self):
+        return run_in_threadpool(self._cursor.fetchone)
+
+    def fetchall(self):
+        return run_in_threadpool(self._cursor.fetchall)
+
+    def fetchmany(self, size=1):
+        return run_in_threadpool(self._cursor.fetchmany, size)
+
+    def __iter__(self):
+        # Одна передача в пул вместо передачи на каждую строку
+        return iter(self.fetchall())
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+class _OffloadedConnection:
+    """Соединение для eventlet/gevent: каждый вызов SQLite уходит в пул потоков ОС.
+
+    Запрос, ждущий диск или блокировку, не останавливает цикл событий,
+    а код маршрутов (`with get_db() as conn: conn.execute(...)`) не меняется.
+    """
+
+    __slots__ = ('_conn',)
+
+    def __init__(self, conn):
+        self._conn = conn
+
+    def execute(self, *args):
+        return _OffloadedCursor(run_in_threadpool(self._conn.execute, *args))
+
+    def executemany(self, *args):
+        return _OffloadedCursor(run_in_threadpool(self._conn.executemany, *args))
+
+    def executescript(self, sql):
+        return _OffloadedCursor(run_in_threadpool(self._conn.executescript, sql))
+
+    def commit(self):
+        run_in_threadpool(self._conn.commit)
+
+    def rollback(self):
+        run_in_threadpool(self._conn.rollback)
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+
+class ConnectionPool:
+    """Пул соединений SQLite.
+
+    Поток держит не больше одного соединения: вложенные get_db() в том же
+    потоке (get_current_user() внутри маршрута и т.п.) получают то же самое.
+    В режимах eventlet/gevent threading.local после monkey_patch привязан
+    к green-потоку, поэтому это правило действует для каждого green-потока,
+    а сами вызовы SQLite выполняются в пуле потоков ОС (_OffloadedConnection).
+    connect — фабрика соединений: вспомогательные БД (присутствие, очередь
+    событий) открывают файл со своими PRAGMA, но берут соединения так же.
+    """
+
+    def __init__(self, path, size=DB_POOL_SIZE, timeout=DB_POOL_TIMEOUT, offload=None, connect=_connect):
+        self.path = path
+        self.connect = connect
+        self.size = size
+        self.timeout = timeout
+        self.offload = is_green() if offload is None else offload
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+        self._local = threading.local()
+
+    @contextmanager
+    def connection(self):
+        local = self._local
+        conn = getattr(local, 'conn', None)
+        if conn is not None:
+            yield conn
+            return
+
+        conn = self._acquire()
+        handle = _OffloadedConnection(conn) if self.offload else conn
+        local.conn = handle
         try:
-            conn.execute('ALTER TABLE users ADD COLUMN avatar TEXT')
-        except sqlite3.OperationalError:
-            pass
+            # Семантика как у `with sqlite3.connect(...)`: commit или rollback на выходе
+            try:
+                yield handle
+            except BaseException:
+                handle.rollback()
+                raise
+            handle.commit()
+        finally:
+            local.conn = None
+            self._release(conn)
+
+    def _acquire(self):
+        if not self._slots.acquire(timeout=self.timeout):
+            raise sqlite3.OperationalError('database connection pool exhausted')
         try:
-            conn.execute('ALTER TABLE users ADD COLUMN bio TEXT DEFAULT "Добавьте описание о себе"')
-        except sqlite3.OperationalError:
+            return self._idle.get_nowait()
+        except queue.Empty:
             pass
         try:
-            conn.execute('ALTER TABLE users ADD COLUMN last_seen TIMESTAMP DEFAULT CURRENT_TIMESTAMP')
-        except sqlite3.OperationalError:
-            pass
+            return self.connect(self.path)
+        except Exception:
+            self._slots.release()
+            raise
 
-        # Таблица чатов
-        conn.execute('''
-            CREATE TABLE IF NOT EXISTS chats (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                name TEXT NOT NULL,
-                type TEXT NOT NULL,
-                created_by INTEGER NOT NULL,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (created_by) REFERENCES users(id)
-            )
-        ''')
-
-        # Таблица участников чата
-        conn.execute('''
-            CREATE TABLE IF NOT EXISTS chat_members (
-                chat_id INTEGER NOT NULL,
-                user_id INTEGER NOT NULL,
-                joined_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                role TEXT DEFAULT 'member',
-                PRIMARY KEY (chat_id, user_id),
-                FOREIGN KEY (chat_id) REFERENCES chats(id) ON DELETE CASCADE,
-                FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
-            )
-        ''')
-
-        # Таблица сообщений
-        conn.execute('''
-            CREATE TABLE IF NOT EXISTS messages (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                chat_id INTEGER NOT NULL,
-                user_id INTEGER NOT NULL,
-                content TEXT NOT NULL,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                is_deleted BOOLEAN DEFAULT 0,
-                FOREIGN KEY (chat_id) REFERENCES chats(id) ON DELETE CASCADE,
-                FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
-            )
-        ''')
-
-        # Таблицы для команд
-        conn.execute('''
-            CREATE TABLE IF NOT EXISTS teams (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                name TEXT NOT NULL,
-                description TEXT,
-                is_private INTEGER DEFAULT 0,
-                avatar TEXT,
-                created_by INTEGER NOT NULL,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                chat_id INTEGER,
-                FOREIGN KEY (created_by) REFERENCES users(id),
-                FOREIGN KEY (chat_id) REFERENCES chats(id) ON DELETE SET NULL
-            )
-        ''')
-
-        # Добавление поля chat_id в teams, если его нет
-        try:
-            conn.execute('ALTER TABLE teams ADD COLUMN chat_id INTEGER')
-        except sqlite3.OperationalError:
-            pass
+    def _release(self, conn):
+        if conn.in_transaction:
+            conn.rollback()
+        self._idle.put(conn)
+        self._slots.release()
 
-        conn.execute('''
-            CREATE TABLE IF NOT EXISTS team_members (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                team_id INTEGER NOT NULL,
-                user_id INTEGER NOT NULL,
-                joined_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                UNIQUE(team_id, user_id),
-                FOREIGN KEY (team_id) REFERENCES teams(id) ON DELETE CASCADE,
-                FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
-            )
-        ''')
-
-        conn.execute('''
-            CREATE TABLE IF NOT EXISTS team_roles (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                team_id INTEGER NOT NULL,
-                user_id INTEGER NOT NULL,
-                role_name TEXT NOT NULL,
-                assigned_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (team_id) REFERENCES teams(id) ON DELETE CASCADE,
-                FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
-            )
-        ''')
-
-        # ----- НОВЫЕ ТАБЛИЦЫ -----
-
-        # Таблица заявок на вступление (вместо устаревшей team_requests)
-        conn.execute('''
-            CREATE TABLE IF NOT EXISTS join_requests (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                team_id INTEGER NOT NULL,
-                user_id INTEGER NOT NULL,
-                status TEXT DEFAULT 'pending',
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (team_id) REFERENCES teams(id) ON DELETE CASCADE,
-                FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE,
-                UNIQUE(team_id, user_id)
-            )
-        ''')
-
-        # Индексы для производительности
-        conn.execute('CREATE INDEX IF NOT EXISTS idx_join_requests_team_id ON join_requests(team_id)')
-        conn.execute('CREATE INDEX IF NOT EXISTS idx_join_requests_user_id ON join_requests(user_id)')
-        conn.execute('CREATE INDEX IF NOT EXISTS idx_join_requests_status ON join_requests(status)')
-
-        # Таблица вайтбордов
-        conn.execute('''
-            CREATE TABLE IF NOT EXISTS whiteboards (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                team_id INTEGER NOT NULL,
-                name TEXT NOT NULL DEFAULT 'Whiteboard',
-                created_by INTEGER NOT NULL,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (team_id) REFERENCES teams(id) ON DELETE CASCADE,
-                FOREIGN KEY (created_by) REFERENCES users(id)
-            )
-        ''')
-
-        # Таблица данных вайтборда (версионность – храним последнюю запись)
-        conn.execute('''
-            CREATE TABLE IF NOT EXISTS whiteboard_data (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                whiteboard_id INTEGER NOT NULL,
-                data TEXT NOT NULL,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (whiteboard_id) REFERENCES whiteboards(id) ON DELETE CASCADE
-            )
-        ''')
-
-        # ⬇️ ТАБЛИЦЫ ДЛЯ POLLS (ГОЛОСОВАНИЯ)
-
-        # Таблица голосований
-        conn.execute('''
-            CREATE TABLE IF NOT EXISTS polls (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                team_id INTEGER NOT NULL,
-                question TEXT NOT NULL,
-                created_by INTEGER NOT NULL,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (team_id) REFERENCES teams(id) ON DELETE CASCADE,
-                FOREIGN KEY (created_by) REFERENCES users(id)
-            )
-        ''')
-
-        # Таблица опций голосования
-        conn.execute('''
-            CREATE TABLE IF NOT EXISTS poll_options (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                poll_id INTEGER NOT NULL,
-                text TEXT NOT NULL,
-                FOREIGN KEY (poll_id) REFERENCES polls(id) ON DELETE CASCADE
-            )
-        ''')
-
-        # Таблица голосов
-        conn.execute('''
-            CREATE TABLE IF NOT EXISTS poll_votes (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                poll_id INTEGER NOT NULL,
-                option_id INTEGER NOT NULL,
-                user_id INTEGER NOT NULL,
-                voted_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (poll_id) REFERENCES polls(id) ON DELETE CASCADE,
-                FOREIGN KEY (option_id) REFERENCES poll_options(id) ON DELETE CASCADE,
-                FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE,
-                UNIQUE(poll_id, user_id)
-            )
-        ''')
-
-        # Добавление поля active_poll_id в teams, если его нет
-        try:
-            conn.execute('ALTER TABLE teams ADD COLUMN active_poll_id INTEGER REFERENCES polls(id)')
-        except sqlite3.OperationalError:
-            pass
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
 
-        # Удаляем устаревшую таблицу team_requests, если она существует
-        conn.execute('DROP TABLE IF EXISTS team_requests')
 
-        # Добавление поля is_site_admin в users, если его нет
-        try:
-            conn.execute('ALTER TABLE users ADD COLUMN is_site_admin INTEGER DEFAULT 0')
-        except sqlite3.OperationalError:
-            pass
+_pool = ConnectionPool(DATABASE)
+
+
+def configure_pool(path=None, size=None):
+    """Пересоздаёт пул (другой файл БД или размер). Старые простаивающие соединения закрываются."""
+    global _pool
+    old = _pool
+    _pool = ConnectionPool(path or old.path, size or old.size)
+    old.close()
+
 
-        # Создаём суперадмина при первом запуске (или восстанавливаем статус)
-        existing = conn.execute(
-            'SELECT id FROM users WHERE username = ?', (SUPERADMIN_USERNAME,)
-        ).fetchone()
-        if existing:
-            conn.execute(
-                'UPDATE users SET is_site_admin = 1 WHERE username = ?',
-                (SUPERADMIN_USERNAME,)
-            )
-        else:
-            conn.execute(
-                'INSERT INTO users (username, password_hash, bio, is_site_admin) VALUES (?, ?, ?, ?)',
-                (SUPERADMIN_USERNAME, generate_password_hash(SUPERADMIN_PASSWORD),
-                 'Суперадминистратор сайта', 1)
-            )
-
-        conn.commit()
\ No newline at end of file
+def get_db():
+    """Контекстный менеджер: `with get_db() as conn:` выдаёт соединение из пула."""
+    return _pool.connection()
+
+
+def init_db():
+    # Импорт здесь, а не наверху: migrations сам импортирует константы из этого модуля
+    from migrations import migrate
+
+    with get_db() as conn:
+        migrate(conn)
@@ -0,0 +1,105 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from cache_bus import cache_bus
+from database import get_db
+
+# Сколько пар (чат, пользователь) держать в памяти и сколько секунд запись считается свежей
+MEMBERSHIP_CACHE_SIZE = int(os.environ.get('MEMBERSHIP_CACHE_SIZE', 65536))
+MEMBERSHIP_CACHE_TTL = float(os.environ.get('MEMBERSHIP_CACHE_TTL', 30))
+
+_MEMBER_SQL = '''
+    SELECT t.id AS team_id
+    FROM chat_members cm
+    LEFT JOIN teams t ON t.chat_id = cm.chat_id
+    WHERE cm.chat_id = ? AND cm.user_id = ?
+'''
+
+_NOT_MEMBER = object()
+
+
+class ChatMembershipCache:
+    """LRU-кеш участия в чатах: (chat_id, user_id) -> team_id чата или «не участник».
+
+    send_message проверяет участие на каждое сообщение; кеш убирает этот
+    запрос из горячего пути. Маршруты, меняющие chat_members, обязаны вызвать
+    invalidate() (это делает sockets.chat_rooms.update_chat_rooms). Это проверка
+    прав, поэтому сброс уходит всем воркерам через cache_bus: исключённый из
+    чата сразу теряет возможность писать в него и через соседние воркеры.
+    """
+
+    def __init__(self, size=MEMBERSHIP_CACHE_SIZE, ttl=MEMBERSHIP_CACHE_TTL):
+        self.size = size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        # Растёт при каждой инвалидации: значение, прочитанное из БД до неё, в кеш не попадает
+        self._generation = 0
+        self._hits = 0
+        self._misses = 0
+
+    def get(self, chat_id, user_id):
+        """(участник ли, team_id чата или None)."""
+        key = (int(chat_id), int(user_id))
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[0] > now:
+                self._entries.move_to_end(key)
+                self._hits += 1
+                return entry[1] is not _NOT_MEMBER, (None if entry[1] is _NOT_MEMBER else entry[1])
+            self._misses += 1
+            generation = self._generation
+
+        with get_db() as conn:
+            row = conn.execute(_MEMBER_SQL, key).fetchone()
+        value = row['team_id'] if row else _NOT_MEMBER
+
+        with self._lock:
+            if generation == self._generation:
+                self._entries[key] = (now + self.ttl, value)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.size:
+                    self._entries.popitem(last=False)
+        return row is not None, (row['team_id'] if row else None)
+
+    def invalidate(self, chat_id, user_ids=None):
+        """Сбрасывает записи чата: указанных пользователей или всех (чат удалён)."""
+        if user_ids is not None:
+            user_ids = [int(user_id) for user_id in user_ids]
+        cache_bus.publish('membership_cache', int(chat_id), user_ids)
+
+    def clear(self):
+        cache_bus.publish('membership_cache')
+
+    def _drop(self, chat_id, user_ids):
+        with self._lock:
+            if user_ids is None:
+                for key in [k for k in self._entries if k[0] == chat_id]:
+                    del self._entries[key]
+            else:
+                for user_id in user_ids:
+                    self._entries.pop((chat_id, user_id), None)
+            self._generation += 1
+
+    def _drop_all(self):
+        with self._lock:
+            self._entries.clear()
+            self._generation += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                'size': len(self._entries),
+                'capacity': self.size,
+                'hits': self._hits,
+                'misses': self._misses,
+                'hit_rate': round(self._hits / lookups, 4) if lookups else 0,
+            }
+
+
+membership_cache = ChatMembershipCache()
+cache_bus.register('membership_cache', membership_cache)
@@ -0,0 +1,200 @@
+import atexit
+import os
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+
+from database import get_db
+
+# Сколько строк максимум в одной транзакции и сколько ждать добора пачки
+MESSAGE_WRITER_BATCH_SIZE = int(os.environ.get('MESSAGE_WRITER_BATCH_SIZE', 256))
+MESSAGE_WRITER_MAX_DELAY_MS = float(os.environ.get('MESSAGE_WRITER_MAX_DELAY_MS', 2))
+# Сколько секунд insert() ждёт commit, прежде чем сдаться с MessageWriterUnavailable
+MESSAGE_WRITER_TIMEOUT = float(os.environ.get('MESSAGE_WRITER_TIMEOUT', 10))
+
+# RETURNING отдаёт id и created_at той же командой — перечитывать строку после вставки не нужно
+_INSERT_SQL = 'INSERT INTO messages (chat_id, user_id, content) VALUES (?, ?, ?) RETURNING id, created_at'
+_STOP = object()
+
+
+class MessageWriterUnavailable(Exception):
+    """Сообщение не записано: пачка упала целиком (например, пул соединений исчерпан) или истёк таймаут."""
+
+
+class MessageRejected(Exception):
+    """БД отвергла само сообщение (например, чат удалён после проверки участия); повтор не поможет."""
+
+
+class _PendingMessage:
+    __slots__ = ('params', 'future', 'enqueued_at')
+
+    def __init__(self, params):
+        self.params = params
+        self.future = Future()
+        self.enqueued_at = time.monotonic()
+
+
+class MessageWriter:
+    """Единственный поток, который пишет сообщения в SQLite.
+
+    Вставки из REST и сокетов складываются в очередь; поток забирает всё, что
+    накопилось (до batch_size строк или max_delay_ms ожидания), и записывает
+    пачку одной транзакцией. Future вызывающего резолвится парой
+    (id, created_at) только после commit, поэтому гарантии сохранности те же, что при commit на каждую строку.
+    """
+
+    def __init__(self, batch_size=MESSAGE_WRITER_BATCH_SIZE, max_delay_ms=MESSAGE_WRITER_MAX_DELAY_MS):
+        self.batch_size = batch_size
+        self.max_delay = max_delay_ms / 1000
+        self._queue = queue.Queue()
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._batches = 0
+        self._rows = 0
+        self._failed = 0
+        self._max_batch = 0
+        self._latency_total = 0.0
+        self._latency_max = 0.0
+
+    def start(self):
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='message-writer', daemon=True)
+                self._thread.start()
+
+    def stop(self, timeout=5):
+        """Дописывает очередь и останавливает поток."""
+        thread = self._thread
+        if thread is None or not thread.is_alive():
+            return
+        self._queue.put(_STOP)
+        thread.join(timeout)
+
+    def submit(self, chat_id, user_id, content):
+        """Ставит сообщение в очередь. Возвращает Future с (id, created_at)."""
+        if self._thread is None or not self._thread.is_alive():
+            self.start()
+        item = _PendingMessage((chat_id, user_id, content))
+        self._queue.put(item)
+        return item.future
+
+    def insert(self, chat_id, user_id, content, timeout=MESSAGE_WRITER_TIMEOUT):
+        """Блокирующий вариант submit(): ждёт commit и возвращает (id, created_at)."""
+        future = self.submit(chat_id, user_id, content)
+        try:
+            return future.result(timeout)
+        except FutureTimeoutError:
+            # Ещё в очереди — отменяем, и поток записи его пропустит: повтор клиента не создаст дубль.
+            # Уже забрано в пачку — отменить нельзя, дожидаемся её commit
+            if future.cancel():
+                raise MessageWriterUnavailable(f'message not committed within {timeout}s') from None
+            return future.result()
+
+    def stats(self):
+        with self._stats_lock:
+            return {
+                'batches': self._batches,
+                'rows': self._rows,
+                'failed': self._failed,
+                'queued': self._queue.qsize(),
+                'avg_batch_size': round(self._rows / self._batches, 2) if self._batches else 0,
+                'max_batch_size': self._max_batch,
+                'avg_latency_ms': round(self._latency_total / self._rows * 1000, 3) if self._rows else 0,
+                'max_latency_ms': round(self._latency_max * 1000, 3),
+            }
+
+    # ---- поток записи ----
+
+    def _run(self):
+        while True:
+            batch, stop = self._collect()
+            if batch:
+                try:
+                    self._write(batch)
+                except Exception as e:
+                    # Поток записи должен пережить любую ошибку, иначе все следующие insert() зависнут
+                    self._fail(batch, e)
+            if stop:
+                return
+
+    def _collect(self):
+        first = self._queue.get()
+        if first is _STOP:
+            return [], True
+
+        # Отменённые по таймауту insert() пропускаем; остальные с этого момента отменить нельзя
+        batch = [first] if first.future.set_running_or_notify_cancel() else []
+        deadline = time.monotonic() + self.max_delay
+        while len(batch) < self.batch_size:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+            if item is _STOP:
+                return batch, True
+            if item.future.set_running_or_notify_cancel():
+                batch.append(item)
+        return batch, False
+
+    def _write(self, batch):
+        with get_db() as conn:
+            try:
+                rows = [tuple(conn.execute(_INSERT_SQL, item.params).fetchone()) for item in batch]
+                conn.commit()
+            except sqlite3.Error:
+                # Одна плохая строка (например, чат уже удалён) не должна ронять всю пачку
+                conn.rollback()
+                self._write_one_by_one(conn, batch)
+                return
+
+        self._record(batch)
+        for item, row in zip(batch, rows):
+            item.future.set_result(row)
+
+    def _write_one_by_one(self, conn, batch):
+        written = []
+        for item in batch:
+            try:
+                row = tuple(conn.execute(_INSERT_SQL, item.params).fetchone())
+                conn.commit()
+            except sqlite3.Error as e:
+                conn.rollback()
+                with self._stats_lock:
+                    self._failed += 1
+                item.future.set_exception(MessageRejected(str(e)))
+                continue
+            written.append(item)
+            item.future.set_result(row)
+        if written:
+            self._record(written)
+
+    def _fail(self, batch, error):
+        failed = [item for item in batch if not item.future.done()]
+        with self._stats_lock:
+            self._failed += len(failed)
+        for item in failed:
+            item.future.set_exception(MessageWriterUnavailable(str(error)))
+
+    def _record(self, batch):
+        now = time.monotonic()
+        with self._stats_lock:
+            self._batches += 1
+            self._rows += len(batch)
+            self._max_batch = max(self._max_batch, len(batch))
+            for item in batch:
+                latency = now - item.enqueued_at
+                self._latency_total += latency
+                self._latency_max = max(self._latency_max, latency)
+
+
+message_writer = MessageWriter()
+atexit.register(message_writer.stop)
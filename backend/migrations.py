@@ -0,0 +1,537 @@
+import json
+import sqlite3
+import uuid
+
+from werkzeug.security import generate_password_hash
+
+from avatar_store import AvatarError, save_avatar
+from database import SUPERADMIN_USERNAME, SUPERADMIN_PASSWORD
+
+
+# Миграции схемы. Текущая версия хранится в PRAGMA user_version; каждая
+# миграция выполняется ровно один раз, в своей транзакции. Новые изменения
+# схемы добавляются только новым шагом в конец MIGRATIONS — уже выпущенные
+# шаги не редактируются.
+
+
+def _initial_schema(conn):
+    # Таблица пользователей
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT UNIQUE NOT NULL,
+            password_hash TEXT NOT NULL,
+            avatar TEXT,
+            bio TEXT DEFAULT 'Добавьте описание о себе',
+            last_seen TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+    # Добавление новых полей в users, если их нет
+    try:
+        conn.execute('ALTER TABLE users ADD COLUMN avatar TEXT')
+    except sqlite3.OperationalError:
+        pass
+    try:
+        conn.execute('ALTER TABLE users ADD COLUMN bio TEXT DEFAULT "Добавьте описание о себе"')
+    except sqlite3.OperationalError:
+        pass
+    try:
+        conn.execute('ALTER TABLE users ADD COLUMN last_seen TIMESTAMP DEFAULT CURRENT_TIMESTAMP')
+    except sqlite3.OperationalError:
+        pass
+
+    # Таблица чатов
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS chats (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            type TEXT NOT NULL,
+            created_by INTEGER NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (created_by) REFERENCES users(id)
+        )
+    ''')
+
+    # Таблица участников чата
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS chat_members (
+            chat_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            joined_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            role TEXT DEFAULT 'member',
+            PRIMARY KEY (chat_id, user_id),
+            FOREIGN KEY (chat_id) REFERENCES chats(id) ON DELETE CASCADE,
+            FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
+        )
+    ''')
+
+    # Таблица сообщений
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS messages (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            chat_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            content TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            is_deleted BOOLEAN DEFAULT 0,
+            FOREIGN KEY (chat_id) REFERENCES chats(id) ON DELETE CASCADE,
+            FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
+        )
+    ''')
+
+    # Таблицы для команд
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS teams (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            description TEXT,
+            is_private INTEGER DEFAULT 0,
+            avatar TEXT,
+            created_by INTEGER NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            chat_id INTEGER,
+            FOREIGN KEY (created_by) REFERENCES users(id),
+            FOREIGN KEY (chat_id) REFERENCES chats(id) ON DELETE SET NULL
+        )
+    ''')
+
+    # Добавление поля chat_id в teams, если его нет
+    try:
+        conn.execute('ALTER TABLE teams ADD COLUMN chat_id INTEGER')
+    except sqlite3.OperationalError:
+        pass
+
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS team_members (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            team_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            joined_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            UNIQUE(team_id, user_id),
+            FOREIGN KEY (team_id) REFERENCES teams(id) ON DELETE CASCADE,
+            FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
+        )
+    ''')
+
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS team_roles (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            team_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            role_name TEXT NOT NULL,
+            assigned_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (team_id) REFERENCES teams(id) ON DELETE CASCADE,
+            FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
+        )
+    ''')
+
+    # ----- НОВЫЕ ТАБЛИЦЫ -----
+
+    # Таблица заявок на вступление (вместо устаревшей team_requests)
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS join_requests (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            team_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            status TEXT DEFAULT 'pending',
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (team_id) REFERENCES teams(id) ON DELETE CASCADE,
+            FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE,
+            UNIQUE(team_id, user_id)
+        )
+    ''')
+
+    # Индексы для производительности
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_join_requests_team_id ON join_requests(team_id)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_join_requests_user_id ON join_requests(user_id)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_join_requests_status ON join_requests(status)')
+
+    # Таблица вайтбордов
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS whiteboards (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            team_id INTEGER NOT NULL,
+            name TEXT NOT NULL DEFAULT 'Whiteboard',
+            created_by INTEGER NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (team_id) REFERENCES teams(id) ON DELETE CASCADE,
+            FOREIGN KEY (created_by) REFERENCES users(id)
+        )
+    ''')
+
+    # Таблица данных вайтборда (версионность – храним последнюю запись)
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS whiteboard_data (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            whiteboard_id INTEGER NOT NULL,
+            data TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (whiteboard_id) REFERENCES whiteboards(id) ON DELETE CASCADE
+        )
+    ''')
+
+    # ⬇️ ТАБЛИЦЫ ДЛЯ POLLS (ГОЛОСОВАНИЯ)
+
+    # Таблица голосований
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS polls (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            team_id INTEGER NOT NULL,
+            question TEXT NOT NULL,
+            created_by INTEGER NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (team_id) REFERENCES teams(id) ON DELETE CASCADE,
+            FOREIGN KEY (created_by) REFERENCES users(id)
+        )
+    ''')
+
+    # Таблица опций голосования
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS poll_options (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            poll_id INTEGER NOT NULL,
+            text TEXT NOT NULL,
+            FOREIGN KEY (poll_id) REFERENCES polls(id) ON DELETE CASCADE
+        )
+    ''')
+
+    # Таблица голосов
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS poll_votes (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            poll_id INTEGER NOT NULL,
+            option_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            voted_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (poll_id) REFERENCES polls(id) ON DELETE CASCADE,
+            FOREIGN KEY (option_id) REFERENCES poll_options(id) ON DELETE CASCADE,
+            FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE,
+            UNIQUE(poll_id, user_id)
+        )
+    ''')
+
+    # Добавление поля active_poll_id в teams, если его нет
+    try:
+        conn.execute('ALTER TABLE teams ADD COLUMN active_poll_id INTEGER REFERENCES polls(id)')
+    except sqlite3.OperationalError:
+        pass
+
+    # Удаляем устаревшую таблицу team_requests, если она существует
+    conn.execute('DROP TABLE IF EXISTS team_requests')
+
+    # Добавление поля is_site_admin в users, если его нет
+    try:
+        conn.execute('ALTER TABLE users ADD COLUMN is_site_admin INTEGER DEFAULT 0')
+    except sqlite3.OperationalError:
+        pass
+
+    # Создаём суперадмина при первом запуске (или восстанавливаем статус)
+    existing = conn.execute(
+        'SELECT id FROM users WHERE username = ?', (SUPERADMIN_USERNAME,)
+    ).fetchone()
+    if existing:
+        conn.execute(
+            'UPDATE users SET is_site_admin = 1 WHERE username = ?',
+            (SUPERADMIN_USERNAME,)
+        )
+    else:
+        conn.execute(
+            'INSERT INTO users (username, password_hash, bio, is_site_admin) VALUES (?, ?, ?, ?)',
+            (SUPERADMIN_USERNAME, generate_password_hash(SUPERADMIN_PASSWORD),
+             'Суперадминистратор сайта', 1)
+        )
+
+
+def _hot_query_indexes(conn):
+    # Индексы под горячие запросы маршрутов; проверяются tools/check_query_plans.py
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_messages_chat_created ON messages(chat_id, created_at)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_chat_members_user ON chat_members(user_id)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_team_members_user ON team_members(user_id)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_team_roles_team_user ON team_roles(team_id, user_id)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_poll_options_poll ON poll_options(poll_id)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_poll_votes_option ON poll_votes(option_id)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_whiteboards_team ON whiteboards(team_id)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_whiteboard_data_whiteboard ON whiteboard_data(whiteboard_id)')
+    # Дочерние ключи ON DELETE CASCADE: без них удаление пользователя сканирует таблицы целиком
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_messages_user ON messages(user_id)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_team_roles_user ON team_roles(user_id)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_poll_votes_user ON poll_votes(user_id)')
+
+
+def _messages_keyset_index(conn):
+    # (chat_id, id): постраничный поиск по первичному ключу внутри чата
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_messages_chat_id ON messages(chat_id, id)')
+
+
+def _messages_fulltext(conn):
+    # FTS5 с внешним содержимым: текст хранится только в messages, индекс
+    # синхронизируют триггеры. Удалённые (is_deleted = 1) сообщения в индекс не попадают
+    conn.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+            content,
+            content='messages',
+            content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2',
+            prefix='2 3'
+        )
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS messages_fts_insert AFTER INSERT ON messages
+        WHEN new.is_deleted = 0
+        BEGIN
+            INSERT INTO messages_fts(rowid, content) VALUES (new.id, new.content);
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS messages_fts_update AFTER UPDATE OF content, is_deleted ON messages
+        BEGIN
+            INSERT INTO messages_fts(messages_fts, rowid, content)
+                SELECT 'delete', old.id, old.content WHERE old.is_deleted = 0;
+            INSERT INTO messages_fts(rowid, content)
+                SELECT new.id, new.content WHERE new.is_deleted = 0;
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS messages_fts_delete AFTER DELETE ON messages
+        WHEN old.is_deleted = 0
+        BEGIN
+            INSERT INTO messages_fts(messages_fts, rowid, content) VALUES ('delete', old.id, old.content);
+        END
+    ''')
+    conn.execute(
+        'INSERT INTO messages_fts(rowid, content) SELECT id, content FROM messages WHERE is_deleted = 0'
+    )
+
+
+def _messages_updated_index(conn):
+    # Поиск правок и удалений при досинхронизации после переподключения
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_messages_chat_updated ON messages(chat_id, updated_at)')
+
+
+def _chat_stats(conn):
+    # Денормализованная сводка по чату для списка чатов. Поддерживается триггерами;
+    # message_count считает только неудалённые сообщения
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS chat_stats (
+            chat_id INTEGER PRIMARY KEY,
+            message_count INTEGER NOT NULL DEFAULT 0,
+            last_message_id INTEGER,
+            last_message_user_id INTEGER,
+            last_message_preview TEXT,
+            last_message_at TIMESTAMP,
+            last_activity_at TIMESTAMP,
+            FOREIGN KEY (chat_id) REFERENCES chats(id) ON DELETE CASCADE
+        )
+    ''')
+
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS chat_stats_chat_insert AFTER INSERT ON chats
+        BEGIN
+            INSERT OR IGNORE INTO chat_stats (chat_id, last_activity_at) VALUES (new.id, new.created_at);
+        END
+    ''')
+
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS chat_stats_message_insert AFTER INSERT ON messages
+        WHEN new.is_deleted = 0
+        BEGIN
+            INSERT INTO chat_stats (chat_id, message_count, last_message_id, last_message_user_id,
+                                    last_message_preview, last_message_at, last_activity_at)
+            VALUES (new.chat_id, 1, new.id, new.user_id, substr(new.content, 1, 100),
+                    new.created_at, new.created_at)
+            ON CONFLICT (chat_id) DO UPDATE SET
+                message_count = message_count + 1,
+                last_message_id = excluded.last_message_id,
+                last_message_user_id = excluded.last_message_user_id,
+                last_message_preview = excluded.last_message_preview,
+                last_message_at = excluded.last_message_at,
+                last_activity_at = excluded.last_activity_at;
+        END
+    ''')
+
+    # Последнее сообщение пересчитывается, только если затронуто оно само
+    # (или сообщение новее него) — поиск идёт по индексу (chat_id, id)
+    refresh_last = '''
+            UPDATE chat_stats
+            SET (last_message_id, last_message_user_id, last_message_preview, last_message_at) = (
+                SELECT id, user_id, substr(content, 1, 100), created_at
+                FROM messages
+                WHERE chat_id = {row}.chat_id AND is_deleted = 0
+                ORDER BY id DESC LIMIT 1
+            )
+            WHERE chat_id = {row}.chat_id
+              AND (last_message_id IS NULL OR {row}.id >= last_message_id);
+    '''
+
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS chat_stats_message_update AFTER UPDATE OF content, is_deleted ON messages
+        BEGIN
+            UPDATE chat_stats
+            SET message_count = message_count + (new.is_deleted = 0) - (old.is_deleted = 0),
+                last_activity_at = CURRENT_TIMESTAMP
+            WHERE chat_id = new.chat_id;
+    ''' + refresh_last.format(row='new') + '''
+        END
+    ''')
+
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS chat_stats_message_delete AFTER DELETE ON messages
+        BEGIN
+            UPDATE chat_stats
+            SET message_count = message_count - (old.is_deleted = 0)
+            WHERE chat_id = old.chat_id;
+    ''' + refresh_last.format(row='old') + '''
+        END
+    ''')
+
+    conn.execute('''
+        INSERT OR REPLACE INTO chat_stats (chat_id, message_count, last_message_id, last_message_user_id,
+                                           last_message_preview, last_message_at, last_activity_at)
+        SELECT c.id,
+               (SELECT COUNT(*) FROM messages WHERE chat_id = c.id AND is_deleted = 0),
+               lm.id, lm.user_id, substr(lm.content, 1, 100), lm.created_at,
+               COALESCE((SELECT MAX(updated_at) FROM messages WHERE chat_id = c.id), c.created_at)
+        FROM chats c
+        LEFT JOIN messages lm ON lm.id = (
+            SELECT id FROM messages WHERE chat_id = c.id AND is_deleted = 0 ORDER BY id DESC LIMIT 1
+        )
+    ''')
+
+
+def _read_cursors(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS chat_read_cursors (
+            chat_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            last_read_id INTEGER NOT NULL DEFAULT 0,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (chat_id, user_id),
+            FOREIGN KEY (chat_id) REFERENCES chats(id) ON DELETE CASCADE,
+            FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
+        ) WITHOUT ROWID
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_chat_read_cursors_user ON chat_read_cursors(user_id)')
+    # Частичный индекс только по живым сообщениям: непрочитанные считаются по нему без чтения таблицы
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_messages_chat_live ON messages(chat_id, id) WHERE is_deleted = 0
+    ''')
+    # Комната команды для рассылки read_receipts ищется по teams.chat_id
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_teams_chat ON teams(chat_id)')
+
+
+def _avatar_store(conn):
+    # Аватары переезжают из base64 в колонках в файловое хранилище (avatar_store);
+    # в БД остаётся только sha256. Битые картинки просто сбрасываются
+    for table in ('users', 'teams'):
+        conn.execute(f'ALTER TABLE {table} ADD COLUMN avatar_hash TEXT')
+        rows = conn.execute(
+            f"SELECT id, avatar FROM {table} WHERE avatar IS NOT NULL AND avatar != ''"
+        ).fetchall()
+        for row in rows:
+            try:
+                avatar_hash = save_avatar(row['avatar'])
+            except AvatarError:
+                avatar_hash = None
+            conn.execute(
+                f'UPDATE {table} SET avatar_hash = ?, avatar = NULL WHERE id = ?', (avatar_hash, row['id'])
+            )
+
+
+def _whiteboard_ops(conn):
+    # Доска хранится как снимок (whiteboard_data) + журнал операций после него
+    conn.execute('ALTER TABLE whiteboards ADD COLUMN version INTEGER NOT NULL DEFAULT 0')
+    conn.execute('ALTER TABLE whiteboard_data ADD COLUMN version INTEGER NOT NULL DEFAULT 0')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS whiteboard_ops (
+            whiteboard_id INTEGER NOT NULL,
+            version INTEGER NOT NULL,
+            op TEXT NOT NULL,
+            element_id TEXT,
+            element TEXT,
+            user_id INTEGER,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (whiteboard_id, version),
+            FOREIGN KEY (whiteboard_id) REFERENCES whiteboards(id) ON DELETE CASCADE
+        ) WITHOUT ROWID
+    ''')
+
+    # Старые версии кода копили по несколько снимков на доску — оставляем последний.
+    # Операциям update/delete нужны id элементов: выдаём их старым элементам
+    boards = conn.execute('''
+        SELECT whiteboard_id, MAX(id) AS id FROM whiteboard_data GROUP BY whiteboard_id
+    ''').fetchall()
+    for board in boards:
+        conn.execute(
+            'DELETE FROM whiteboard_data WHERE whiteboard_id = ? AND id != ?', (board['whiteboard_id'], board['id'])
+        )
+        row = conn.execute('SELECT data FROM whiteboard_data WHERE id = ?', (board['id'],)).fetchone()
+        try:
+            elements = json.loads(row['data']).get('elements') or []
+        except (ValueError, AttributeError):
+            elements = []
+        elements = [e for e in elements if isinstance(e, dict)]
+        for element in elements:
+            element.setdefault('id', uuid.uuid4().hex)
+        conn.execute(
+            'UPDATE whiteboard_data SET data = ? WHERE id = ?', (json.dumps({'elements': elements}), board['id'])
+        )
+
+    conn.execute('DROP INDEX IF EXISTS idx_whiteboard_data_whiteboard')
+    conn.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_whiteboard_data_board ON whiteboard_data(whiteboard_id)')
+
+
+def _owner_indexes(conn):
+    # Внешние ключи на users, teams и polls, которые раньше не проверялись (check_query_plans
+    # знал не все таблицы): удаление пользователя или команды сканировало их целиком
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_chats_created_by ON chats(created_by)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_teams_created_by ON teams(created_by)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_whiteboards_created_by ON whiteboards(created_by)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_polls_created_by ON polls(created_by)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_polls_team ON polls(team_id)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_teams_active_poll ON teams(active_poll_id)')
+
+
+MIGRATIONS = [
+    (1, _initial_schema),
+    (2, _hot_query_indexes),
+    (3, _messages_keyset_index),
+    (4, _messages_fulltext),
+    (5, _messages_updated_index),
+    (6, _chat_stats),
+    (7, _read_cursors),
+    (8, _avatar_store),
+    (9, _whiteboard_ops),
+    (10, _owner_indexes),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def get_version(conn):
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+
+def migrate(conn):
+    """Доводит схему до LATEST_VERSION. Для актуальной БД — одна проверка версии."""
+    if get_version(conn) >= LATEST_VERSION:
+        return
+
+    # IMMEDIATE берёт блокировку записи сразу: если несколько воркеров стартуют
+    # одновременно, миграции выполнит первый, остальные увидят новую версию
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        current = get_version(conn)
+        for version, step in MIGRATIONS:
+            if version > current:
+                step(conn)
+                conn.execute(f'PRAGMA user_version = {version}')
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
@@ -0,0 +1,122 @@
+import atexit
+import os
+import threading
+from collections import defaultdict
+
+from database import get_db
+
+# Как часто (в секундах) накопленные курсоры прочтения пишутся в БД
+READ_CURSOR_FLUSH_INTERVAL = float(os.environ.get('READ_CURSOR_FLUSH_INTERVAL', 3))
+
+_UPSERT_SQL = '''
+    INSERT INTO chat_read_cursors (chat_id, user_id, last_read_id, updated_at)
+    SELECT chat_id, user_id, ?, CURRENT_TIMESTAMP
+    FROM chat_members
+    WHERE chat_id = ? AND user_id = ?
+    ON CONFLICT (chat_id, user_id) DO UPDATE SET
+        last_read_id = MAX(last_read_id, excluded.last_read_id),
+        updated_at = excluded.updated_at
+    RETURNING last_read_id
+'''
+
+_socketio = None
+
+
+def init_socketio(socketio):
+    global _socketio
+    _socketio = socketio
+
+
+class ReadCursorBuffer:
+    """Копит продвижения курсоров прочтения в памяти и пишет их пачкой.
+
+    Пользователь, пролистывающий чат, шлёт mark_read на каждое сообщение;
+    в БД за один интервал попадает только максимальный id по каждой паре
+    (chat_id, user_id), и за тот же сброс рассылается одно событие
+    read_receipts на чат. Запись в чужой чат отсекается самим upsert
+    (строка вставляется только при наличии chat_members).
+    """
+
+    def __init__(self, flush_interval=READ_CURSOR_FLUSH_INTERVAL):
+        self.flush_interval = flush_interval
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def advance(self, chat_id, user_id, message_id):
+        key = (int(chat_id), int(user_id))
+        message_id = int(message_id)
+        with self._lock:
+            if message_id <= self._pending.get(key, 0):
+                return
+            self._pending[key] = message_id
+        if self._thread is None:
+            self.start()
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='read-cursors', daemon=True)
+                self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self.flush()
+
+    def flush(self, user_id=None):
+        """Пишет накопленные курсоры (все или только одного пользователя)."""
+        with self._lock:
+            if user_id is None:
+                entries, self._pending = self._pending, {}
+            else:
+                entries = {k: v for k, v in self._pending.items() if k[1] == user_id}
+                for key in entries:
+                    del self._pending[key]
+        if not entries:
+            return
+
+        saved = {}
+        try:
+            with get_db() as conn:
+                for (chat_id, uid), last_read_id in entries.items():
+                    # Пустой RETURNING: пользователь не состоит в чате — курсор не сохраняется и не рассылается
+                    row = conn.execute(_UPSERT_SQL, (last_read_id, chat_id, uid)).fetchone()
+                    if row:
+                        saved[(chat_id, uid)] = row['last_read_id']
+                conn.commit()
+        except Exception:
+            # Запись не удалась — возвращаем курсоры в буфер, их запишет следующий сброс
+            self._requeue(entries)
+            raise
+
+        if _socketio and saved:
+            self._broadcast(saved)
+
+    def _requeue(self, entries):
+        with self._lock:
+            for key, message_id in entries.items():
+                # Пока шла запись, курсор мог уйти дальше — оставляем больший id
+                if message_id > self._pending.get(key, 0):
+                    self._pending[key] = message_id
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception:
+                # Курсоры уже возвращены в буфер — следующий сброс попробует снова
+                pass
+
+    def _broadcast(self, entries):
+        receipts = defaultdict(list)
+        for (chat_id, user_id), last_read_id in entries.items():
+            receipts[chat_id].append({'user_id': user_id, 'last_read_id': last_read_id})
+
+        # В комнате chat_{id} только сокеты участников чата — ни команды, ни состав чата искать не нужно
+        for chat_id, chat_receipts in receipts.items():
+            _socketio.emit('read_receipts', {'chat_id': chat_id, 'receipts': chat_receipts}, room=f'chat_{chat_id}')
+
+
+read_cursors = ReadCursorBuffer()
+atexit.register(read_cursors.stop)
@@ -1,7 +1,14 @@
 from flask import Blueprint, request, jsonify
 from flask_jwt_extended import jwt_required
+from avatar_store import with_avatar_url
 from database import get_db
+from membership_cache import membership_cache
+from message_writer import message_writer
 from routes.auth import get_current_user
+from sockets.events import connected_users
+from sockets.sessions import sessions_stats
+from user_cache import user_cache
+from whiteboards import hot_boards
 
 admin_bp = Blueprint('admin', __name__, url_prefix='/api/admin')
 
@@ -32,10 +39,10 @@ def get_all_users():
 
     with get_db() as conn:
         users = conn.execute(
-            'SELECT id, username, avatar, bio, is_site_admin, last_seen, created_at FROM users ORDER BY created_at DESC'
+            'SELECT id, username, avatar_hash, bio, is_site_admin, last_seen, created_at FROM users ORDER BY created_at DESC'
         ).fetchall()
 
-    return jsonify({'users': [dict(u) for u in users]}), 200
+    return jsonify({'users': [with_avatar_url(u, thumb=True) for u in users]}), 200
 
 
 @admin_bp.route('/users/<int:user_id>/toggle-admin', methods=['PUT'])
@@ -55,6 +62,7 @@ def toggle_site_admin(user_id):
         new_status = 0 if user['is_site_admin'] else 1
         conn.execute('UPDATE users SET is_site_admin = ? WHERE id = ?', (new_status, user_id))
         conn.commit()
+    user_cache.invalidate(user_id)
 
     return jsonify({'message': 'Admin status updated', 'is_site_admin': bool(new_status)}), 200
 
@@ -81,6 +89,8 @@ def delete_user(user_id):
         conn.execute('DELETE FROM chats WHERE created_by = ?', (user_id,))
         conn.execute('DELETE FROM users WHERE id = ?', (user_id,))
         conn.commit()
+    user_cache.invalidate(user_id)
+    membership_cache.clear()
 
     return jsonify({'message': 'User deleted'}), 200
 
@@ -96,7 +106,7 @@ def get_all_teams():
 
     with get_db() as conn:
         teams = conn.execute('''
-            SELECT t.id, t.name, t.description, t.is_private, t.avatar,
+            SELECT t.id, t.name, t.description, t.is_private, t.avatar_hash,
                    t.created_at, u.username as creator_username,
                    (SELECT COUNT(*) FROM team_members WHERE team_id = t.id) as member_count
             FROM teams t
@@ -104,7 +114,7 @@ def get_all_teams():
             ORDER BY t.created_at DESC
         ''').fetchall()
 
-    return jsonify({'teams': [dict(t) for t in teams]}), 200
+    return jsonify({'teams': [with_avatar_url(t, thumb=True) for t in teams]}), 200
 
 
 @admin_bp.route('/teams/<int:team_id>', methods=['DELETE'])
@@ -120,8 +130,27 @@ def delete_team(team_id):
 
         conn.execute('DELETE FROM teams WHERE id = ?', (team_id,))
         conn.commit()
+    membership_cache.clear()
 
     if _socketio:
         _socketio.emit('team_deleted', {'team_id': team_id}, room=f'team_{team_id}')
 
     return jsonify({'message': 'Team deleted'}), 200
+
+
+# ---- МЕТРИКИ ----
+
+@admin_bp.route('/stats', methods=['GET'])
+@jwt_required()
+def get_server_stats():
+    admin = _require_admin()
+    if not admin:
+        return jsonify({'error': 'Forbidden'}), 403
+
+    return jsonify({
+        'message_writer': message_writer.stats(),
+        'user_cache': user_cache.stats(),
+        'membership_cache': membership_cache.stats(),
+        'socket_sessions': sessions_stats(connected_users),
+        'whiteboards': hot_boards.stats(),
+    }), 200
@@ -1,4 +1,3 @@
-import base64
 import sqlite3
 from datetime import datetime
 
@@ -6,16 +5,20 @@ from flask import Blueprint, request, jsonify
 from flask_jwt_extended import create_access_token, jwt_required, get_jwt_identity
 from werkzeug.security import generate_password_hash, check_password_hash
 
+from avatar_store import AvatarError, avatar_url, save_avatar
 from database import get_db
+from user_cache import user_cache
 
 auth_bp = Blueprint('auth', __name__, url_prefix='/api')
 
 
 def get_current_user():
-    """Возвращает пользователя по JWT identity. Использовать внутри @jwt_required()."""
-    user_id = int(get_jwt_identity())
-    with get_db() as conn:
-        return conn.execute('SELECT * FROM users WHERE id = ?', (user_id,)).fetchone()
+    """Возвращает пользователя по JWT identity. Использовать внутри @jwt_required().
+
+    Запись берётся из user_cache и содержит только id, username, avatar_hash
+    и is_site_admin — остальные поля нужно читать из БД отдельно.
+    """
+    return user_cache.get(int(get_jwt_identity()))
 
 
 def authenticate(username, password):
@@ -66,7 +69,7 @@ def register():
         'user': {
             'id': user['id'],
             'username': user['username'],
-            'avatar': user['avatar'],
+            'avatar': avatar_url(user['avatar_hash']),
             'bio': user['bio'],
             'is_site_admin': bool(user['is_site_admin'])
         }
@@ -96,7 +99,7 @@ def login():
         'user': {
             'id': user['id'],
             'username': user['username'],
-            'avatar': user['avatar'],
+            'avatar': avatar_url(user['avatar_hash']),
             'bio': user['bio'],
             'is_site_admin': bool(user['is_site_admin'])
         }
@@ -109,12 +112,14 @@ def get_me():
     user = get_current_user()
     if not user:
         return jsonify({'error': 'User not found'}), 404
+    with get_db() as conn:
+        profile = conn.execute('SELECT bio FROM users WHERE id = ?', (user['id'],)).fetchone()
     return jsonify({
         'user': {
             'id': user['id'],
             'username': user['username'],
-            'avatar': user['avatar'],
-            'bio': user['bio'],
+            'avatar': avatar_url(user['avatar_hash']),
+            'bio': profile['bio'] if profile else None,
             'is_site_admin': bool(user['is_site_admin']),
         }
     }), 200
@@ -154,6 +159,7 @@ def update_profile():
             (new_username, new_bio, datetime.now(), user['id'])
         )
         conn.commit()
+    user_cache.invalidate(user['id'])
 
     return jsonify({'message': 'Profile updated successfully'}), 200
 
@@ -174,20 +180,19 @@ def upload_avatar():
         return jsonify({'error': 'User not found'}), 404
 
     try:
-        base64_data = avatar.split(',')[1] if avatar.startswith('data:image') else avatar
-        if len(base64.b64decode(base64_data)) / (1024 * 1024) > 5:
-            return jsonify({'error': 'Image size exceeds 5MB limit'}), 400
-    except Exception:
-        return jsonify({'error': 'Invalid image data'}), 400
+        avatar_hash = save_avatar(avatar)
+    except AvatarError as e:
+        return jsonify({'error': str(e)}), 400
 
     with get_db() as conn:
         conn.execute(
-            'UPDATE users SET avatar = ?, last_seen = ? WHERE id = ?',
-            (avatar, datetime.now(), user['id'])
+            'UPDATE users SET avatar_hash = ?, avatar = NULL, last_seen = ? WHERE id = ?',
+            (avatar_hash, datetime.now(), user['id'])
         )
         conn.commit()
+    user_cache.invalidate(user['id'])
 
-    return jsonify({'message': 'Avatar updated successfully'}), 200
+    return jsonify({'message': 'Avatar updated successfully', 'avatar': avatar_url(avatar_hash)}), 200
 
 
 @auth_bp.route('/profile/avatar', methods=['DELETE'])
@@ -199,9 +204,10 @@ def delete_avatar():
 
     with get_db() as conn:
         conn.execute(
-            'UPDATE users SET avatar = NULL, last_seen = ? WHERE id = ?',
+            'UPDATE users SET avatar_hash = NULL, avatar = NULL, last_seen = ? WHERE id = ?',
             (datetime.now(), user['id'])
         )
         conn.commit()
+    user_cache.invalidate(user['id'])
 
     return jsonify({'message': 'Avatar deleted successfully'}), 200
@@ -0,0 +1,38 @@
+import os
+
+from flask import Blueprint, request, jsonify, send_file
+
+from avatar_store import avatar_path, is_valid_hash, sniff_mimetype
+
+avatar_bp = Blueprint('avatars', __name__, url_prefix='/api/avatars')
+
+# Файл адресуется своим хешем и никогда не меняется — кешируем «навсегда»
+AVATAR_CACHE_SECONDS = 365 * 24 * 3600
+
+
+@avatar_bp.route('/<avatar_hash>', methods=['GET'])
+def get_avatar(avatar_hash):
+    if not is_valid_hash(avatar_hash):
+        return jsonify({'error': 'Avatar not found'}), 404
+
+    thumb = request.args.get('size') == 'thumb'
+    path = avatar_path(avatar_hash, thumb=thumb)
+    if thumb and not os.path.exists(path):
+        # Миниатюры нет (Pillow не установлен или формат не поддержан) — отдаём оригинал
+        thumb, path = False, avatar_path(avatar_hash)
+    if not os.path.exists(path):
+        return jsonify({'error': 'Avatar not found'}), 404
+
+    with open(path, 'rb') as f:
+        mimetype = sniff_mimetype(f.read(16))
+
+    response = send_file(
+        path,
+        mimetype=mimetype,
+        etag=f'{avatar_hash}-thumb' if thumb else avatar_hash,
+        max_age=AVATAR_CACHE_SECONDS,
+        conditional=True,
+    )
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
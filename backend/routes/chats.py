@@ -1,10 +1,15 @@
 from flask import Blueprint, request, jsonify
 from flask_jwt_extended import jwt_required
 from database import get_db
+from read_cursors import read_cursors
 from routes.auth import get_current_user
+from sockets.chat_rooms import close_chat_room, update_chat_rooms
 
 chat_bp = Blueprint('chat', __name__, url_prefix='/api/chats')
 
+# Непрочитанные считаются не дальше этого числа (клиент показывает «999+»)
+UNREAD_COUNT_CAP = 999
+
 
 @chat_bp.route('', methods=['POST'])
 @jwt_required()
@@ -45,6 +50,7 @@ def create_chat():
             )
         conn.commit()
 
+    update_chat_rooms(chat_id, [user['id'], *member_ids], True)
     return jsonify({'chat_id': chat_id, 'message': 'Chat created'}), 201
 
 
@@ -55,15 +61,31 @@ def get_chats():
     if not user:
         return jsonify({'error': 'User not found'}), 404
 
+    # Курсоры, ещё не сброшенные в БД, иначе счётчики отстанут на интервал сброса
+    read_cursors.flush(user_id=user['id'])
+
     with get_db() as conn:
         chats = conn.execute('''
             SELECT c.*, cm.role,
-                   (SELECT COUNT(*) FROM messages WHERE chat_id = c.id) as message_count
+                   COALESCE(cs.message_count, 0) as message_count,
+                   cs.last_message_id, cs.last_message_user_id, cs.last_message_preview,
+                   cs.last_message_at, cs.last_activity_at,
+                   COALESCE(rc.last_read_id, 0) as last_read_id,
+                   CASE
+                       WHEN cs.last_message_id IS NULL OR cs.last_message_id <= COALESCE(rc.last_read_id, 0) THEN 0
+                       ELSE (SELECT COUNT(*) FROM (
+                           SELECT 1 FROM messages
+                           WHERE chat_id = c.id AND id > COALESCE(rc.last_read_id, 0) AND is_deleted = 0
+                           LIMIT ?
+                       ))
+                   END as unread_count
             FROM chats c
             JOIN chat_members cm ON c.id = cm.chat_id
+            LEFT JOIN chat_stats cs ON cs.chat_id = c.id
+            LEFT JOIN chat_read_cursors rc ON rc.chat_id = c.id AND rc.user_id = cm.user_id
             WHERE cm.user_id = ?
             ORDER BY c.created_at DESC
-        ''', (user['id'],)).fetchall()
+        ''', (UNREAD_COUNT_CAP, user['id'])).fetchall()
 
     return jsonify([dict(chat) for chat in chats]), 200
 
@@ -145,6 +167,7 @@ def delete_chat(chat_id):
         conn.execute('DELETE FROM chats WHERE id = ?', (chat_id,))
         conn.commit()
 
+    close_chat_room(chat_id)
     return jsonify({'message': 'Chat deleted'}), 200
 
 
@@ -178,6 +201,7 @@ def add_members(chat_id):
             )
         conn.commit()
 
+    update_chat_rooms(chat_id, new_member_ids, True)
     return jsonify({'message': 'Members added'}), 200
 
 
@@ -203,4 +227,5 @@ def remove_member(chat_id, user_id):
         )
         conn.commit()
 
+    update_chat_rooms(chat_id, [user_id], False)
     return jsonify({'message': 'Member removed'}), 200
@@ -1,10 +1,31 @@
+import html
+import re
+
 from flask import Blueprint, request, jsonify
 from flask_jwt_extended import jwt_required
+from avatar_store import with_avatar_url
 from database import get_db
+from membership_cache import membership_cache
+from message_writer import MessageRejected, MessageWriterUnavailable, message_writer
+from read_cursors import read_cursors
 from routes.auth import get_current_user
 
 message_bp = Blueprint('message', __name__, url_prefix='/api/messages')
 
+# Максимальный размер страницы в курсорном режиме
+MESSAGES_PAGE_MAX = 200
+SEARCH_PAGE_MAX = 50
+
+# Маркеры подсветки из Private Use Area: после html.escape() меняются на <mark>
+_MARK_OPEN, _MARK_CLOSE = '\ue000', '\ue001'
+
+_MESSAGE_COLUMNS = '''
+    SELECT m.id, m.chat_id, m.user_id, m.content, m.created_at, m.updated_at,
+           u.username, u.avatar_hash
+    FROM messages m
+    JOIN users u ON m.user_id = u.id
+'''
+
 
 @message_bp.route('', methods=['POST'])
 @jwt_required()
@@ -17,34 +38,45 @@ def send_message():
     content = data.get('content')
     if not chat_id or not content:
         return jsonify({'error': 'chat_id and content required'}), 400
+    try:
+        chat_id = int(chat_id)
+    except (TypeError, ValueError):
+        return jsonify({'error': 'chat_id must be an integer'}), 400
 
     user = get_current_user()
     if not user:
         return jsonify({'error': 'User not found'}), 404
 
-    with get_db() as conn:
-        member = conn.execute(
-            'SELECT * FROM chat_members WHERE chat_id = ? AND user_id = ?',
-            (chat_id, user['id'])
-        ).fetchone()
-        if not member:
-            return jsonify({'error': 'You are not a member of this chat'}), 403
+    is_member, _ = membership_cache.get(chat_id, user['id'])
+    if not is_member:
+        return jsonify({'error': 'You are not a member of this chat'}), 403
 
-        cur = conn.execute(
-            'INSERT INTO messages (chat_id, user_id, content) VALUES (?, ?, ?)',
-            (chat_id, user['id'], content)
-        )
-        conn.commit()
+    try:
+        message_id, _ = message_writer.insert(chat_id, user['id'], content)
+    except MessageWriterUnavailable:
+        return jsonify({'error': 'Message storage is busy, try again later'}), 503
+    except MessageRejected:
+        return jsonify({'error': 'Message rejected, the chat may have been deleted'}), 409
+    read_cursors.advance(chat_id, user['id'], message_id)
 
-    return jsonify({'message_id': cur.lastrowid, 'status': 'sent'}), 201
+    return jsonify({'message_id': message_id, 'status': 'sent'}), 201
 
 
 @message_bp.route('', methods=['GET'])
 @jwt_required()
 def get_messages():
+    """Сообщения чата.
+
+    Курсорный режим (before_id / after_id) ищет по первичному ключу и не зависит
+    от глубины прокрутки: before_id — более старые сообщения от новых к старым
+    (пустое значение — с самого нового), after_id — более новые по возрастанию.
+    Ответ: {'messages': [...], 'next_cursor': id | None}.
+    Без курсора работает старый режим limit/offset и возвращается список.
+    """
     chat_id = request.args.get('chat_id')
     limit = request.args.get('limit', 50, type=int)
     offset = request.args.get('offset', 0, type=int)
+    keyset = 'before_id' in request.args or 'after_id' in request.args
 
     if not chat_id:
         return jsonify({'error': 'chat_id required'}), 400
@@ -61,17 +93,109 @@ def get_messages():
         if not member:
             return jsonify({'error': 'Access denied'}), 403
 
-        messages = conn.execute('''
-            SELECT m.id, m.chat_id, m.user_id, m.content, m.created_at, m.updated_at,
-                   u.username, u.avatar
-            FROM messages m
-            JOIN users u ON m.user_id = u.id
-            WHERE m.chat_id = ? AND m.is_deleted = 0
-            ORDER BY m.created_at DESC
-            LIMIT ? OFFSET ?
-        ''', (chat_id, limit, offset)).fetchall()
-
-    return jsonify([dict(msg) for msg in messages]), 200
+        if not keyset:
+            messages = conn.execute(_MESSAGE_COLUMNS + '''
+                WHERE m.chat_id = ? AND m.is_deleted = 0
+                ORDER BY m.created_at DESC
+                LIMIT ? OFFSET ?
+            ''', (chat_id, limit, offset)).fetchall()
+            return jsonify([with_avatar_url(msg, thumb=True) for msg in messages]), 200
+
+        limit = max(1, min(limit, MESSAGES_PAGE_MAX))
+        after_id = request.args.get('after_id', type=int)
+        before_id = request.args.get('before_id', type=int)
+
+        if after_id is not None:
+            messages = conn.execute(_MESSAGE_COLUMNS + '''
+                WHERE m.chat_id = ? AND m.id > ? AND m.is_deleted = 0
+                ORDER BY m.id ASC
+                LIMIT ?
+            ''', (chat_id, after_id, limit)).fetchall()
+        elif before_id is not None:
+            messages = conn.execute(_MESSAGE_COLUMNS + '''
+                WHERE m.chat_id = ? AND m.id < ? AND m.is_deleted = 0
+                ORDER BY m.id DESC
+                LIMIT ?
+            ''', (chat_id, before_id, limit)).fetchall()
+        else:
+            messages = conn.execute(_MESSAGE_COLUMNS + '''
+                WHERE m.chat_id = ? AND m.is_deleted = 0
+                ORDER BY m.id DESC
+                LIMIT ?
+            ''', (chat_id, limit)).fetchall()
+
+    next_cursor = messages[-1]['id'] if len(messages) == limit else None
+    return jsonify({'messages': [with_avatar_url(msg, thumb=True) for msg in messages], 'next_cursor': next_cursor}), 200
+
+
+def _fts_query(text):
+    """Превращает пользовательский ввод в безопасный запрос FTS5: все слова, последнее — по префиксу."""
+    words = re.findall(r'\w+', text)
+    if not words:
+        return None
+    terms = [f'"{w}"' for w in words]
+    terms[-1] += '*'
+    return ' '.join(terms)
+
+
+def _highlight(snippet):
+    return html.escape(snippet).replace(_MARK_OPEN, '<mark>').replace(_MARK_CLOSE, '</mark>')
+
+
+@message_bp.route('/search', methods=['GET'])
+@jwt_required()
+def search_messages():
+    """Полнотекстовый поиск по сообщениям чатов, где состоит пользователь.
+
+    Результаты отсортированы по релевантности (bm25). Для следующей страницы
+    передаётся cursor из next_cursor предыдущего ответа.
+    """
+    query = _fts_query(request.args.get('q', ''))
+    if not query:
+        return jsonify({'error': 'Search query required'}), 400
+
+    chat_id = request.args.get('chat_id', type=int)
+    limit = max(1, min(request.args.get('limit', 20, type=int), SEARCH_PAGE_MAX))
+
+    after_rank = after_id = None
+    cursor = request.args.get('cursor')
+    if cursor:
+        try:
+            rank_part, id_part = cursor.split(':')
+            after_rank, after_id = float(rank_part), int(id_part)
+        except ValueError:
+            return jsonify({'error': 'Invalid cursor'}), 400
+
+    user = get_current_user()
+    if not user:
+        return jsonify({'error': 'User not found'}), 404
+
+    with get_db() as conn:
+        rows = conn.execute('''
+            SELECT m.id, m.chat_id, m.user_id, m.created_at, u.username,
+                   snippet(messages_fts, 0, ?, ?, '…', 12) AS snippet,
+                   messages_fts.rank AS rank
+            FROM messages_fts
+            JOIN messages m ON m.id = messages_fts.rowid
+            JOIN chat_members cm ON cm.chat_id = m.chat_id AND cm.user_id = ?
+            JOIN users u ON u.id = m.user_id
+            WHERE messages_fts MATCH ?
+              AND (? IS NULL OR m.chat_id = ?)
+              AND (? IS NULL OR messages_fts.rank > ? OR (messages_fts.rank = ? AND m.id > ?))
+            ORDER BY messages_fts.rank, m.id
+            LIMIT ?
+        ''', (_MARK_OPEN, _MARK_CLOSE, user['id'], query, chat_id, chat_id,
+              after_rank, after_rank, after_rank, after_id, limit)).fetchall()
+
+    results = []
+    for row in rows:
+        result = dict(row)
+        result['snippet'] = _highlight(result['snippet'])
+        del result['rank']
+        results.append(result)
+
+    next_cursor = f"{rows[-1]['rank']!r}:{rows[-1]['id']}" if len(rows) == limit else None
+    return jsonify({'results': results, 'next_cursor': next_cursor}), 200
 
 
 @message_bp.route('/<int:message_id>', methods=['PUT'])
@@ -1,11 +1,19 @@
-import base64
+import json
 from datetime import datetime
 
 from flask import Blueprint, request, jsonify, current_app
 from flask_jwt_extended import jwt_required
+from avatar_store import AvatarError, avatar_url, save_avatar, with_avatar_url
 from database import get_db
+from membership_cache import membership_cache
 from routes.auth import get_current_user
-from sockets.events import online_users
+from sockets.chat_rooms import update_chat_rooms
+from sockets.presence import presence
+from stroke_codec import emit_elements
+from whiteboards import (
+    WHITEBOARD_OPS_PAGE_MAX, WhiteboardError, can_replay_since, get_or_create_board,
+    hot_boards, ops_since, parse_rect, validate_ops,
+)
 
 team_bp = Blueprint('team', __name__, url_prefix='/api')
 
@@ -25,18 +33,6 @@ def is_team_admin(conn, team_id, user_id):
     return any(r['role_name'] == 'Admin' for r in roles)
 
 
-def validate_image(avatar):
-    """Проверяет base64-изображение. Возвращает None или строку ошибки."""
-    try:
-        base64_data = avatar.split(',')[1] if avatar.startswith('data:image') else avatar
-        decoded = base64.b64decode(base64_data)
-        if len(decoded) / (1024 * 1024) > 5:
-            return 'Image size exceeds 5MB limit'
-    except Exception:
-        return 'Invalid image data'
-    return None
-
-
 # ---- КОМАНДЫ ----
 
 @team_bp.route('/teams', methods=['GET'])
@@ -56,7 +52,7 @@ def get_teams():
             ORDER BY t.created_at DESC
         ''', (user['id'],)).fetchall()
 
-    return jsonify({'teams': [dict(t) for t in teams]}), 200
+    return jsonify({'teams': [with_avatar_url(t) for t in teams]}), 200
 
 
 @team_bp.route('/teams', methods=['POST'])
@@ -80,10 +76,12 @@ def create_team():
     if not user:
         return jsonify({'error': 'User not found'}), 404
 
+    avatar_hash = None
     if avatar:
-        err = validate_image(avatar)
-        if err:
-            return jsonify({'error': err}), 400
+        try:
+            avatar_hash = save_avatar(avatar)
+        except AvatarError as e:
+            return jsonify({'error': str(e)}), 400
 
     with get_db() as conn:
         chat_cur = conn.execute(
@@ -98,8 +96,8 @@ def create_team():
         )
 
         cur = conn.execute(
-            'INSERT INTO teams (name, description, is_private, avatar, created_by, chat_id) VALUES (?, ?, ?, ?, ?, ?)',
-            (name, description, 1 if is_private else 0, avatar, user['id'], chat_id)
+            'INSERT INTO teams (name, description, is_private, avatar_hash, created_by, chat_id) VALUES (?, ?, ?, ?, ?, ?)',
+            (name, description, 1 if is_private else 0, avatar_hash, user['id'], chat_id)
         )
         team_id = cur.lastrowid
 
@@ -113,6 +111,7 @@ def create_team():
         )
         conn.commit()
 
+    update_chat_rooms(chat_id, [user['id']], True)
     return jsonify({'message': 'Team created successfully', 'team_id': team_id, 'chat_id': chat_id}), 200
 
 
@@ -133,7 +132,7 @@ def get_team(team_id):
         ).fetchone()['count']
 
         members_raw = conn.execute('''
-            SELECT u.id, u.username, u.avatar, u.last_seen
+            SELECT u.id, u.username, u.avatar_hash, u.last_seen
             FROM users u
             JOIN team_members tm ON u.id = tm.user_id
             WHERE tm.team_id = ?
@@ -148,9 +147,9 @@ def get_team(team_id):
             members.append({
                 'id': m['id'],
                 'username': m['username'],
-                'avatar': m['avatar'],
+                'avatar': avatar_url(m['avatar_hash'], thumb=True),
                 'roles': [r['role_name'] for r in roles],
-                'is_online': team_id in online_users and m['id'] in online_users[team_id]
+                'is_online': presence.is_online(team_id, m['id'])
             })
 
         active_poll = None
@@ -183,7 +182,7 @@ def get_team(team_id):
                     'options': [dict(o) for o in options]
                 }
 
-    team_dict = dict(team)
+    team_dict = with_avatar_url(team)
     team_dict['member_count'] = member_count
 
     return jsonify({'team': team_dict, 'members': members, 'active_poll': active_poll}), 200
@@ -209,7 +208,7 @@ def get_public_teams():
             ORDER BY t.created_at DESC
         ''', (user['id'], user['id'])).fetchall()
 
-    return jsonify({'teams': [dict(t) for t in teams]}), 200
+    return jsonify({'teams': [with_avatar_url(t) for t in teams]}), 200
 
 
 @team_bp.route('/teams/<int:team_id>', methods=['PUT'])
@@ -239,10 +238,12 @@ def update_team(team_id):
         if description is not None and len(description) > 80:
             return jsonify({'error': 'Description must be less than 80 characters'}), 400
 
+        avatar_hash = None
         if avatar:
-            err = validate_image(avatar)
-            if err:
-                return jsonify({'error': err}), 400
+            try:
+                avatar_hash = save_avatar(avatar)
+            except AvatarError as e:
+                return jsonify({'error': str(e)}), 400
 
         updates, values = [], []
         if name is not None:
@@ -252,7 +253,7 @@ def update_team(team_id):
         if is_private is not None:
             updates.append('is_private = ?'); values.append(1 if is_private else 0)
         if avatar is not None:
-            updates.append('avatar = ?'); values.append(avatar)
+            updates.append('avatar_hash = ?'); values.append(avatar_hash)
 
         if not updates:
             return jsonify({'error': 'No fields to update'}), 400
@@ -280,6 +281,8 @@ def delete_team(team_id):
 
         conn.execute('DELETE FROM teams WHERE id = ?', (team_id,))
         conn.commit()
+    # Чат команды остаётся (ON DELETE SET NULL), но в кеше у его участников записан team_id
+    membership_cache.clear()
 
     return jsonify({'message': 'Team deleted successfully'}), 200
 
@@ -309,6 +312,8 @@ def remove_team_member(team_id, user_id):
             )
         conn.commit()
 
+    if team and team['chat_id']:
+        update_chat_rooms(team['chat_id'], [user_id], False)
     return jsonify({'message': 'Member removed successfully'}), 200
 
 
@@ -424,6 +429,8 @@ def join_team_instantly(team_id):
             )
         conn.commit()
 
+    if team['chat_id']:
+        update_chat_rooms(team['chat_id'], [user['id']], True)
     return jsonify({'message': 'Successfully joined the team'}), 200
 
 
@@ -439,14 +446,14 @@ def get_join_requests(team_id):
             return jsonify({'error': 'Only admins can view requests'}), 403
 
         requests_raw = conn.execute('''
-            SELECT jr.id, jr.user_id, jr.status, jr.created_at, u.username, u.avatar
+            SELECT jr.id, jr.user_id, jr.status, jr.created_at, u.username, u.avatar_hash
             FROM join_requests jr
             JOIN users u ON jr.user_id = u.id
             WHERE jr.team_id = ? AND jr.status = 'pending'
             ORDER BY jr.created_at DESC
         ''', (team_id,)).fetchall()
 
-    return jsonify({'requests': [dict(r) for r in requests_raw]}), 200
+    return jsonify({'requests': [with_avatar_url(r, thumb=True) for r in requests_raw]}), 200
 
 
 @team_bp.route('/teams/<int:team_id>/requests/<int:request_id>/approve', methods=['POST'])
@@ -489,6 +496,8 @@ def approve_request(team_id, request_id):
         )
         conn.commit()
 
+    if team and team['chat_id']:
+        update_chat_rooms(team['chat_id'], [join_req['user_id']], True)
     return jsonify({'message': 'Request approved successfully'}), 200
 
 
@@ -555,6 +564,14 @@ def get_team_stats(team_id):
 @team_bp.route('/teams/<int:team_id>/whiteboard', methods=['GET'])
 @jwt_required()
 def get_whiteboard(team_id):
+    """Доска команды. С ?viewport=x0,y0,x1,y1 — только элементы в этой области (страницами по after)."""
+    viewport = request.args.get('viewport')
+    if viewport is not None:
+        try:
+            viewport = parse_rect(viewport)
+        except WhiteboardError as e:
+            return jsonify({'error': str(e)}), 400
+
     user = get_current_user()
     if not user:
         return jsonify({'error': 'User not found'}), 404
@@ -565,35 +582,88 @@ def get_whiteboard(team_id):
         ).fetchone():
             return jsonify({'error': 'You are not a member of this team'}), 403
 
-        whiteboard = conn.execute(
-            'SELECT * FROM whiteboards WHERE team_id = ?', (team_id,)
-        ).fetchone()
-
-        if not whiteboard:
-            cur = conn.execute(
-                'INSERT INTO whiteboards (team_id, created_by) VALUES (?, ?)', (team_id, user['id'])
-            )
-            whiteboard_id = cur.lastrowid
-            conn.execute(
-                'INSERT INTO whiteboard_data (whiteboard_id, data) VALUES (?, ?)',
-                (whiteboard_id, '{"elements":[]}')
-            )
-            conn.commit()
-            data = '{"elements":[]}'
+        if viewport is None:
+            whiteboard_id, version, elements = hot_boards.load(conn, team_id, user['id'])
         else:
-            whiteboard_id = whiteboard['id']
-            wb_data = conn.execute(
-                'SELECT data FROM whiteboard_data WHERE whiteboard_id = ? ORDER BY updated_at DESC LIMIT 1',
-                (whiteboard_id,)
-            ).fetchone()
-            data = wb_data['data'] if wb_data else '{"elements":[]}'
+            whiteboard_id, version, elements, next_after = hot_boards.viewport(
+                conn, team_id, user['id'], viewport, after=request.args.get('after', 0, type=int)
+            )
 
-    return jsonify({'whiteboard_id': whiteboard_id, 'data': data}), 200
+    result = {'whiteboard_id': whiteboard_id, 'version': version, 'data': json.dumps({'elements': elements})}
+    if viewport is not None:
+        result.update(partial=True, next_after=next_after)
+    return jsonify(result), 200
+
+
+@team_bp.route('/teams/<int:team_id>/whiteboard/ops', methods=['GET'])
+@jwt_required()
+def get_whiteboard_ops(team_id):
+    """Операции доски после версии since.
+
+    Если журнал уже свёрнут дальше since, возвращается {'reset': True, 'data': ...}
+    с полным снимком — клиент заменяет доску целиком.
+    """
+    since = request.args.get('since', type=int)
+    if since is None:
+        return jsonify({'error': 'since required'}), 400
+    limit = max(1, min(request.args.get('limit', WHITEBOARD_OPS_PAGE_MAX, type=int), WHITEBOARD_OPS_PAGE_MAX))
+
+    user = get_current_user()
+    if not user:
+        return jsonify({'error': 'User not found'}), 404
+
+    with get_db() as conn:
+        if not conn.execute(
+            'SELECT * FROM team_members WHERE team_id = ? AND user_id = ?', (team_id, user['id'])
+        ).fetchone():
+            return jsonify({'error': 'You are not a member of this team'}), 403
+
+        whiteboard_id, version = get_or_create_board(conn, team_id, user['id'])
+        if not can_replay_since(conn, whiteboard_id, since, version):
+            _, version, elements = hot_boards.load(conn, team_id, user['id'])
+            return jsonify({'version': version, 'reset': True, 'data': json.dumps({'elements': elements})}), 200
+
+        ops = ops_since(conn, whiteboard_id, since, limit)
+
+    return jsonify({'version': version, 'ops': ops, 'has_more': len(ops) == limit}), 200
+
+
+@team_bp.route('/teams/<int:team_id>/whiteboard/ops', methods=['POST'])
+@jwt_required()
+def post_whiteboard_ops(team_id):
+    data = request.get_json()
+    if not data:
+        return jsonify({'error': 'Missing JSON body'}), 400
+
+    try:
+        ops = validate_ops(data.get('ops'))
+    except WhiteboardError as e:
+        return jsonify({'error': str(e)}), 400
+
+    user = get_current_user()
+    if not user:
+        return jsonify({'error': 'User not found'}), 404
+
+    with get_db() as conn:
+        if not conn.execute(
+            'SELECT * FROM team_members WHERE team_id = ? AND user_id = ?', (team_id, user['id'])
+        ).fetchone():
+            return jsonify({'error': 'You are not a member of this team'}), 403
+
+        ops = hot_boards.append(conn, team_id, user['id'], ops)
+
+    emit_elements(current_app.extensions['socketio'].emit, 'whiteboard_ops', {
+        'team_id': team_id,
+        'username': user['username'],
+        'ops': ops,
+    }, team_id)
+    return jsonify({'version': ops[-1]['version']}), 201
 
 
 @team_bp.route('/teams/<int:team_id>/whiteboard', methods=['PUT'])
 @jwt_required()
 def update_whiteboard(team_id):
+    """Полная перезапись доски. Оставлена для старых клиентов — новые шлют операции."""
     data = request.get_json()
     if not data:
         return jsonify({'error': 'Missing JSON body'}), 400
@@ -601,6 +671,15 @@ def update_whiteboard(team_id):
     whiteboard_data = data.get('data')
     if not whiteboard_data:
         return jsonify({'error': 'Whiteboard data required'}), 400
+    # data — JSON-строка, как её всегда слали старые клиенты
+    if not isinstance(whiteboard_data, str):
+        return jsonify({'error': 'Whiteboard data must be a JSON string'}), 400
+    try:
+        elements = json.loads(whiteboard_data).get('elements') or []
+    except (ValueError, AttributeError):
+        return jsonify({'error': 'Invalid whiteboard data'}), 400
+    if not isinstance(elements, list):
+        return jsonify({'error': 'Invalid whiteboard data'}), 400
 
     user = get_current_user()
     if not user:
@@ -612,30 +691,12 @@ def update_whiteboard(team_id):
         ).fetchone():
             return jsonify({'error': 'You are not a member of this team'}), 403
 
-        whiteboard = conn.execute(
-            'SELECT * FROM whiteboards WHERE team_id = ?', (team_id,)
-        ).fetchone()
-        if not whiteboard:
+        if not conn.execute('SELECT 1 FROM whiteboards WHERE team_id = ?', (team_id,)).fetchone():
             return jsonify({'error': 'Whiteboard not found'}), 404
 
-        # Обновляем существующую запись вместо INSERT — предотвращает бесконечный рост таблицы
-        existing = conn.execute(
-            'SELECT id FROM whiteboard_data WHERE whiteboard_id = ?', (whiteboard['id'],)
-        ).fetchone()
-
-        if existing:
-            conn.execute(
-                'UPDATE whiteboard_data SET data = ?, updated_at = CURRENT_TIMESTAMP WHERE whiteboard_id = ?',
-                (whiteboard_data, whiteboard['id'])
-            )
-        else:
-            conn.execute(
-                'INSERT INTO whiteboard_data (whiteboard_id, data) VALUES (?, ?)',
-                (whiteboard['id'], whiteboard_data)
-            )
-        conn.commit()
+        version = hot_boards.replace(conn, team_id, user['id'], elements)
 
-    return jsonify({'message': 'Whiteboard updated successfully'}), 200
+    return jsonify({'message': 'Whiteboard updated successfully', 'version': version}), 200
 
 
 # ---- ГОЛОСОВАНИЯ (POLLS) ----
@@ -0,0 +1,61 @@
+from cache_bus import cache_bus
+from flask import current_app
+from membership_cache import membership_cache
+from sockets.events import connected_users
+
+_socketio = None
+
+
+def init_socketio(socketio):
+    global _socketio
+    _socketio = socketio
+
+
+class _ChatRoomMoves:
+    """Переводит локальные сокеты пользователей в комнату чата или из неё.
+
+    Регистрируется в cache_bus: update_chat_rooms публикует перевод, и каждый
+    воркер применяет его к своим сокетам. Исключённый из чата перестаёт получать
+    его сообщения на всех воркерах, не дожидаясь, пока клиент сам вызовет leave_chat.
+    """
+
+    def _drop(self, chat_id, user_ids, member):
+        if _socketio is None:
+            return
+        user_ids = set(user_ids)
+        room = f'chat_{chat_id}'
+        for sid, session in list(connected_users.items()):
+            if session.id in user_ids:
+                if member:
+                    _socketio.server.enter_room(sid, room, namespace='/')
+                else:
+                    _socketio.server.leave_room(sid, room, namespace='/')
+
+    def _drop_all(self):
+        # Не кеш: при переподключении слушателя сбрасывать нечего
+        pass
+
+
+cache_bus.register('chat_rooms', _ChatRoomMoves())
+
+
+def update_chat_rooms(chat_id, user_ids, member):
+    """Вводит (member=True) или выводит сокеты пользователей из комнаты chat_{id}.
+
+    Вызывается маршрутами после изменения chat_members; заодно сбрасывает
+    membership_cache для этих пользователей. Сокеты переводятся на всех
+    воркерах через cache_bus. Кроме того, каждому пользователю в личную
+    комнату уходит chat_membership — клиент обновляет список чатов.
+    """
+    socketio = current_app.extensions['socketio']
+    user_ids = sorted({int(user_id) for user_id in user_ids})
+    membership_cache.invalidate(chat_id, user_ids)
+    cache_bus.publish('chat_rooms', int(chat_id), user_ids, bool(member))
+    for user_id in user_ids:
+        socketio.emit('chat_membership', {'chat_id': chat_id, 'member': member}, room=f'user_{user_id}')
+
+
+def close_chat_room(chat_id):
+    """Чат удалён — комната закрывается на всех воркерах."""
+    membership_cache.invalidate(chat_id)
+    current_app.extensions['socketio'].close_room(f'chat_{chat_id}')
@@ -1,17 +1,49 @@
-from flask_socketio import emit, join_room, leave_room
+from flask_socketio import emit, join_room, leave_room, rooms
 from flask import request
 from flask_jwt_extended import decode_token
+from avatar_store import avatar_url
 from database import get_db
+from membership_cache import membership_cache
+from message_writer import MessageRejected, MessageWriterUnavailable, message_writer
+from read_cursors import read_cursors
+from sockets.presence import presence, presence_deltas, start_heartbeat
+from sockets.sessions import SocketSession
+from sockets.sync import parse_resume, stream_missed_messages
+from sockets.whiteboard_frames import whiteboard_frames
+from stroke_codec import CODECS, CodecError, decode_element, emit_elements, encode_elements, whiteboard_room
+from user_cache import user_cache
+from whiteboards import WhiteboardError, hot_boards, new_element_id, parse_rect, parse_rects, validate_ops
+
+# Аутентифицированные соединения: { sid: SocketSession }
+connected_users = {}
 
-# Глобальный реестр онлайн-пользователей
-# Структура: { team_id: { user_id: socket_id } }
-online_users = {}
+# Все команды и чаты пользователя одним запросом — для входа в комнаты при connect
+_MEMBERSHIPS_SQL = '''
+    SELECT 'team' AS kind, team_id AS id FROM team_members WHERE user_id = ?
+    UNION ALL
+    SELECT 'chat' AS kind, chat_id AS id FROM chat_members WHERE user_id = ?
+'''
+
+
+def _is_team_member(conn, team_id, user_id):
+    return conn.execute(
+        'SELECT 1 FROM team_members WHERE team_id = ? AND user_id = ?', (team_id, user_id)
+    ).fetchone() is not None
 
-# Аутентифицированные соединения: { sid: user_dict }
-connected_users = {}
+
+def _persist_whiteboard_ops(team_id, user_id, ops):
+    """Пишет операции в журнал доски команды. None — пользователь не состоит в команде."""
+    with get_db() as conn:
+        if not _is_team_member(conn, team_id, user_id):
+            return None
+        # append сам делает commit до того, как менять горячую копию
+        return hot_boards.append(conn, team_id, user_id, ops)
 
 
 def register_socket_events(socketio):
+    presence_deltas.start(socketio)
+    start_heartbeat(socketio, presence_deltas)
+    whiteboard_frames.start(socketio)
 
     @socketio.on('connect')
     def handle_connect(auth):
@@ -21,27 +53,54 @@ def register_socket_events(socketio):
         try:
             decoded = decode_token(token)
             user_id = int(decoded['sub'])
-            with get_db() as conn:
-                user = conn.execute('SELECT * FROM users WHERE id = ?', (user_id,)).fetchone()
+            user = user_cache.get(user_id)
             if not user:
                 return False
-            connected_users[request.sid] = dict(user)
+            codec = (auth or {}).get('codec')
+            connected_users[request.sid] = SocketSession.from_user(user, codec if codec in CODECS else 'json')
         except Exception:
             return False
-        emit('connected', {'sid': request.sid})
+
+        # Сокет сразу входит в комнаты всех своих команд и чатов: клиенту не нужен
+        # join_team на каждую команду. С auth.lazy_join команды подключаются как раньше,
+        # по join_team; в комнаты чатов сокет входит всегда — туда идут сообщения
+        lazy_join = bool((auth or {}).get('lazy_join'))
+        with get_db() as conn:
+            memberships = conn.execute(_MEMBERSHIPS_SQL, (user_id, user_id)).fetchall()
+
+        teams = []
+        for row in memberships:
+            if row['kind'] == 'chat':
+                join_room(f"chat_{row['id']}")
+            elif not lazy_join:
+                teams.append(row['id'])
+        for team_id in teams:
+            join_room(f'team_{team_id}')
+            if presence.join(team_id, user_id, request.sid):
+                presence_deltas.record(team_id, user_id, True)
+
+        emit('connected', {
+            'sid': request.sid,
+            'codec': connected_users[request.sid].codec,
+            'teams': teams,
+            'lazy_join': lazy_join,
+        })
+
+        # Клиент после переподключения присылает {chat_id: last_seen_id} —
+        # досылаем пропущенное в фоне, не задерживая обработку connect
+        resume = parse_resume((auth or {}).get('resume'))
+        if resume:
+            socketio.start_background_task(
+                stream_missed_messages, socketio, request.sid, user_id, resume, auth.get('since')
+            )
 
     @socketio.on('disconnect')
     def handle_disconnect():
-        user = connected_users.pop(request.sid, None)
-        if not user:
+        if not connected_users.pop(request.sid, None):
             return
-        user_id = user['id']
-        for team_id in list(online_users.keys()):
-            if user_id in online_users[team_id]:
-                del online_users[team_id][user_id]
-                socketio.emit('user_offline', {'user_id': user_id, 'team_id': team_id}, room=f'team_{team_id}')
-                if not online_users[team_id]:
-                    del online_users[team_id]
+        user_id, offline_teams = presence.disconnect(request.sid)
+        for team_id in offline_teams:
+            presence_deltas.record(team_id, user_id, False)
 
     # ==================== КОМАНДЫ ====================
 
@@ -57,33 +116,33 @@ def register_socket_events(socketio):
             emit('error', {'message': 'Missing team_id'})
             return
         team_id = int(team_id)
+        room = f'team_{team_id}'
 
-        with get_db() as conn:
-            if not conn.execute(
-                'SELECT * FROM team_members WHERE team_id = ? AND user_id = ?',
-                (team_id, user['id'])
-            ).fetchone():
-                emit('error', {'message': 'Not a team member'})
-                return
+        # Сокет уже в комнате (вошёл при connect) — участие проверено, нужен только список онлайн
+        if room not in rooms():
+            with get_db() as conn:
+                if not _is_team_member(conn, team_id, user.id):
+                    emit('error', {'message': 'Not a team member'})
+                    return
 
-        room = f'team_{team_id}'
-        join_room(room)
+            join_room(room)
 
-        if team_id not in online_users:
-            online_users[team_id] = {}
-        online_users[team_id][user['id']] = request.sid
+            # Вторая вкладка того же пользователя не делает его «ещё раз онлайн»
+            if presence.join(team_id, user.id, request.sid):
+                presence_deltas.record(team_id, user.id, True)
 
+        # Полный список — только подключившемуся, остальные получат presence_delta
         emit('joined_team', {
             'status': 'success',
             'team_id': team_id,
-            'online_users': list(online_users[team_id].keys())
-        }, room=room)
+            'online_users': presence.online_users(team_id)
+        })
 
-        emit('user_online', {
-            'user_id': user['id'],
-            'username': user['username'],
-            'team_id': team_id
-        }, room=room, include_self=False)
+        resume = parse_resume(data.get('resume'))
+        if resume:
+            socketio.start_background_task(
+                stream_missed_messages, socketio, request.sid, user.id, resume, data.get('since')
+            )
 
     @socketio.on('leave_team')
     def handle_leave_team(data):
@@ -94,15 +153,8 @@ def register_socket_events(socketio):
         team_id = int(data.get('team_id'))
         leave_room(f'team_{team_id}')
 
-        if team_id in online_users and user['id'] in online_users[team_id]:
-            del online_users[team_id][user['id']]
-            if not online_users[team_id]:
-                del online_users[team_id]
-
-        socketio.emit('online_users_list', {
-            'team_id': team_id,
-            'online_users': list(online_users.get(team_id, {}).keys())
-        }, room=f'team_{team_id}')
+        if presence.leave(team_id, request.sid):
+            presence_deltas.record(team_id, user.id, False)
 
     # ==================== ЧАТ ====================
 
@@ -113,50 +165,108 @@ def register_socket_events(socketio):
             emit('error', {'message': 'Not authenticated'})
             return
 
-        team_id = int(data.get('team_id'))
         chat_id = data.get('chat_id')
         content = data.get('content')
 
         if not content or not chat_id:
             emit('error', {'message': 'Missing required fields'})
             return
+        try:
+            chat_id = int(chat_id)
+        except (TypeError, ValueError):
+            emit('error', {'message': 'chat_id must be an integer'})
+            return
 
+        # team_id берём из БД (через кеш), а не от клиента: для чата вне команды он None
+        is_member, team_id = membership_cache.get(chat_id, user.id)
+        if not is_member:
+            emit('error', {'message': 'Not a chat member'})
+            return
+
+        try:
+            message_id, created_at = message_writer.insert(chat_id, user.id, content)
+        except MessageWriterUnavailable:
+            emit('error', {'message': 'Message storage is busy, try again later'})
+            return
+        except MessageRejected:
+            emit('error', {'message': 'Message rejected, the chat may have been deleted'})
+            return
+        read_cursors.advance(chat_id, user.id, message_id)
+
+        emit('new_message', {
+            'id': message_id,
+            'team_id': team_id,
+            'chat_id': chat_id,
+            'user_id': user.id,
+            'username': user.username,
+            'avatar': avatar_url(user.avatar_hash, thumb=True),
+            'content': content,
+            'created_at': created_at
+        }, room=f'chat_{chat_id}', include_self=True)
+
+    @socketio.on('join_chat')
+    def handle_join_chat(data):
+        """Вход в комнату чата после chat_membership (сокет на другом воркере или новый чат)."""
+        user = connected_users.get(request.sid)
+        if not user:
+            return
+        try:
+            chat_id = int(data.get('chat_id'))
+        except (AttributeError, TypeError, ValueError):
+            emit('error', {'message': 'chat_id must be an integer'})
+            return
         with get_db() as conn:
             if not conn.execute(
-                'SELECT * FROM chat_members WHERE chat_id = ? AND user_id = ?',
-                (chat_id, user['id'])
+                'SELECT 1 FROM chat_members WHERE chat_id = ? AND user_id = ?', (chat_id, user.id)
             ).fetchone():
                 emit('error', {'message': 'Not a chat member'})
                 return
+        join_room(f'chat_{chat_id}')
 
-            cur = conn.execute(
-                'INSERT INTO messages (chat_id, user_id, content) VALUES (?, ?, ?)',
-                (chat_id, user['id'], content)
-            )
-            message_id = cur.lastrowid
-            conn.commit()
+    @socketio.on('leave_chat')
+    def handle_leave_chat(data):
+        try:
+            chat_id = int(data.get('chat_id'))
+        except (AttributeError, TypeError, ValueError):
+            emit('error', {'message': 'chat_id must be an integer'})
+            return
+        leave_room(f'chat_{chat_id}')
 
-            message = conn.execute('SELECT * FROM messages WHERE id = ?', (message_id,)).fetchone()
+    @socketio.on('mark_read')
+    def handle_mark_read(data):
+        user = connected_users.get(request.sid)
+        if not user:
+            return {'error': 'Not authenticated'}
+        try:
+            chat_id, message_id = int(data.get('chat_id')), int(data.get('message_id'))
+        except (AttributeError, TypeError, ValueError):
+            return {'error': 'chat_id and message_id must be integers'}
 
-        emit('new_message', {
-            'id': message_id,
-            'team_id': team_id,
-            'chat_id': chat_id,
-            'user_id': user['id'],
-            'username': user['username'],
-            'avatar': user['avatar'],
-            'content': content,
-            'created_at': message['created_at']
-        }, room=f'team_{team_id}', include_self=True)
+        # Курсор не может уйти дальше реальных сообщений чата — иначе сообщения,
+        # пришедшие позже, сразу считались бы прочитанными
+        with get_db() as conn:
+            if not conn.execute(
+                'SELECT 1 FROM messages WHERE id = ? AND chat_id = ?', (message_id, chat_id)
+            ).fetchone():
+                return {'error': 'Message not found in this chat'}
+
+        # Пишется в БД не сразу, а раз в READ_CURSOR_FLUSH_INTERVAL секунд
+        read_cursors.advance(chat_id, user.id, message_id)
+        return {'status': 'ok'}
 
     @socketio.on('typing')
     def handle_typing(data):
-        team_id = int(data.get('team_id'))
+        user = connected_users.get(request.sid)
+        chat_id = data.get('chat_id')
+        room = f'chat_{chat_id}'
+        # Участие в чате проверять в БД не нужно: в комнате чата сокет только если состоит в нём
+        if not user or room not in rooms():
+            return
         emit('user_typing', {
-            'username': data.get('username'),
-            'chat_id': data.get('chat_id'),
+            'username': user.username,
+            'chat_id': chat_id,
             'is_typing': data.get('is_typing', False)
-        }, room=f'team_{team_id}', include_self=False)
+        }, room=room, include_self=False)
 
     # ==================== ВАЙТБОРД ====================
 
@@ -167,24 +277,127 @@ def register_socket_events(socketio):
             emit('error', {'message': 'Not authenticated'})
             return
         team_id = int(data.get('team_id'))
+        try:
+            viewport = parse_rect(data['viewport']) if data.get('viewport') is not None else None
+        except WhiteboardError as e:
+            emit('error', {'message': str(e)})
+            return
+        with get_db() as conn:
+            if not _is_team_member(conn, team_id, user.id):
+                emit('error', {'message': 'Not a team member'})
+                return
+            # Снимок из горячей копии: клиенту не нужен отдельный GET, а соседям — пересылать доску.
+            # С viewport отдаётся только видимая часть, остальное клиент догружает whiteboard_viewport
+            if viewport is None:
+                whiteboard_id, version, elements = hot_boards.load(conn, team_id, user.id)
+                snapshot = {'elements': encode_elements(elements, user.codec)}
+            else:
+                whiteboard_id, version, elements, next_after = hot_boards.viewport(conn, team_id, user.id, viewport)
+                snapshot = {'elements': encode_elements(elements, user.codec), 'partial': True, 'next_after': next_after}
+            conn.commit()
+        # Общая комната — для событий без элементов, комната кодека — для событий с элементами
         join_room(f'whiteboard_{team_id}')
+        join_room(whiteboard_room(team_id, user.codec))
         emit('joined_whiteboard', {'status': 'success', 'team_id': team_id})
+        return dict(snapshot, team_id=team_id, whiteboard_id=whiteboard_id, version=version)
+
+    @socketio.on('whiteboard_viewport')
+    def handle_whiteboard_viewport(data):
+        """Догрузка элементов при панорамировании.
+
+        loaded — уже загруженные клиентом прямоугольники: пересекающие их
+        элементы он получил раньше, повторно они не отдаются. Ответ (ack):
+        {version, elements, next_after}; при next_after клиент запрашивает
+        ту же область с after=next_after.
+        """
+        user = connected_users.get(request.sid)
+        if not user:
+            emit('error', {'message': 'Not authenticated'})
+            return
+        team_id = int(data.get('team_id'))
+        try:
+            viewport = parse_rect(data.get('viewport'))
+            loaded = parse_rects(data.get('loaded'))
+            after = int(data.get('after') or 0)
+        except (WhiteboardError, TypeError, ValueError) as e:
+            emit('error', {'message': str(e)})
+            return
+        with get_db() as conn:
+            if not _is_team_member(conn, team_id, user.id):
+                emit('error', {'message': 'Not a team member'})
+                return
+            _, version, elements, next_after = hot_boards.viewport(conn, team_id, user.id, viewport, loaded, after)
+            conn.commit()
+        return {
+            'team_id': team_id,
+            'version': version,
+            'elements': encode_elements(elements, user.codec),
+            'next_after': next_after,
+        }
 
     @socketio.on('leave_whiteboard')
     def handle_leave_whiteboard(data):
-        leave_room(f'whiteboard_{int(data.get("team_id"))}')
+        team_id = int(data.get('team_id'))
+        leave_room(f'whiteboard_{team_id}')
+        for codec in CODECS:
+            leave_room(whiteboard_room(team_id, codec))
 
     @socketio.on('whiteboard_draw')
     def handle_whiteboard_draw(data):
+        user = connected_users.get(request.sid)
+        if not user:
+            emit('error', {'message': 'Not authenticated'})
+            return
         team_id = int(data.get('team_id'))
         element = data.get('element')
-        if not element:
+        if isinstance(element, bytes):
+            try:
+                element = decode_element(element)
+            except CodecError as e:
+                emit('error', {'message': str(e)})
+                return
+        if not isinstance(element, dict):
             return
+        # Старые клиенты не присваивают id — без него элемент нельзя будет изменить операцией
+        element.setdefault('id', new_element_id())
+
+        ops = _persist_whiteboard_ops(team_id, user.id, [{'op': 'add', 'id': element['id'], 'element': element}])
+        if ops is None:
+            emit('error', {'message': 'Not a team member'})
+            return
+
+        whiteboard_frames.finish(team_id, user.username)
+        emit_elements(emit, 'whiteboard_update', {
+            'username': user.username,
+            'element': element,
+            'version': ops[0]['version']
+        }, team_id, include_self=False)
+        return {'id': element['id'], 'version': ops[0]['version']}
+
+    @socketio.on('whiteboard_ops')
+    def handle_whiteboard_ops(data):
         user = connected_users.get(request.sid)
-        emit('whiteboard_update', {
-            'username': user['username'] if user else data.get('username'),
-            'element': element
-        }, room=f'whiteboard_{team_id}', include_self=False)
+        if not user:
+            emit('error', {'message': 'Not authenticated'})
+            return
+        team_id = int(data.get('team_id'))
+        try:
+            ops = validate_ops(data.get('ops'))
+        except WhiteboardError as e:
+            emit('error', {'message': str(e)})
+            return
+
+        ops = _persist_whiteboard_ops(team_id, user.id, ops)
+        if ops is None:
+            emit('error', {'message': 'Not a team member'})
+            return
+
+        emit_elements(emit, 'whiteboard_ops', {
+            'team_id': team_id,
+            'username': user.username,
+            'ops': ops
+        }, team_id, include_self=False)
+        return {'version': ops[-1]['version']}
 
     @socketio.on('whiteboard_drawing')
     def handle_whiteboard_drawing(data):
@@ -192,11 +405,15 @@ def register_socket_events(socketio):
         element = data.get('element')
         if not element:
             return
+        if isinstance(element, bytes):
+            # Разбираем сразу: битый элемент не должен сорвать кадр всей комнаты
+            try:
+                element = decode_element(element)
+            except CodecError:
+                return
         user = connected_users.get(request.sid)
-        emit('whiteboard_live_drawing', {
-            'username': user['username'] if user else data.get('username'),
-            'element': element
-        }, room=f'whiteboard_{team_id}', include_self=False)
+        # Уходит в комнату с ближайшим whiteboard_frame, промежуточные состояния схлопываются
+        whiteboard_frames.drawing(team_id, user.username if user else data.get('username'), element)
 
     @socketio.on('whiteboard_cursor')
     def handle_whiteboard_cursor(data):
@@ -205,10 +422,7 @@ def register_socket_events(socketio):
         if x is None or y is None:
             return
         user = connected_users.get(request.sid)
-        emit('whiteboard_cursor_update', {
-            'username': user['username'] if user else data.get('username'),
-            'x': x, 'y': y
-        }, room=f'whiteboard_{team_id}', include_self=False)
+        whiteboard_frames.cursor(team_id, user.username if user else data.get('username'), x, y)
 
     @socketio.on('whiteboard_clear')
     def handle_whiteboard_clear(data):
@@ -216,23 +430,17 @@ def register_socket_events(socketio):
         if not user:
             return
         team_id = int(data.get('team_id'))
+        ops = _persist_whiteboard_ops(team_id, user.id, [{'op': 'clear'}])
+        if ops is None:
+            emit('error', {'message': 'Not a team member'})
+            return
+        whiteboard_frames.clear(team_id)
         emit('whiteboard_cleared', {
-            'username': user['username'],
-            'team_id': team_id
+            'username': user.username,
+            'team_id': team_id,
+            'version': ops[0]['version']
         }, room=f'whiteboard_{team_id}', include_self=True)
 
-    @socketio.on('whiteboard_sync')
-    def handle_whiteboard_sync(data):
-        team_id = int(data.get('team_id'))
-        elements = data.get('elements')
-        if elements is None:
-            return
-        user = connected_users.get(request.sid)
-        emit('whiteboard_sync', {
-            'username': user['username'] if user else data.get('username'),
-            'elements': elements
-        }, room=f'whiteboard_{team_id}', include_self=False)
-
     # ==================== ГОЛОСОВАНИЯ ====================
 
     @socketio.on('poll_vote')
@@ -247,7 +455,7 @@ def register_socket_events(socketio):
             'poll_id': poll_id,
             'option_id': option_id,
             'votes': data.get('votes', 0),
-            'voter': user['username'] if user else data.get('username')
+            'voter': user.username if user else data.get('username')
         }, room=f'team_{team_id}', include_self=True)
 
     # ==================== ЗАЯВКИ В КОМАНДУ ====================
@@ -283,7 +491,7 @@ def register_socket_events(socketio):
         user = connected_users.get(request.sid)
         if not user:
             return
-        join_room(f'user_{user["id"]}')
+        join_room(f'user_{user.id}')
 
     # ==================== УТИЛИТЫ ====================
 
@@ -292,5 +500,5 @@ def register_socket_events(socketio):
         team_id = int(data.get('team_id'))
         emit('online_users_list', {
             'team_id': team_id,
-            'online_users': list(online_users.get(team_id, {}).keys())
+            'online_users': presence.online_users(team_id)
         })
@@ -0,0 +1,447 @@
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+
+from database import ConnectionPool
+
+# Как часто (в секундах) накопленные изменения присутствия рассылаются командам
+PRESENCE_FLUSH_INTERVAL = float(os.environ.get('PRESENCE_FLUSH_INTERVAL', 0.25))
+
+# Где хранится присутствие: memory — в процессе (один воркер), sqlite / redis — общее для всех воркеров
+PRESENCE_BACKEND = os.environ.get('PRESENCE_BACKEND', 'memory')
+PRESENCE_SQLITE_PATH = os.environ.get(
+    'PRESENCE_SQLITE_PATH', os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'presence.db')
+)
+PRESENCE_REDIS_URL = os.environ.get('PRESENCE_REDIS_URL', 'redis://localhost:6379/0')
+# Сколько соединений с файлом присутствия держит воркер (для sqlite)
+PRESENCE_SQLITE_POOL_SIZE = int(os.environ.get('PRESENCE_SQLITE_POOL_SIZE', 4))
+
+# Воркер продлевает свою запись раз в HEARTBEAT секунд; записи воркера,
+# молчащего дольше TTL, считаются осиротевшими (процесс упал) и удаляются
+PRESENCE_HEARTBEAT_INTERVAL = float(os.environ.get('PRESENCE_HEARTBEAT_INTERVAL', 5))
+PRESENCE_TTL = float(os.environ.get('PRESENCE_TTL', 15))
+
+
+def _worker_id():
+    return f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+
+
+class PresenceBackend(ABC):
+    """Интерфейс хранилища присутствия.
+
+    join/leave/disconnect возвращают переходы онлайн ↔ офлайн, по ним
+    рассылается presence_delta. heartbeat() и expire() вызываются
+    периодически (см. start_heartbeat): общие хранилища по ним находят
+    сокеты упавших воркеров.
+    """
+
+    @abstractmethod
+    def join(self, team_id, user_id, sid):
+        """Отмечает сокет в команде. True — пользователь только что стал онлайн в ней."""
+
+    @abstractmethod
+    def leave(self, team_id, sid):
+        """Убирает сокет из команды. True — у пользователя там не осталось сокетов."""
+
+    @abstractmethod
+    def disconnect(self, sid):
+        """Убирает сокет отовсюду. Возвращает (user_id, [команды, где пользователь ушёл в офлайн])."""
+
+    @abstractmethod
+    def is_online(self, team_id, user_id):
+        """Есть ли у пользователя хотя бы один сокет в команде."""
+
+    @abstractmethod
+    def online_users(self, team_id):
+        """Список user_id онлайн в команде."""
+
+    @abstractmethod
+    def teams_of(self, user_id):
+        """Команды, где пользователь онлайн."""
+
+    def heartbeat(self):
+        pass
+
+    def expire(self):
+        """Удаляет сокеты воркеров, переставших слать heartbeat. Возвращает [(team_id, user_id)] ушедших в офлайн."""
+        return []
+
+
+class MemoryPresence(PresenceBackend):
+    """Кто из пользователей онлайн в какой команде (в памяти процесса).
+
+    Хранит три индекса — команда → пользователи → сокеты, пользователь → команды
+    и сокет → (пользователь, команды), — поэтому отключение сокета обходит
+    только его команды, а проверка «онлайн ли» — O(1). У пользователя может быть
+    несколько сокетов (вкладки, устройства): из команды он «уходит», только
+    когда закрыт последний из них.
+    """
+
+    def __init__(self):
+        self._teams = {}       # team_id -> {user_id: {sid, ...}}
+        self._user_teams = {}  # user_id -> {team_id, ...}
+        self._sids = {}        # sid -> (user_id, {team_id, ...})
+        self._lock = threading.Lock()
+
+    def join(self, team_id, user_id, sid):
+        with self._lock:
+            members = self._teams.setdefault(team_id, {})
+            sids = members.get(user_id)
+            became_online = not sids
+            if became_online:
+                sids = members[user_id] = set()
+                self._user_teams.setdefault(user_id, set()).add(team_id)
+            sids.add(sid)
+            self._sids.setdefault(sid, (user_id, set()))[1].add(team_id)
+            return became_online
+
+    def leave(self, team_id, sid):
+        with self._lock:
+            entry = self._sids.get(sid)
+            if not entry or team_id not in entry[1]:
+                return False
+            user_id, sid_teams = entry
+            sid_teams.discard(team_id)
+            if not sid_teams:
+                del self._sids[sid]
+            return self._remove(team_id, user_id, sid)
+
+    def disconnect(self, sid):
+        with self._lock:
+            entry = self._sids.pop(sid, None)
+            if not entry:
+                return None, []
+            user_id, sid_teams = entry
+            return user_id, [team_id for team_id in sid_teams if self._remove(team_id, user_id, sid)]
+
+    def is_online(self, team_id, user_id):
+        return user_id in self._teams.get(team_id, ())
+
+    def online_users(self, team_id):
+        with self._lock:
+            return list(self._teams.get(team_id, ()))
+
+    def teams_of(self, user_id):
+        with self._lock:
+            return set(self._user_teams.get(user_id, ()))
+
+    def _remove(self, team_id, user_id, sid):
+        members = self._teams.get(team_id)
+        sids = members.get(user_id) if members else None
+        if not sids:
+            return False
+        sids.discard(sid)
+        if sids:
+            return False
+        del members[user_id]
+        if not members:
+            del self._teams[team_id]
+        user_teams = self._user_teams[user_id]
+        user_teams.discard(team_id)
+        if not user_teams:
+            del self._user_teams[user_id]
+        return True
+
+
+_SQLITE_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS presence_workers (
+        worker TEXT PRIMARY KEY,
+        heartbeat_at REAL NOT NULL
+    ) WITHOUT ROWID;
+
+    CREATE TABLE IF NOT EXISTS presence_sockets (
+        team_id INTEGER NOT NULL,
+        user_id INTEGER NOT NULL,
+        sid TEXT NOT NULL,
+        worker TEXT NOT NULL,
+        PRIMARY KEY (team_id, user_id, sid)
+    ) WITHOUT ROWID;
+
+    CREATE INDEX IF NOT EXISTS idx_presence_sockets_sid ON presence_sockets(sid);
+    CREATE INDEX IF NOT EXISTS idx_presence_sockets_user ON presence_sockets(user_id);
+    CREATE INDEX IF NOT EXISTS idx_presence_sockets_worker ON presence_sockets(worker);
+'''
+
+
+def _connect_sqlite_presence(path):
+    # isolation_level=None: транзакции открываем сами через BEGIN IMMEDIATE
+    conn = sqlite3.connect(path, timeout=5, isolation_level=None, check_same_thread=False)
+    conn.execute('PRAGMA journal_mode = WAL')
+    conn.execute('PRAGMA synchronous = OFF')
+    return conn
+
+
+class SqlitePresence(PresenceBackend):
+    """Присутствие в отдельном файле SQLite, общем для воркеров на одной машине.
+
+    Данные эфемерные, поэтому это не основная БД и не миграции: схема
+    создаётся при старте, synchronous = OFF. Соединения берутся из
+    ограниченного ConnectionPool, как у основной БД: без открытия файла на
+    каждый поток-обработчик, а под eventlet/gevent — в пуле потоков ОС.
+    """
+
+    def __init__(self, path=PRESENCE_SQLITE_PATH, ttl=PRESENCE_TTL, pool_size=PRESENCE_SQLITE_POOL_SIZE):
+        self.path = path
+        self.ttl = ttl
+        self.worker = _worker_id()
+        self._pool = ConnectionPool(path, size=pool_size, connect=_connect_sqlite_presence)
+        with self._pool.connection() as conn:
+            conn.executescript(_SQLITE_SCHEMA)
+        self.heartbeat()
+
+    def _transaction(self, fn):
+        with self._pool.connection() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                result = fn(conn)
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+            conn.execute('COMMIT')
+            return result
+
+    @staticmethod
+    def _has_sockets(conn, team_id, user_id):
+        return conn.execute(
+            'SELECT 1 FROM presence_sockets WHERE team_id = ? AND user_id = ? LIMIT 1', (team_id, user_id)
+        ).fetchone() is not None
+
+    def join(self, team_id, user_id, sid):
+        def fn(conn):
+            was_online = self._has_sockets(conn, team_id, user_id)
+            conn.execute(
+                'INSERT OR IGNORE INTO presence_sockets (team_id, user_id, sid, worker) VALUES (?, ?, ?, ?)',
+                (team_id, user_id, sid, self.worker)
+            )
+            return not was_online
+        return self._transaction(fn)
+
+    def leave(self, team_id, sid):
+        def fn(conn):
+            row = conn.execute(
+                'DELETE FROM presence_sockets WHERE team_id = ? AND sid = ? RETURNING user_id', (team_id, sid)
+            ).fetchone()
+            return bool(row) and not self._has_sockets(conn, team_id, row[0])
+        return self._transaction(fn)
+
+    def disconnect(self, sid):
+        def fn(conn):
+            rows = conn.execute(
+                'DELETE FROM presence_sockets WHERE sid = ? RETURNING team_id, user_id', (sid,)
+            ).fetchall()
+            if not rows:
+                return None, []
+            return rows[0][1], [team_id for team_id, user_id in rows if not self._has_sockets(conn, team_id, user_id)]
+        return self._transaction(fn)
+
+    def is_online(self, team_id, user_id):
+        with self._pool.connection() as conn:
+            return self._has_sockets(conn, team_id, user_id)
+
+    def online_users(self, team_id):
+        with self._pool.connection() as conn:
+            return [row[0] for row in conn.execute(
+                'SELECT DISTINCT user_id FROM presence_sockets WHERE team_id = ?', (team_id,)
+            )]
+
+    def teams_of(self, user_id):
+        with self._pool.connection() as conn:
+            return {row[0] for row in conn.execute(
+                'SELECT DISTINCT team_id FROM presence_sockets WHERE user_id = ?', (user_id,)
+            )}
+
+    def heartbeat(self):
+        with self._pool.connection() as conn:
+            conn.execute(
+                'INSERT INTO presence_workers (worker, heartbeat_at) VALUES (?, ?) '
+                'ON CONFLICT (worker) DO UPDATE SET heartbeat_at = excluded.heartbeat_at',
+                (self.worker, time.time())
+            )
+
+    def expire(self):
+        def fn(conn):
+            stale = [row[0] for row in conn.execute(
+                'DELETE FROM presence_workers WHERE heartbeat_at < ? RETURNING worker', (time.time() - self.ttl,)
+            )]
+            removed = set()
+            for worker in stale:
+                removed.update(conn.execute(
+                    'DELETE FROM presence_sockets WHERE worker = ? RETURNING team_id, user_id', (worker,)
+                ).fetchall())
+            return [(team_id, user_id) for team_id, user_id in removed
+                    if not self._has_sockets(conn, team_id, user_id)]
+        return self._transaction(fn)
+
+
+class RedisPresence(PresenceBackend):
+    """Присутствие в Redis (или совместимом сервере) — для воркеров на разных машинах.
+
+    Ключи (prefix = presence):
+      {prefix}:team:{team_id}              SET   пользователей онлайн в команде
+      {prefix}:sockets:{team_id}:{user_id} SET   сокетов пользователя в команде
+      {prefix}:user:{user_id}              SET   команд пользователя
+      {prefix}:sid:{sid}                   HASH  user — владелец сокета
+      {prefix}:sid:{sid}:teams             SET   команд сокета
+      {prefix}:worker:{worker}             SET   сокетов воркера
+      {prefix}:workers                     ZSET  воркер -> время последнего heartbeat
+    """
+
+    def __init__(self, client, ttl=PRESENCE_TTL, prefix='presence'):
+        self.redis = client
+        self.ttl = ttl
+        self.prefix = prefix
+        self.worker = _worker_id()
+        self.heartbeat()
+
+    def _key(self, *parts):
+        return ':'.join((self.prefix, *map(str, parts)))
+
+    def join(self, team_id, user_id, sid):
+        pipe = self.redis.pipeline()
+        pipe.sadd(self._key('sockets', team_id, user_id), sid)
+        pipe.sadd(self._key('team', team_id), user_id)
+        pipe.sadd(self._key('user', user_id), team_id)
+        pipe.hset(self._key('sid', sid), 'user', user_id)
+        pipe.sadd(self._key('sid', sid, 'teams'), team_id)
+        pipe.sadd(self._key('worker', self.worker), sid)
+        return pipe.execute()[1] == 1
+
+    def leave(self, team_id, sid):
+        user_id = self.redis.hget(self._key('sid', sid), 'user')
+        if user_id is None or not self.redis.srem(self._key('sid', sid, 'teams'), team_id):
+            return False
+        return self._remove(team_id, int(user_id), sid)
+
+    def disconnect(self, sid):
+        user_id = self.redis.hget(self._key('sid', sid), 'user')
+        if user_id is None:
+            return None, []
+        user_id = int(user_id)
+        teams = [int(team_id) for team_id in self.redis.smembers(self._key('sid', sid, 'teams'))]
+        self.redis.delete(self._key('sid', sid), self._key('sid', sid, 'teams'))
+        self.redis.srem(self._key('worker', self.worker), sid)
+        return user_id, [team_id for team_id in teams if self._remove(team_id, user_id, sid)]
+
+    def _remove(self, team_id, user_id, sid):
+        sockets = self._key('sockets', team_id, user_id)
+        self.redis.srem(sockets, sid)
+
+        # WATCH: если другой воркер успеет добавить сокет между SCARD и SREM, транзакция повторится
+        def fn(pipe):
+            if pipe.scard(sockets):
+                return False
+            pipe.multi()
+            pipe.srem(self._key('team', team_id), user_id)
+            pipe.srem(self._key('user', user_id), team_id)
+            return True
+
+        return self.redis.transaction(fn, sockets, value_from_callable=True)
+
+    def is_online(self, team_id, user_id):
+        return bool(self.redis.sismember(self._key('team', team_id), user_id))
+
+    def online_users(self, team_id):
+        return [int(user_id) for user_id in self.redis.smembers(self._key('team', team_id))]
+
+    def teams_of(self, user_id):
+        return {int(team_id) for team_id in self.redis.smembers(self._key('user', user_id))}
+
+    def heartbeat(self):
+        self.redis.zadd(self._key('workers'), {self.worker: time.time()})
+
+    def expire(self):
+        offline = []
+        for worker in self.redis.zrangebyscore(self._key('workers'), '-inf', time.time() - self.ttl):
+            # ZREM вернёт 1 только одному из воркеров, одновременно заметивших просрочку
+            if not self.redis.zrem(self._key('workers'), worker):
+                continue
+            worker_key = self._key('worker', worker)
+            for sid in self.redis.smembers(worker_key):
+                user_id, teams = self.disconnect(sid)
+                offline += [(team_id, user_id) for team_id in teams]
+            self.redis.delete(worker_key)
+        return offline
+
+
+def create_presence_backend(name=PRESENCE_BACKEND):
+    if name == 'memory':
+        return MemoryPresence()
+    if name == 'sqlite':
+        return SqlitePresence()
+    if name == 'redis':
+        if PRESENCE_REDIS_URL.startswith('fakeredis://'):
+            # Для локальной проверки без сервера: pip install fakeredis (только в пределах процесса)
+            import fakeredis
+            return RedisPresence(fakeredis.FakeRedis(decode_responses=True))
+        import redis
+        return RedisPresence(redis.Redis.from_url(PRESENCE_REDIS_URL, decode_responses=True))
+    raise ValueError(f'Unknown PRESENCE_BACKEND: {name}')
+
+
+def start_heartbeat(socketio, deltas):
+    """Фоновая задача: heartbeat этого воркера и уборка сокетов упавших."""
+    def run():
+        while True:
+            socketio.sleep(PRESENCE_HEARTBEAT_INTERVAL)
+            try:
+                presence.heartbeat()
+                for team_id, user_id in presence.expire():
+                    deltas.record(team_id, user_id, False)
+            except Exception:
+                # Хранилище временно недоступно — повторим на следующем тике
+                pass
+
+    socketio.start_background_task(run)
+
+
+class PresenceDeltaBuffer:
+    """Копит изменения присутствия по командам и рассылает их раз в тик.
+
+    Раньше каждый join/leave рассылал всей комнате полный список онлайн —
+    при массовом переподключении большой команды это O(n²) байт. Теперь
+    в комнату уходит одно событие presence_delta за тик: {team_id, added, removed};
+    полный список получает только подключившийся сокет (в joined_team).
+    Если пользователь за тик успел войти и выйти, рассылается последнее состояние.
+    """
+
+    def __init__(self, interval=PRESENCE_FLUSH_INTERVAL):
+        self.interval = interval
+        self._pending = {}  # team_id -> {user_id: online}
+        self._lock = threading.Lock()
+        self._socketio = None
+
+    def start(self, socketio):
+        if self._socketio is None:
+            self._socketio = socketio
+            socketio.start_background_task(self._run)
+
+    def record(self, team_id, user_id, online):
+        with self._lock:
+            self._pending.setdefault(team_id, {})[user_id] = online
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        for team_id, changes in pending.items():
+            self._socketio.emit('presence_delta', {
+                'team_id': team_id,
+                'added': [user_id for user_id, online in changes.items() if online],
+                'removed': [user_id for user_id, online in changes.items() if not online],
+            }, room=f'team_{team_id}')
+
+    def _run(self):
+        while True:
+            self._socketio.sleep(self.interval)
+            try:
+                self.flush()
+            except Exception:
+                # Следующий join/leave всё равно разошлёт актуальное состояние
+                pass
+
+
+presence = create_presence_backend()
+presence_deltas = PresenceDeltaBuffer()
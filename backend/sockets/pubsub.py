@@ -0,0 +1,109 @@
+import os
+import pickle
+import sqlite3
+import time
+
+import socketio
+
+from database import ConnectionPool
+
+# Очередь для рассылки событий между воркерами: пусто — один процесс,
+# redis://... — Redis (штатный RedisManager), sqlite:///путь — локальная замена на одной машине
+SOCKETIO_MESSAGE_QUEUE = os.environ.get('SOCKETIO_MESSAGE_QUEUE', '')
+
+_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS socketio_queue (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        channel TEXT NOT NULL,
+        payload BLOB NOT NULL,
+        created_at REAL NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS idx_socketio_queue_created ON socketio_queue(created_at);
+'''
+
+
+def _connect_queue(path):
+    conn = sqlite3.connect(path, timeout=5, isolation_level=None, check_same_thread=False)
+    conn.execute('PRAGMA journal_mode = WAL')
+    conn.execute('PRAGMA synchronous = OFF')
+    return conn
+
+
+class SqlitePubSubManager(socketio.PubSubManager):
+    """Менеджер клиентов Socket.IO, передающий события через таблицу SQLite.
+
+    Замена Redis для нескольких воркеров на одной машине и для проверки
+    горизонтального режима без внешних сервисов. Каждый воркер опрашивает
+    таблицу раз в poll_interval секунд и забирает строки после последней
+    прочитанной; старше retention секунд — удаляются. Соединения берутся из
+    небольшого ConnectionPool: под eventlet/gevent каждый опрос и публикация
+    выполняются в пуле потоков ОС и не останавливают цикл событий.
+    """
+
+    name = 'sqlite'
+
+    def __init__(self, url='sqlite:///socketio_queue.db', channel='socketio', write_only=False,
+                 logger=None, poll_interval=0.01, retention=60, pool_size=4):
+        # sqlite:///relative.db и sqlite:////abs/path.db — как в SQLAlchemy
+        self.path = url[len('sqlite:///'):]
+        self.poll_interval = poll_interval
+        self.retention = retention
+        self._pool = ConnectionPool(self.path, size=pool_size, connect=_connect_queue)
+        self._last_cleanup = 0
+        super().__init__(channel=channel, write_only=write_only, logger=logger)
+        with self._pool.connection() as conn:
+            conn.executescript(_SCHEMA)
+
+    def _publish(self, data):
+        now = time.time()
+        with self._pool.connection() as conn:
+            conn.execute(
+                'INSERT INTO socketio_queue (channel, payload, created_at) VALUES (?, ?, ?)',
+                (self.channel, pickle.dumps(data), now)
+            )
+            if now - self._last_cleanup > self.retention:
+                self._last_cleanup = now
+                conn.execute('DELETE FROM socketio_queue WHERE created_at < ?', (now - self.retention,))
+
+    def _listen(self):
+        with self._pool.connection() as conn:
+            # Только события, опубликованные после старта воркера
+            last_id = conn.execute('SELECT COALESCE(MAX(id), 0) FROM socketio_queue').fetchone()[0]
+        while True:
+            with self._pool.connection() as conn:
+                rows = conn.execute(
+                    'SELECT id, payload FROM socketio_queue WHERE id > ? AND channel = ? ORDER BY id',
+                    (last_id, self.channel)
+                ).fetchall()
+            for row_id, payload in rows:
+                last_id = row_id
+                yield pickle.loads(payload)
+            if not rows:
+                self._sleep(self.poll_interval)
+
+    def _sleep(self, seconds):
+        # Без сервера (бенчмарк, write_only-эмиттер) — обычный sleep
+        if self.server:
+            self.server.sleep(seconds)
+        else:
+            time.sleep(seconds)
+
+
+def create_pubsub_manager(url, channel, write_only=False):
+    """Менеджер очереди для url — для своих каналов поверх той же очереди (см. cache_bus)."""
+    if url.startswith('sqlite:'):
+        return SqlitePubSubManager(url, channel=channel, write_only=write_only)
+    if url.startswith(('redis://', 'rediss://')):
+        return socketio.RedisManager(url, channel=channel, write_only=write_only)
+    if url.startswith('kafka://'):
+        return socketio.KafkaManager(url, channel=channel, write_only=write_only)
+    return socketio.KombuManager(url, channel=channel, write_only=write_only)
+
+
+def socketio_queue_options(url=SOCKETIO_MESSAGE_QUEUE):
+    """Аргументы SocketIO(...) для выбранной очереди."""
+    if not url:
+        return {}
+    if url.startswith('sqlite:'):
+        return {'client_manager': SqlitePubSubManager(url)}
+    return {'message_queue': url}
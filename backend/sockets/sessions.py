@@ -0,0 +1,43 @@
+import sys
+import time
+
+
+class SocketSession:
+    """Данные аутентифицированного сокета — только то, что нужно обработчикам.
+
+    Раньше в реестре лежал dict(user) целиком (с password_hash, bio и base64-аватаром),
+    и память росла вместе с размером аватаров, а не с числом соединений.
+    """
+
+    __slots__ = ('id', 'username', 'avatar_hash', 'codec', 'connected_at')
+
+    def __init__(self, user_id, username, avatar_hash=None, codec='json'):
+        self.id = user_id
+        self.username = username
+        self.avatar_hash = avatar_hash
+        # Формат элементов доски, который клиент запросил при подключении (см. stroke_codec)
+        self.codec = codec
+        self.connected_at = time.time()
+
+    @classmethod
+    def from_user(cls, user, codec='json'):
+        return cls(user['id'], user['username'], user['avatar_hash'], codec)
+
+    def footprint(self):
+        """Примерный размер в байтах вместе со строками."""
+        return (
+            sys.getsizeof(self) + sys.getsizeof(self.username)
+            + (sys.getsizeof(self.avatar_hash) if self.avatar_hash else 0)
+        )
+
+
+def sessions_stats(sessions):
+    """Сводка по реестру {sid: SocketSession} для /api/admin/stats."""
+    sessions = list(sessions.values())
+    total = sum(session.footprint() for session in sessions)
+    return {
+        'connections': len(sessions),
+        'users': len({session.id for session in sessions}),
+        'bytes': total,
+        'avg_bytes': round(total / len(sessions)) if sessions else 0,
+    }
@@ -0,0 +1,92 @@
+from database import get_db
+
+# Сколько сообщений в одном sync_batch и максимум на чат за одно переподключение.
+# Если пропущено больше, клиент получает truncated и догружает историю через REST.
+SYNC_BATCH_SIZE = 200
+SYNC_MAX_PER_CHAT = 2000
+
+SYNC_FIELDS = ['id', 'user_id', 'username', 'content', 'created_at', 'updated_at']
+
+
+def parse_resume(raw):
+    """{chat_id: last_seen_id} из данных клиента (ключи JSON приходят строками)."""
+    if not isinstance(raw, dict):
+        return {}
+    resume = {}
+    for chat_id, last_id in raw.items():
+        try:
+            resume[int(chat_id)] = int(last_id or 0)
+        except (TypeError, ValueError):
+            continue
+    return resume
+
+
+def stream_missed_messages(socketio, sid, user_id, resume, since=None):
+    """Досылает сокету sid пропущенное с момента отключения.
+
+    resume — {chat_id: id последнего полученного сообщения}; since — synced_at
+    из прошлого sync_complete, по нему находятся правки и удаления старых
+    сообщений. Данные уходят пачками sync_batch (строки — массивы в порядке
+    fields), в конце — sync_complete с новым synced_at.
+    """
+    with get_db() as conn:
+        synced_at = conn.execute('SELECT CURRENT_TIMESTAMP').fetchone()[0]
+        placeholders = ','.join('?' * len(resume))
+        member_chats = [
+            row['chat_id'] for row in conn.execute(
+                f'SELECT chat_id FROM chat_members WHERE user_id = ? AND chat_id IN ({placeholders})',
+                (user_id, *resume)
+            )
+        ] if resume else []
+
+    for chat_id in member_chats:
+        _stream_chat(socketio, sid, chat_id, resume[chat_id], since)
+
+    socketio.emit('sync_complete', {'synced_at': synced_at, 'chats': member_chats}, room=sid)
+
+
+def _stream_chat(socketio, sid, chat_id, last_id, since):
+    updated, deleted = [], []
+    if since:
+        with get_db() as conn:
+            changes = conn.execute('''
+                SELECT m.id, m.user_id, u.username, m.content, m.created_at, m.updated_at, m.is_deleted
+                FROM messages m
+                JOIN users u ON m.user_id = u.id
+                WHERE m.chat_id = ? AND m.updated_at >= ? AND m.id <= ?
+                ORDER BY m.id
+            ''', (chat_id, since, last_id)).fetchall()
+        for row in changes:
+            if row['is_deleted']:
+                deleted.append(row['id'])
+            else:
+                updated.append([row[field] for field in SYNC_FIELDS])
+
+    sent = 0
+    while True:
+        with get_db() as conn:
+            rows = conn.execute('''
+                SELECT m.id, m.user_id, u.username, m.content, m.created_at, m.updated_at
+                FROM messages m
+                JOIN users u ON m.user_id = u.id
+                WHERE m.chat_id = ? AND m.id > ? AND m.is_deleted = 0
+                ORDER BY m.id
+                LIMIT ?
+            ''', (chat_id, last_id, SYNC_BATCH_SIZE)).fetchall()
+
+        sent += len(rows)
+        truncated = len(rows) == SYNC_BATCH_SIZE and sent >= SYNC_MAX_PER_CHAT
+        done = len(rows) < SYNC_BATCH_SIZE or truncated
+        socketio.emit('sync_batch', {
+            'chat_id': chat_id,
+            'fields': SYNC_FIELDS,
+            'rows': [[row[field] for field in SYNC_FIELDS] for row in rows],
+            'updated': updated,
+            'deleted': deleted,
+            'done': done,
+            'truncated': truncated,
+        }, room=sid)
+        updated, deleted = [], []
+        if done:
+            return
+        last_id = rows[-1]['id']
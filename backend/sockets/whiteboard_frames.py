@@ -0,0 +1,78 @@
+import os
+import threading
+
+from stroke_codec import emit_elements
+
+# Сколько кадров в секунду рассылается в комнату доски
+WHITEBOARD_FRAME_HZ = float(os.environ.get('WHITEBOARD_FRAME_HZ', 20))
+
+
+class WhiteboardFrameAggregator:
+    """Собирает курсоры и незавершённые фигуры доски и рассылает их кадрами.
+
+    Клиенты шлют whiteboard_cursor и whiteboard_drawing на каждое движение
+    мыши; раньше каждое событие сразу уходило всей комнате. Теперь по каждой
+    комнате хранится только последний курсор и последнее состояние фигуры
+    каждого пользователя, и раз в тик в комнату уходит один whiteboard_frame:
+    {team_id, cursors: [{username, x, y}], drawing: [{username, element}]}.
+    Число исходящих сообщений зависит от частоты кадров, а не от частоты событий.
+    """
+
+    def __init__(self, hz=WHITEBOARD_FRAME_HZ):
+        self.interval = 1 / hz
+        self._rooms = {}  # team_id -> {'cursors': {username: (x, y)}, 'drawing': {username: element}}
+        self._lock = threading.Lock()
+        self._socketio = None
+
+    def start(self, socketio):
+        if self._socketio is None:
+            self._socketio = socketio
+            socketio.start_background_task(self._run)
+
+    def _room(self, team_id):
+        return self._rooms.setdefault(team_id, {'cursors': {}, 'drawing': {}})
+
+    def cursor(self, team_id, username, x, y):
+        with self._lock:
+            self._room(team_id)['cursors'][username] = (x, y)
+
+    def drawing(self, team_id, username, element):
+        with self._lock:
+            self._room(team_id)['drawing'][username] = element
+
+    def finish(self, team_id, username):
+        """Фигура завершена (whiteboard_draw) — её промежуточное состояние больше не рассылаем."""
+        with self._lock:
+            room = self._rooms.get(team_id)
+            if room:
+                room['drawing'].pop(username, None)
+
+    def clear(self, team_id):
+        with self._lock:
+            room = self._rooms.get(team_id)
+            if room:
+                room['drawing'].clear()
+
+    def flush(self):
+        with self._lock:
+            rooms, self._rooms = self._rooms, {}
+        for team_id, room in rooms.items():
+            if not room['cursors'] and not room['drawing']:
+                continue
+            emit_elements(self._socketio.emit, 'whiteboard_frame', {
+                'team_id': team_id,
+                'cursors': [{'username': u, 'x': x, 'y': y} for u, (x, y) in room['cursors'].items()],
+                'drawing': [{'username': u, 'element': e} for u, e in room['drawing'].items()],
+            }, team_id)
+
+    def _run(self):
+        while True:
+            self._socketio.sleep(self.interval)
+            try:
+                self.flush()
+            except Exception:
+                # Кадр потерян — следующий всё равно несёт актуальные позиции
+                pass
+
+
+whiteboard_frames = WhiteboardFrameAggregator()
@@ -0,0 +1,169 @@
+import json
+import math
+
+# Компактный бинарный формат элементов доски.
+#
+# Элемент — JSON без поля points, а точки (path, triangle) упакованы отдельно:
+# координаты квантуются до 1/POINT_SCALE пикселя, кодируются разностью
+# с предыдущей точкой и пишутся zigzag-varint'ами. Штрих пера — сотни
+# близких точек, так что на точку обычно уходит 2–4 байта вместо ~30 в JSON.
+#
+#     [FORMAT_VERSION] [флаги] [varint длина заголовка] [заголовок JSON]
+#     [varint число точек] [zigzag dx, zigzag dy]...
+#
+# Тот же формат разбирает frontend/src/shared/socket/strokeCodec.js.
+
+FORMAT_VERSION = 1
+POINT_SCALE = 10  # точность координат — 0.1 px
+# Предел |координаты| в px: разности точек после квантования остаются целыми,
+# точными и в Number на стороне strokeCodec.js (до 2**53)
+MAX_COORDINATE = 1e9
+
+_FLAG_POINTS = 1
+
+CODECS = ('json', 'binary')
+
+
+class CodecError(ValueError):
+    pass
+
+
+def _write_varint(out, value):
+    while value > 0x7F:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _read_varint(data, pos):
+    result = shift = 0
+    while True:
+        if pos >= len(data) or shift > 63:
+            raise CodecError('Truncated varint')
+        byte = data[pos]
+        pos += 1
+        result |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return result, pos
+        shift += 7
+
+
+def _valid_coordinate(value):
+    return math.isfinite(value) and -MAX_COORDINATE <= value <= MAX_COORDINATE
+
+
+def check_points(points):
+    """Числовые координаты точек должны быть конечны и не больше MAX_COORDINATE по модулю."""
+    if not isinstance(points, list):
+        return
+    for p in points:
+        if not isinstance(p, dict):
+            continue
+        for value in (p.get('x'), p.get('y')):
+            if type(value) in (int, float) and not _valid_coordinate(value):
+                raise CodecError('Point coordinates must be finite and within range')
+
+
+def _packable_points(points):
+    if not isinstance(points, list):
+        return False
+    for p in points:
+        if not isinstance(p, dict) or len(p) != 2:
+            return False
+        x, y = p.get('x'), p.get('y')
+        if type(x) not in (int, float) or type(y) not in (int, float):
+            return False
+        # Infinity и NaN json пропускает, а квантование на них падает
+        if not _valid_coordinate(x) or not _valid_coordinate(y):
+            raise CodecError('Point coordinates must be finite and within range')
+    return True
+
+
+def encode_element(element):
+    points = element.get('points')
+    packed = _packable_points(points)
+    header = {k: v for k, v in element.items() if k != 'points'} if packed else element
+    header_bytes = json.dumps(header, separators=(',', ':')).encode()
+
+    out = bytearray((FORMAT_VERSION, _FLAG_POINTS if packed else 0))
+    _write_varint(out, len(header_bytes))
+    out += header_bytes
+    if packed:
+        _write_varint(out, len(points))
+        px = py = 0
+        for p in points:
+            # floor(v + 0.5), а не round(): так же округляет Math.round в strokeCodec.js
+            x, y = math.floor(p['x'] * POINT_SCALE + 0.5), math.floor(p['y'] * POINT_SCALE + 0.5)
+            dx, dy = x - px, y - py
+            _write_varint(out, dx * 2 if dx >= 0 else -dx * 2 - 1)
+            _write_varint(out, dy * 2 if dy >= 0 else -dy * 2 - 1)
+            px, py = x, y
+    return bytes(out)
+
+
+def decode_element(data):
+    if len(data) < 2 or data[0] != FORMAT_VERSION:
+        raise CodecError('Unknown element format')
+    flags = data[1]
+    length, pos = _read_varint(data, 2)
+    try:
+        element = json.loads(bytes(data[pos:pos + length]))
+    except ValueError:
+        raise CodecError('Invalid element header')
+    if not isinstance(element, dict):
+        raise CodecError('Invalid element header')
+    pos += length
+
+    if flags & _FLAG_POINTS:
+        count, pos = _read_varint(data, pos)
+        points = []
+        x = y = 0
+        for _ in range(count):
+            dx, pos = _read_varint(data, pos)
+            dy, pos = _read_varint(data, pos)
+            x += (dx >> 1) ^ -(dx & 1)
+            y += (dy >> 1) ^ -(dy & 1)
+            points.append({'x': x / POINT_SCALE, 'y': y / POINT_SCALE})
+        element['points'] = points
+    return element
+
+
+def _convert(payload, convert):
+    """Копия payload, где каждое значение по ключу 'element' пропущено через convert."""
+    if isinstance(payload, dict):
+        return {k: convert(v) if k == 'element' else _convert(v, convert) for k, v in payload.items()}
+    if isinstance(payload, list):
+        return [_convert(v, convert) for v in payload]
+    return payload
+
+
+def _to_binary(element):
+    return element if isinstance(element, (bytes, bytearray)) else encode_element(element)
+
+
+def _to_json(element):
+    return decode_element(element) if isinstance(element, (bytes, bytearray)) else element
+
+
+def binary_payload(payload):
+    return _convert(payload, _to_binary)
+
+
+def json_payload(payload):
+    return _convert(payload, _to_json)
+
+
+def encode_elements(elements, codec):
+    """Список элементов для отправки клиенту с кодеком codec."""
+    return [encode_element(e) for e in elements] if codec == 'binary' else elements
+
+
+def whiteboard_room(team_id, codec):
+    """Комната доски для событий с элементами: JSON- и binary-клиенты получают их раздельно."""
+    return f'whiteboard_{team_id}_{codec}'
+
+
+def emit_elements(emit_fn, event, payload, team_id, **kwargs):
+    """Рассылает событие с элементами в обе комнаты доски, кодируя payload под каждую."""
+    emit_fn(event, json_payload(payload), room=whiteboard_room(team_id, 'json'), **kwargs)
+    emit_fn(event, binary_payload(payload), room=whiteboard_room(team_id, 'binary'), **kwargs)
@@ -0,0 +1,199 @@
+"""Проверка планов SQL-запросов бэкенда.
+
+Собирает все строковые SQL-запросы, которые передаются в conn.execute(...)
+в маршрутах, сокет-событиях и сервисных модулях, прогоняет для каждого
+EXPLAIN QUERY PLAN на свежей БД со всеми миграциями и завершается с кодом 1,
+если какой-то запрос делает полный проход (SCAN) по большой таблице.
+Большими считаются все таблицы схемы, кроме SMALL_TABLES, — новая таблица
+проверяется сразу, без правки списка. Запросы, собранные во время выполнения,
+проверить нельзя: они печатаются вместе с выражением SQL для ручного просмотра.
+
+В свежей БД нет sqlite_stat1, поэтому планировщик считает все таблицы
+большими — ровно тот случай, от которого мы защищаемся.
+
+Запуск из каталога backend:
+
+    python tools/check_query_plans.py
+"""
+import ast
+import os
+import re
+import sqlite3
+import sys
+import tempfile
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+import database  # noqa: E402
+from sockets.presence import _SQLITE_SCHEMA as PRESENCE_SCHEMA  # noqa: E402
+
+# Модули со схемой и служебный код не проверяем
+SKIPPED_FILES = {'database.py', 'migrations.py', 'pubsub.py'}
+SKIPPED_DIRS = {'tools', 'benchmarks', '__pycache__'}
+
+# Таблицы, которые не растут с числом пользователей/сообщений: полный проход по ним допустим.
+# Остальные таблицы схемы (и теневые таблицы FTS) считаются большими
+SMALL_TABLES = {
+    'sqlite_sequence',
+    'presence_workers',  # строка на воркер
+}
+
+# Запросы, которым полный проход нужен по смыслу: (файл, функция) -> причина
+ALLOWED_SCANS = {
+    ('routes/admin.py', 'get_all_users'): 'админ-панель выводит всех пользователей',
+    ('routes/admin.py', 'get_all_teams'): 'админ-панель выводит все команды',
+    ('routes/teams.py', 'get_public_teams'): 'каталог команд выводит все команды',
+}
+
+_TABLE_REF = re.compile(r'\b(?:FROM|JOIN|UPDATE|INTO)\s+(\w+)(?:\s+(?:AS\s+)?(\w+))?', re.IGNORECASE)
+_NOT_ALIASES = {
+    'where', 'join', 'left', 'inner', 'cross', 'on', 'order', 'group', 'limit',
+    'set', 'values', 'using', 'as', 'select', 'union', 'and', 'or',
+}
+_SCHEMA_PREFIXES = ('PRAGMA', 'CREATE', 'ALTER', 'DROP', 'BEGIN', 'COMMIT', 'ROLLBACK')
+
+
+class _Collector(ast.NodeVisitor):
+    """Ищет вызовы *.execute(<строка>, ...) и запоминает функцию, в которой они стоят."""
+
+    def __init__(self, constants):
+        self.constants = constants
+        self.functions = []
+        self.queries = []
+        self.dynamic = []
+
+    def visit_FunctionDef(self, node):
+        self.functions.append(node.name)
+        self.generic_visit(node)
+        self.functions.pop()
+
+    def visit_Call(self, node):
+        func = node.func
+        if isinstance(func, ast.Attribute) and func.attr in ('execute', 'executemany') and node.args:
+            sql = self._resolve(node.args[0])
+            where = self.functions[-1] if self.functions else '<module>'
+            if sql is None:
+                self.dynamic.append((node.lineno, where, ast.unparse(node.args[0])))
+            else:
+                self.queries.append((node.lineno, where, sql))
+        self.generic_visit(node)
+
+    def _resolve(self, arg):
+        if isinstance(arg, ast.Constant) and isinstance(arg.value, str):
+            return arg.value
+        if isinstance(arg, ast.Name):
+            return self.constants.get(arg.id)
+        if isinstance(arg, ast.BinOp) and isinstance(arg.op, ast.Add):
+            left, right = self._resolve(arg.left), self._resolve(arg.right)
+            if left is not None and right is not None:
+                return left + right
+        return None
+
+
+def _module_constants(tree):
+    constants = {}
+    for node in tree.body:
+        if (isinstance(node, ast.Assign) and len(node.targets) == 1
+                and isinstance(node.targets[0], ast.Name)
+                and isinstance(node.value, ast.Constant) and isinstance(node.value.value, str)):
+            constants[node.targets[0].id] = node.value.value
+    return constants
+
+
+def iter_source_files():
+    for root, dirs, files in os.walk(BACKEND_DIR):
+        dirs[:] = sorted(d for d in dirs if d not in SKIPPED_DIRS and not d.startswith('.'))
+        for name in sorted(files):
+            if not name.endswith('.py') or name in SKIPPED_FILES:
+                continue
+            path = os.path.join(root, name)
+            yield os.path.relpath(path, BACKEND_DIR).replace(os.sep, '/'), path
+
+
+def collect_queries():
+    queries, dynamic = [], []
+    for rel, path in iter_source_files():
+        with open(path, encoding='utf-8') as f:
+            tree = ast.parse(f.read(), filename=rel)
+        collector = _Collector(_module_constants(tree))
+        collector.visit(tree)
+        queries += [(rel, line, func, sql) for line, func, sql in collector.queries]
+        dynamic += [(rel, line, func, expr) for line, func, expr in collector.dynamic]
+    return queries, dynamic
+
+
+def _aliases(sql):
+    mapping = {}
+    for table, alias in _TABLE_REF.findall(sql):
+        mapping[table] = table
+        if alias and alias.lower() not in _NOT_ALIASES:
+            mapping[alias] = table
+    return mapping
+
+
+def large_tables(conn):
+    """Все таблицы схемы, кроме SMALL_TABLES и самих виртуальных (FTS) таблиц."""
+    tables = {row[0]: row[1] for row in conn.execute("SELECT name, sql FROM sqlite_master WHERE type = 'table'")}
+    virtual = {name for name, sql in tables.items() if sql and sql.upper().startswith('CREATE VIRTUAL')}
+    return set(tables) - SMALL_TABLES - virtual
+
+
+def full_scans(conn, sql, large):
+    """Возвращает строки плана с полным проходом по большим таблицам."""
+    params = (None,) * sql.count('?')
+    plan = conn.execute(f'EXPLAIN QUERY PLAN {sql}', params).fetchall()
+    aliases = _aliases(sql)
+    bad = []
+    for row in plan:
+        detail = row[3]
+        if not detail.startswith('SCAN ') or 'VIRTUAL TABLE' in detail:
+            continue
+        name = detail.split()[1]
+        if aliases.get(name, name) in large:
+            bad.append(detail)
+    return bad
+
+
+def main():
+    tmp_dir = tempfile.mkdtemp()
+    database.configure_pool(os.path.join(tmp_dir, 'plans.db'))
+    database.init_db()
+    # Присутствие живёт в отдельной БД (PRESENCE_BACKEND=sqlite), её схему создаём рядом
+    with database.get_db() as conn:
+        conn.executescript(PRESENCE_SCHEMA)
+
+    queries, dynamic = collect_queries()
+    failures = []
+    checked = 0
+
+    with database.get_db() as conn:
+        large = large_tables(conn)
+        for rel, line, func, sql in queries:
+            if sql.lstrip().upper().startswith(_SCHEMA_PREFIXES):
+                continue
+            checked += 1
+            try:
+                bad = full_scans(conn, sql, large)
+            except sqlite3.Error as e:
+                failures.append(f'{rel}:{line} {func}: не удалось построить план: {e}')
+                continue
+            if bad and (rel, func) not in ALLOWED_SCANS:
+                failures.append(f'{rel}:{line} {func}: ' + '; '.join(bad))
+
+    print(f'Проверено запросов: {checked}, динамических (пропущено): {len(dynamic)}')
+    for rel, line, func, expr in dynamic:
+        print(f'  пропущен {rel}:{line} {func}: {" ".join(expr.split())}')
+
+    if failures:
+        print('\nПолный проход по большим таблицам:')
+        for failure in failures:
+            print(f'  {failure}')
+        return 1
+
+    print('OK')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
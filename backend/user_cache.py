@@ -0,0 +1,91 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from cache_bus import cache_bus
+from database import get_db
+
+# Сколько пользователей держать в памяти и сколько секунд запись считается свежей
+USER_CACHE_SIZE = int(os.environ.get('USER_CACHE_SIZE', 4096))
+USER_CACHE_TTL = float(os.environ.get('USER_CACHE_TTL', 60))
+
+_USER_SQL = 'SELECT id, username, avatar_hash, is_site_admin FROM users WHERE id = ?'
+
+
+class UserCache:
+    """LRU-кеш «облегчённых» записей пользователей (id, username, avatar_hash, is_site_admin).
+
+    get_current_user() вызывается в каждом авторизованном запросе; кеш убирает
+    из него обращение к БД. Маршруты, меняющие эти поля, обязаны вызвать
+    invalidate() — сброс уходит всем воркерам через cache_bus (разжалованный
+    админ или удалённый пользователь не должен оставаться авторизованным на
+    соседнем воркере). TTL страхует от изменений в обход приложения.
+    """
+
+    def __init__(self, size=USER_CACHE_SIZE, ttl=USER_CACHE_TTL):
+        self.size = size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        # Растёт при каждой инвалидации: запись, прочитанная из БД до неё, в кеш не попадает
+        self._generation = 0
+        self._hits = 0
+        self._misses = 0
+
+    def get(self, user_id):
+        """dict пользователя или None, если такого нет."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry and entry[0] > now:
+                self._entries.move_to_end(user_id)
+                self._hits += 1
+                return dict(entry[1])
+            self._misses += 1
+            generation = self._generation
+
+        with get_db() as conn:
+            row = conn.execute(_USER_SQL, (user_id,)).fetchone()
+        if not row:
+            return None
+
+        user = dict(row)
+        with self._lock:
+            if generation == self._generation:
+                self._entries[user_id] = (now + self.ttl, user)
+                self._entries.move_to_end(user_id)
+                while len(self._entries) > self.size:
+                    self._entries.popitem(last=False)
+        return dict(user)
+
+    def invalidate(self, user_id):
+        cache_bus.publish('user_cache', user_id)
+
+    def clear(self):
+        cache_bus.publish('user_cache')
+
+    def _drop(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
+            self._generation += 1
+
+    def _drop_all(self):
+        with self._lock:
+            self._entries.clear()
+            self._generation += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                'size': len(self._entries),
+                'capacity': self.size,
+                'hits': self._hits,
+                'misses': self._misses,
+                'hit_rate': round(self._hits / lookups, 4) if lookups else 0,
+            }
+
+
+user_cache = UserCache()
+cache_bus.register('user_cache', user_cache)
@@ -0,0 +1,126 @@
+import math
+import os
+
+# Сторона ячейки сетки пространственного индекса доски (в пикселях доски)
+WHITEBOARD_GRID_CELL = float(os.environ.get('WHITEBOARD_GRID_CELL', 512))
+# Элемент, накрывающий больше ячеек, хранится в отдельном списке и проверяется перебором
+WHITEBOARD_GRID_MAX_CELLS = 256
+
+
+def element_bounds(element):
+    """(min_x, min_y, max_x, max_y) элемента с учётом толщины линии; None — форму не понять."""
+    try:
+        kind = element.get('type')
+        if kind in ('path', 'triangle'):
+            xs = [float(p['x']) for p in element['points']]
+            ys = [float(p['y']) for p in element['points']]
+        elif kind == 'line':
+            xs = [float(element['startX']), float(element['endX'])]
+            ys = [float(element['startY']), float(element['endY'])]
+        elif kind == 'rectangle':
+            x, y = float(element['startX']), float(element['startY'])
+            xs = [x, x + float(element['width'])]
+            ys = [y, y + float(element['height'])]
+        elif kind == 'circle':
+            x, y, r = float(element['x']), float(element['y']), abs(float(element['radius']))
+            xs, ys = [x - r, x + r], [y - r, y + r]
+        else:
+            return None
+        # Ластик рисуется втрое толще (см. WhiteboardCanvas.drawElement)
+        pad = float(element.get('lineWidth') or 0) * (3 if element.get('tool') == 'eraser' else 1) / 2
+        bounds = (min(xs) - pad, min(ys) - pad, max(xs) + pad, max(ys) + pad)
+    except (AttributeError, KeyError, TypeError, ValueError):
+        return None
+    if not all(math.isfinite(v) for v in bounds):
+        return None
+    return bounds
+
+
+def intersects(a, b):
+    return a[0] <= b[2] and b[0] <= a[2] and a[1] <= b[3] and b[1] <= a[3]
+
+
+class GridIndex:
+    """Равномерная сетка: ячейка -> id элементов, чьи рамки её задевают.
+
+    Запрос прямоугольника обходит только накрытые им ячейки. Элементы без
+    понятной формы попадают в любой запрос, слишком крупные — проверяются
+    перебором по рамке.
+    """
+
+    def __init__(self, cell=WHITEBOARD_GRID_CELL):
+        self.cell = cell
+        self._cells = {}     # (cx, cy) -> set(id)
+        self._bounds = {}    # id -> рамка (или None)
+        self._large = set()  # id элементов больше WHITEBOARD_GRID_MAX_CELLS ячеек
+        self._unbounded = set()
+
+    def __len__(self):
+        return len(self._bounds)
+
+    def _cell_range(self, bounds):
+        return (math.floor(bounds[0] / self.cell), math.floor(bounds[1] / self.cell),
+                math.floor(bounds[2] / self.cell), math.floor(bounds[3] / self.cell))
+
+    def insert(self, element_id, element):
+        if element_id in self._bounds:
+            self.remove(element_id)
+        bounds = element_bounds(element)
+        self._bounds[element_id] = bounds
+        if bounds is None:
+            self._unbounded.add(element_id)
+            return
+        x0, y0, x1, y1 = self._cell_range(bounds)
+        if (x1 - x0 + 1) * (y1 - y0 + 1) > WHITEBOARD_GRID_MAX_CELLS:
+            self._large.add(element_id)
+            return
+        for cx in range(x0, x1 + 1):
+            for cy in range(y0, y1 + 1):
+                self._cells.setdefault((cx, cy), set()).add(element_id)
+
+    def remove(self, element_id):
+        if element_id not in self._bounds:
+            return
+        bounds = self._bounds.pop(element_id)
+        if bounds is None:
+            self._unbounded.discard(element_id)
+            return
+        if element_id in self._large:
+            self._large.discard(element_id)
+            return
+        x0, y0, x1, y1 = self._cell_range(bounds)
+        for cx in range(x0, x1 + 1):
+            for cy in range(y0, y1 + 1):
+                ids = self._cells.get((cx, cy))
+                if ids is not None:
+                    ids.discard(element_id)
+                    if not ids:
+                        del self._cells[(cx, cy)]
+
+    def clear(self):
+        self._cells.clear()
+        self._bounds.clear()
+        self._large.clear()
+        self._unbounded.clear()
+
+    def bounds(self, element_id):
+        return self._bounds.get(element_id)
+
+    def query(self, rect):
+        """id элементов, чьи рамки пересекают rect (плюс элементы без рамки)."""
+        x0, y0, x1, y1 = self._cell_range(rect)
+        if (x1 - x0 + 1) * (y1 - y0 + 1) > len(self._cells):
+            # Прямоугольник шире занятой части сетки — быстрее пройти по занятым ячейкам
+            candidates = set().union(*(
+                ids for (cx, cy), ids in self._cells.items() if x0 <= cx <= x1 and y0 <= cy <= y1
+            ))
+        else:
+            candidates = set()
+            for cx in range(x0, x1 + 1):
+                for cy in range(y0, y1 + 1):
+                    ids = self._cells.get((cx, cy))
+                    if ids:
+                        candidates |= ids
+        candidates |= self._large
+        result = {i for i in candidates if intersects(self._bounds[i], rect)}
+        return result | self._unbounded
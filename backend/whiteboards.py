@@ -0,0 +1,483 @@
+import atexit
+import json
+import logging
+import os
+import threading
+import time
+import math
+import uuid
+
+from database import get_db
+from stroke_codec import CodecError, check_points, decode_element, encode_element
+from whiteboard_index import GridIndex, intersects
+
+# После скольких операций с последнего снимка журнал сворачивается в новый снимок
+WHITEBOARD_COMPACT_EVERY = int(os.environ.get('WHITEBOARD_COMPACT_EVERY', 500))
+# Сколько операций до снимка хранить, чтобы отставший клиент догнал доску без полной загрузки
+WHITEBOARD_OPS_RETAIN = int(os.environ.get('WHITEBOARD_OPS_RETAIN', 1000))
+WHITEBOARD_OPS_PAGE_MAX = 1000
+# Как часто (сек) горячие доски сбрасывают снимки в БД и проверяют простой
+WHITEBOARD_FLUSH_INTERVAL = float(os.environ.get('WHITEBOARD_FLUSH_INTERVAL', 5))
+# Через сколько секунд без обращений доска выгружается из памяти
+WHITEBOARD_IDLE_TTL = float(os.environ.get('WHITEBOARD_IDLE_TTL', 300))
+# Сколько элементов отдаётся за один запрос области просмотра
+WHITEBOARD_VIEWPORT_MAX = 2000
+# Сколько уже загруженных клиентом прямоугольников учитывается при догрузке
+WHITEBOARD_LOADED_RECTS_MAX = 16
+
+OPS = ('add', 'update', 'delete', 'clear')
+
+logger = logging.getLogger(__name__)
+
+_EMPTY = '{"elements":[]}'
+
+_INSERT_OP_SQL = '''
+    INSERT INTO whiteboard_ops (whiteboard_id, version, op, element_id, element, user_id)
+    VALUES (?, ?, ?, ?, ?, ?)
+'''
+
+
+class WhiteboardError(ValueError):
+    pass
+
+
+def new_element_id():
+    return uuid.uuid4().hex
+
+
+def parse_rect(value):
+    """Прямоугольник [x0, y0, x1, y1] (список или строка через запятую) -> (min_x, min_y, max_x, max_y)."""
+    if isinstance(value, str):
+        value = value.split(',')
+    try:
+        x0, y0, x1, y1 = (float(v) for v in value)
+    except (TypeError, ValueError):
+        raise WhiteboardError('Viewport must be [x0, y0, x1, y1]')
+    if not all(math.isfinite(v) for v in (x0, y0, x1, y1)):
+        raise WhiteboardError('Viewport must be finite')
+    return min(x0, x1), min(y0, y1), max(x0, x1), max(y0, y1)
+
+
+def parse_rects(value):
+    if value is None:
+        return []
+    if not isinstance(value, list) or len(value) > WHITEBOARD_LOADED_RECTS_MAX:
+        raise WhiteboardError(f'loaded must be a list of at most {WHITEBOARD_LOADED_RECTS_MAX} rects')
+    return [parse_rect(rect) for rect in value]
+
+
+def validate_ops(ops):
+    """Проверяет операции клиента и приводит их к виду {'op', 'id', 'element'}."""
+    if not isinstance(ops, list) or not ops:
+        raise WhiteboardError('ops must be a non-empty list')
+    result = []
+    for op in ops:
+        kind = op.get('op') if isinstance(op, dict) else None
+        if kind in ('add', 'update'):
+            element = op.get('element')
+            if isinstance(element, bytes):
+                try:
+                    element = decode_element(element)
+                except CodecError as e:
+                    raise WhiteboardError(str(e))
+            if not isinstance(element, dict) or not isinstance(element.get('id'), str) or not element['id']:
+                raise WhiteboardError('Element with id required')
+            try:
+                check_points(element.get('points'))
+            except CodecError as e:
+                raise WhiteboardError(str(e))
+            result.append({'op': kind, 'id': element['id'], 'element': element})
+        elif kind == 'delete':
+            if not isinstance(op.get('id'), str) or not op['id']:
+                raise WhiteboardError('Element id required')
+            result.append({'op': kind, 'id': op['id']})
+        elif kind == 'clear':
+            result.append({'op': kind})
+        else:
+            raise WhiteboardError('Invalid op')
+    return result
+
+
+def apply_ops(elements, ops):
+    """Применяет операции к {id: element}. Порядок ключей — порядок отрисовки."""
+    for op in ops:
+        kind = op['op']
+        if kind in ('add', 'update'):
+            elements[op['id']] = op['element']
+        elif kind == 'delete':
+            elements.pop(op['id'], None)
+        else:
+            elements.clear()
+    return elements
+
+
+def get_or_create_board(conn, team_id, user_id):
+    """(whiteboard_id, version) доски команды; создаёт пустую при первом обращении."""
+    board = conn.execute('SELECT id, version FROM whiteboards WHERE team_id = ?', (team_id,)).fetchone()
+    if board:
+        return board['id'], board['version']
+    cur = conn.execute('INSERT INTO whiteboards (team_id, created_by) VALUES (?, ?)', (team_id, user_id))
+    conn.execute('INSERT INTO whiteboard_data (whiteboard_id, data) VALUES (?, ?)', (cur.lastrowid, _EMPTY))
+    return cur.lastrowid, 0
+
+
+def _row_to_op(row):
+    op = {'version': row['version'], 'op': row['op']}
+    if row['element_id'] is not None:
+        op['id'] = row['element_id']
+    element = row['element']
+    if isinstance(element, bytes):
+        op['element'] = decode_element(element)
+    elif element is not None:
+        # Операции, записанные до stroke_codec, хранятся JSON-текстом
+        op['element'] = json.loads(element)
+    return op
+
+
+def ops_since(conn, whiteboard_id, version, limit=-1):
+    rows = conn.execute('''
+        SELECT version, op, element_id, element FROM whiteboard_ops
+        WHERE whiteboard_id = ? AND version > ?
+        ORDER BY version
+        LIMIT ?
+    ''', (whiteboard_id, version, limit)).fetchall()
+    return [_row_to_op(row) for row in rows]
+
+
+def can_replay_since(conn, whiteboard_id, version, current_version):
+    """Есть ли в журнале все операции после version (или клиенту нужен полный снимок)."""
+    if version >= current_version:
+        return True
+    oldest = conn.execute(
+        'SELECT MIN(version) AS version FROM whiteboard_ops WHERE whiteboard_id = ?', (whiteboard_id,)
+    ).fetchone()['version']
+    return oldest is not None and version >= oldest - 1
+
+
+def load_board(conn, whiteboard_id):
+    """(version, {id: element}) — снимок с применёнными после него операциями."""
+    snapshot = conn.execute(
+        'SELECT data, version FROM whiteboard_data WHERE whiteboard_id = ?', (whiteboard_id,)
+    ).fetchone()
+    elements, version = {}, 0
+    if snapshot:
+        version = snapshot['version']
+        for element in json.loads(snapshot['data']).get('elements', []):
+            elements[element['id']] = element
+    ops = ops_since(conn, whiteboard_id, version)
+    apply_ops(elements, ops)
+    return (ops[-1]['version'] if ops else version), elements
+
+
+def dump_elements(elements):
+    return json.dumps({'elements': list(elements.values())})
+
+
+def write_snapshot(conn, whiteboard_id, version, elements):
+    conn.execute('''
+        INSERT INTO whiteboard_data (whiteboard_id, data, version) VALUES (?, ?, ?)
+        ON CONFLICT (whiteboard_id) DO UPDATE SET
+            data = excluded.data, version = excluded.version, updated_at = CURRENT_TIMESTAMP
+        WHERE excluded.version > whiteboard_data.version
+    ''', (whiteboard_id, dump_elements(elements), version))
+
+
+def compact(conn, whiteboard_id, version, elements):
+    """Пишет снимок доски на version; хвост из WHITEBOARD_OPS_RETAIN операций остаётся для догоняющих клиентов."""
+    write_snapshot(conn, whiteboard_id, version, elements)
+    conn.execute(
+        'DELETE FROM whiteboard_ops WHERE whiteboard_id = ? AND version <= ?',
+        (whiteboard_id, version - WHITEBOARD_OPS_RETAIN)
+    )
+
+
+def append_ops(conn, whiteboard_id, ops, user_id):
+    """Дописывает проверенные операции в журнал. Возвращает их же с присвоенными version.
+
+    Снимок здесь не пишется — его сбрасывает из памяти HotWhiteboards.
+
+    Версию доски увеличивает UPDATE ... RETURNING: он же берёт блокировку записи,
+    поэтому операции разных воркеров получают последовательные версии.
+    """
+    version = conn.execute(
+        'UPDATE whiteboards SET version = version + ?, updated_at = CURRENT_TIMESTAMP WHERE id = ? RETURNING version',
+        (len(ops), whiteboard_id)
+    ).fetchone()['version']
+    first = version - len(ops) + 1
+    conn.executemany(_INSERT_OP_SQL, [
+        (whiteboard_id, first + i, op['op'], op.get('id'),
+         encode_element(op['element']) if 'element' in op else None, user_id)
+        for i, op in enumerate(ops)
+    ])
+    return [dict(op, version=first + i) for i, op in enumerate(ops)]
+
+
+def replace_board(conn, whiteboard_id, elements):
+    """Полная перезапись доски (старый PUT). Журнал очищается — отставшие клиенты получат снимок."""
+    board = {}
+    for element in elements:
+        if isinstance(element, dict):
+            element.setdefault('id', new_element_id())
+            board[element['id']] = element
+    version = conn.execute(
+        'UPDATE whiteboards SET version = version + 1, updated_at = CURRENT_TIMESTAMP WHERE id = ? RETURNING version',
+        (whiteboard_id,)
+    ).fetchone()['version']
+    write_snapshot(conn, whiteboard_id, version, board)
+    conn.execute('DELETE FROM whiteboard_ops WHERE whiteboard_id = ?', (whiteboard_id,))
+    return version
+
+
+class _HotBoard:
+    __slots__ = (
+        'whiteboard_id', 'version', 'elements', 'index', 'order', 'next_seq',
+        'snapshot_version', 'last_access', 'lock',
+    )
+
+    def __init__(self, whiteboard_id):
+        self.whiteboard_id = whiteboard_id
+        self.version = -1  # -1 — копия ещё не загружена (или выгружена)
+        self.elements = {}
+        self.index = GridIndex()
+        self.order = {}  # id -> порядковый номер отрисовки
+        self.next_seq = 1
+        self.snapshot_version = 0
+        self.last_access = time.monotonic()
+        self.lock = threading.Lock()
+
+    def reset(self, elements):
+        self.elements = elements
+        self.index.clear()
+        self.order = {}
+        self.next_seq = 1
+        for element_id, element in elements.items():
+            self._put(element_id, element)
+
+    def _put(self, element_id, element):
+        if element_id not in self.order:
+            self.order[element_id] = self.next_seq
+            self.next_seq += 1
+        self.index.insert(element_id, element)
+
+    def apply(self, ops):
+        for op in ops:
+            kind = op['op']
+            if kind in ('add', 'update'):
+                self._put(op['id'], op['element'])
+            elif kind == 'delete':
+                self.order.pop(op['id'], None)
+                self.index.remove(op['id'])
+            else:
+                self.order.clear()
+                self.index.clear()
+        apply_ops(self.elements, ops)
+
+    def viewport(self, rect, loaded, after, limit):
+        """Элементы, пересекающие rect, в порядке отрисовки — кроме уже отданных по loaded.
+
+        Возвращает (элементы, курсор следующей страницы или None).
+        """
+        seqs = []
+        for element_id in self.index.query(rect):
+            seq = self.order[element_id]
+            if seq <= after:
+                continue
+            bounds = self.index.bounds(element_id)
+            # Пересекавшее loaded клиент уже получил (или получил операцией в комнате доски)
+            if loaded and (bounds is None or any(intersects(bounds, r) for r in loaded)):
+                continue
+            seqs.append((seq, element_id))
+        seqs.sort()
+        page = seqs[:limit]
+        next_after = page[-1][0] if len(seqs) > limit else None
+        return [self.elements[element_id] for _, element_id in page], next_after
+
+
+class HotWhiteboards:
+    """Горячие копии активных досок в памяти процесса.
+
+    Доска читается из БД (снимок + журнал) один раз при первом обращении,
+    дальше join_whiteboard и GET отдают её из памяти. Операции по-прежнему
+    сразу пишутся в журнал: версию выдаёт БД, поэтому несколько воркеров
+    не расходятся. Снимок пишется отложенно (write-behind): фоновый поток
+    раз в WHITEBOARD_FLUSH_INTERVAL сворачивает журнал досок, набравших
+    WHITEBOARD_COMPACT_EVERY операций, а доску без обращений дольше
+    WHITEBOARD_IDLE_TTL сбрасывает и выгружает.
+
+    Если журнал дописал другой воркер, копия догоняет его по ops_since
+    (или перечитывается целиком, если журнал уже свёрнут).
+    """
+
+    def __init__(self, flush_interval=WHITEBOARD_FLUSH_INTERVAL, idle_ttl=WHITEBOARD_IDLE_TTL):
+        self.flush_interval = flush_interval
+        self.idle_ttl = idle_ttl
+        self._boards = {}  # team_id -> _HotBoard
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='whiteboards', daemon=True)
+                self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self.flush(evict_all=True)
+
+    def _acquire(self, conn, team_id, user_id):
+        """Горячая доска команды с захваченным board.lock; при первом обращении загружается из БД."""
+        if self._thread is None:
+            self.start()
+        with self._lock:
+            board = self._boards.get(team_id)
+        if board is None:
+            whiteboard_id, _ = get_or_create_board(conn, team_id, user_id)
+            with self._lock:
+                # Параллельный запрос мог создать копию раньше — используем его
+                board = self._boards.setdefault(team_id, _HotBoard(whiteboard_id))
+        # Не ждём board.lock с открытой транзакцией записи (INSERT новой доски):
+        # владелец board.lock сам может ждать блокировку записи БД
+        if conn.in_transaction:
+            conn.commit()
+        board.lock.acquire()
+        board.last_access = time.monotonic()
+        if board.version < 0:
+            self._reload(conn, board)
+        return board
+
+    def _reload(self, conn, board):
+        snapshot = conn.execute(
+            'SELECT version FROM whiteboard_data WHERE whiteboard_id = ?', (board.whiteboard_id,)
+        ).fetchone()
+        board.snapshot_version = snapshot['version'] if snapshot else 0
+        board.version, elements = load_board(conn, board.whiteboard_id)
+        board.reset(elements)
+
+    def _catch_up(self, conn, board):
+        current = conn.execute(
+            'SELECT version FROM whiteboards WHERE id = ?', (board.whiteboard_id,)
+        ).fetchone()['version']
+        if current == board.version:
+            return
+        if can_replay_since(conn, board.whiteboard_id, board.version, current):
+            board.apply(ops_since(conn, board.whiteboard_id, board.version))
+            board.version = current
+        else:
+            self._reload(conn, board)
+
+    def load(self, conn, team_id, user_id):
+        """(whiteboard_id, version, [elements]) — актуальная доска команды."""
+        board = self._acquire(conn, team_id, user_id)
+        try:
+            self._catch_up(conn, board)
+            return board.whiteboard_id, board.version, list(board.elements.values())
+        finally:
+            board.lock.release()
+
+    def viewport(self, conn, team_id, user_id, rect, loaded=(), after=0, limit=WHITEBOARD_VIEWPORT_MAX):
+        """(whiteboard_id, version, [elements], next_after) — часть доски в области просмотра."""
+        board = self._acquire(conn, team_id, user_id)
+        try:
+            self._catch_up(conn, board)
+            elements, next_after = board.viewport(rect, loaded, after, limit)
+            return board.whiteboard_id, board.version, elements, next_after
+        finally:
+            board.lock.release()
+
+    def append(self, conn, team_id, user_id, ops):
+        """Пишет проверенные операции в журнал и делает commit; только после него
+        операции применяются к горячей копии — откат не оставит в ней лишнего.
+        """
+        board = self._acquire(conn, team_id, user_id)
+        try:
+            ops = append_ops(conn, board.whiteboard_id, ops, user_id)
+            conn.commit()
+            if ops[0]['version'] == board.version + 1:
+                board.apply(ops)
+                board.version = ops[-1]['version']
+            else:
+                # Перед нашими операциями в журнал писал другой воркер
+                self._catch_up(conn, board)
+            return ops
+        except BaseException:
+            # Копия могла разойтись с БД — следующее обращение перечитает доску
+            board.version = -1
+            raise
+        finally:
+            board.lock.release()
+
+    def replace(self, conn, team_id, user_id, elements):
+        """Полная перезапись доски с commit; горячая копия меняется только после него."""
+        board = self._acquire(conn, team_id, user_id)
+        try:
+            version = replace_board(conn, board.whiteboard_id, elements)
+            conn.commit()
+            board.version = board.snapshot_version = version
+            board.reset({e['id']: e for e in elements if isinstance(e, dict)})
+            return version
+        except BaseException:
+            board.version = -1
+            raise
+        finally:
+            board.lock.release()
+
+    def flush(self, evict_all=False):
+        """Сворачивает журнал досок, набравших операций, и выгружает простаивающие."""
+        idle_before = time.monotonic() - self.idle_ttl
+        with self._lock:
+            boards = list(self._boards.items())
+
+        for team_id, board in boards:
+            try:
+                self._flush_board(team_id, board, evict_all, idle_before)
+            except Exception:
+                # Операции уже в журнале — следующий сброс повторит сворачивание
+                logger.exception('whiteboard %s: snapshot flush failed', board.whiteboard_id)
+
+    def _flush_board(self, team_id, board, evict_all, idle_before):
+        # Под board.lock только копируем состояние: compact ждёт блокировку записи БД,
+        # а её может держать запрос, который сам ждёт board.lock
+        with board.lock:
+            idle = evict_all or board.last_access < idle_before
+            version = board.version
+            pending = version - board.snapshot_version
+            snapshot = None
+            if version >= 0 and (pending >= WHITEBOARD_COMPACT_EVERY or (idle and pending > 0)):
+                snapshot = dict(board.elements)
+
+        if snapshot is not None:
+            with get_db() as conn:
+                compact(conn, board.whiteboard_id, version, snapshot)
+                conn.commit()
+
+        with board.lock:
+            if snapshot is not None:
+                board.snapshot_version = max(board.snapshot_version, version)
+            # За время сворачивания к доске могли обратиться — тогда не выгружаем
+            if idle and (evict_all or board.last_access < idle_before):
+                with self._lock:
+                    self._boards.pop(team_id, None)
+                # Запрос, успевший взять копию до выгрузки, перечитает доску из БД
+                board.version = -1
+                board.reset({})
+
+    def stats(self):
+        with self._lock:
+            boards = list(self._boards.values())
+        return {
+            'boards': len(boards),
+            'elements': sum(len(b.elements) for b in boards),
+        }
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception:
+                logger.exception('whiteboard flush failed')
+
+
+hot_boards = HotWhiteboards()
+atexit.register(hot_boards.stop)
@@ -39,8 +39,14 @@ function TeamWorkspace() {
 	useEffect(() => {
 		if (!socket.socket) return
 
-		socket.on('user_online', () => loadTeamData())
-		socket.on('user_offline', () => loadTeamData())
+		socket.on('presence_delta', (data) => {
+			if (parseInt(data.team_id) !== parseInt(teamId)) return
+			const added = new Set(data.added || [])
+			const removed = new Set(data.removed || [])
+			setMembers(prev => prev.map(m =>
+				added.has(m.id) ? { ...m, is_online: true } : removed.has(m.id) ? { ...m, is_online: false } : m
+			))
+		})
 
 		socket.on('new_poll', (poll) => {
 			toast.success(`Новое голосование: ${poll.question}`)
@@ -69,8 +75,7 @@ function TeamWorkspace() {
 		})
 
 		return () => {
-			socket.off('user_online')
-			socket.off('user_offline')
+			socket.off('presence_delta')
 			socket.off('new_poll')
 			socket.off('poll_updated')
 			socket.off('poll_closed')
@@ -53,7 +53,10 @@ export const useSocket = (teamId, user) => {
 		sendTyping: socketService.sendTyping.bind(socketService),
 		joinWhiteboard: socketService.joinWhiteboard.bind(socketService),
 		leaveWhiteboard: socketService.leaveWhiteboard.bind(socketService),
+		requestWhiteboardViewport: socketService.requestWhiteboardViewport.bind(socketService),
 		sendWhiteboardDraw: socketService.sendWhiteboardDraw.bind(socketService),
+		sendWhiteboardDrawing: socketService.sendWhiteboardDrawing.bind(socketService),
+		sendWhiteboardOps: socketService.sendWhiteboardOps.bind(socketService),
 		clearWhiteboard: socketService.clearWhiteboard.bind(socketService),
 		sendPollCreated: socketService.sendPollCreated.bind(socketService),
 		sendPollVote: socketService.sendPollVote.bind(socketService),
@@ -2,6 +2,57 @@ import { useState, useEffect, useRef } from 'react'
 import { apiFetch } from '@shared/api/api'
 import toast from 'react-hot-toast'
 
+const newElementId = () => crypto.randomUUID().replace(/-/g, '')
+
+// Операции журнала доски, переводящие prev в next (по id элементов)
+const diffElements = (prev, next) => {
+	const prevById = new Map(prev.map(e => [e.id, e]))
+	const nextIds = new Set(next.map(e => e.id))
+	const ops = prev.filter(e => !nextIds.has(e.id)).map(e => ({ op: 'delete', id: e.id }))
+	next.forEach(e => {
+		const old = prevById.get(e.id)
+		if (!old) ops.push({ op: 'add', element: e })
+		else if (old !== e) ops.push({ op: 'update', element: e })
+	})
+	return ops
+}
+
+const applyOps = (elements, ops) => {
+	let result = elements
+	ops.forEach(op => {
+		if (op.op === 'clear') result = []
+		else if (op.op === 'delete') result = result.filter(e => e.id !== op.id)
+		else if (result.some(e => e.id === op.element.id)) {
+			result = result.map(e => (e.id === op.element.id ? op.element : e))
+		} else result = [...result, op.element]
+	})
+	return result
+}
+
+// Размер холста (см. WhiteboardCanvas) и запас вокруг видимой области при загрузке
+const CANVAS_WIDTH = 2000
+const CANVAS_HEIGHT = 1200
+const VIEWPORT_MARGIN = 1000
+// Столько загруженных прямоугольников принимает сервер в whiteboard_viewport
+const LOADED_RECTS_MAX = 16
+
+const viewportRect = (panOffset, margin = VIEWPORT_MARGIN) => [
+	-panOffset.x - margin,
+	-panOffset.y - margin,
+	-panOffset.x + CANVAS_WIDTH + margin,
+	-panOffset.y + CANVAS_HEIGHT + margin,
+]
+
+const containsRect = (outer, inner) =>
+	outer[0] <= inner[0] && outer[1] <= inner[1] && outer[2] >= inner[2] && outer[3] >= inner[3]
+
+// Догруженные элементы уже есть на доске — добавляем их в каждое состояние истории
+const mergeElements = (elements, loaded) => {
+	const known = new Set(elements.map(e => e.id))
+	const fresh = loaded.filter(e => !known.has(e.id))
+	return fresh.length ? [...elements, ...fresh] : elements
+}
+
 export const useWhiteboard = (teamId, user, socket) => {
 	const [elements, setElements] = useState([])
 	const [currentElement, setCurrentElement] = useState(null)
@@ -16,16 +67,52 @@ export const useWhiteboard = (teamId, user, socket) => {
 	const [spacePressed, setSpacePressed] = useState(false)
 
 	const cursorThrottleRef = useRef(null)
+	// Области доски, элементы которых уже загружены
+	const loadedRectsRef = useRef([])
+
+	// Загружает элементы области rect постранично; loaded — уже загруженные области
+	const loadViewport = (rect, loaded, after = 0) => {
+		socket.requestWhiteboardViewport(parseInt(teamId), rect, loaded, after, (page) => {
+			if (!page?.elements) return
+			if (page.elements.length) {
+				setElements(prev => mergeElements(prev, page.elements))
+				setHistory(prev => prev.map(state => mergeElements(state, page.elements)))
+			}
+			if (page.next_after) {
+				loadViewport(rect, loaded, page.next_after)
+			} else {
+				loadedRectsRef.current = [...loadedRectsRef.current, rect].slice(-LOADED_RECTS_MAX)
+			}
+		})
+	}
 
-	// Присоединяемся к whiteboard-комнате когда сокет готов
+	// Присоединяемся к whiteboard-комнате когда сокет готов; сервер сразу отдаёт видимую часть доски
 	useEffect(() => {
 		if (!socket?.socket?.connected || !teamId) return
-		socket.joinWhiteboard(parseInt(teamId))
+		const rect = viewportRect(panOffset)
+		loadedRectsRef.current = []
+		socket.joinWhiteboard(parseInt(teamId), rect, (snapshot) => {
+			if (!snapshot?.elements) return
+			resetElements(snapshot.elements)
+			if (snapshot.next_after) loadViewport(rect, [], snapshot.next_after)
+			else loadedRectsRef.current = [rect]
+		})
 		return () => {
 			socket.leaveWhiteboard(parseInt(teamId))
 		}
 	}, [socket?.socket?.connected, teamId])
 
+	// При панорамировании догружаем элементы, попавшие в новую область
+	useEffect(() => {
+		if (!socket?.socket?.connected || !loadedRectsRef.current.length) return
+		const timer = setTimeout(() => {
+			const visible = viewportRect(panOffset, 0)
+			if (loadedRectsRef.current.some(rect => containsRect(rect, visible))) return
+			loadViewport(viewportRect(panOffset), loadedRectsRef.current)
+		}, 150)
+		return () => clearTimeout(timer)
+	}, [panOffset])
+
 	// WEBSOCKET — регистрируем слушатели один раз на teamId
 	useEffect(() => {
 		if (!socket || !teamId) return
@@ -49,31 +136,35 @@ export const useWhiteboard = (teamId, user, socket) => {
 			}
 		}
 
-		const handleWhiteboardLiveDrawing = (data) => {
-			if (data.username !== user.username) {
-				setLiveElements(prev => ({
-					...prev,
-					[data.username]: data.element
-				}))
+		// Сервер присылает курсоры и незавершённые фигуры пачкой раз в тик
+		const handleWhiteboardFrame = (data) => {
+			const drawing = (data.drawing || []).filter(d => d.username !== user.username)
+			if (drawing.length) {
+				setLiveElements(prev => {
+					const updated = { ...prev }
+					drawing.forEach(d => { updated[d.username] = d.element })
+					return updated
+				})
 			}
-		}
 
-		const handleCursorUpdate = (data) => {
-			if (data.username !== user.username) {
-				setCursors(prev => ({
-					...prev,
-					[data.username]: { x: data.x, y: data.y }
-				}))
+			const cursorsUpdate = (data.cursors || []).filter(c => c.username !== user.username)
+			if (!cursorsUpdate.length) return
+			setCursors(prev => {
+				const updated = { ...prev }
+				cursorsUpdate.forEach(c => { updated[c.username] = { x: c.x, y: c.y } })
+				return updated
+			})
+			cursorsUpdate.forEach(c => {
 				setTimeout(() => {
 					setCursors(prev => {
 						const updated = { ...prev }
-						if (updated[data.username]?.x === data.x && updated[data.username]?.y === data.y) {
-							delete updated[data.username]
+						if (updated[c.username]?.x === c.x && updated[c.username]?.y === c.y) {
+							delete updated[c.username]
 						}
 						return updated
 					})
 				}, 2000)
-			}
+			})
 		}
 
 		const handleWhiteboardCleared = (data) => {
@@ -86,65 +177,54 @@ export const useWhiteboard = (teamId, user, socket) => {
 			}
 		}
 
-		const handleWhiteboardSync = (data) => {
+		const handleWhiteboardOps = (data) => {
 			if (data.username !== user.username) {
-				setElements(data.elements)
-				setHistory([data.elements])
-				setHistoryStep(0)
+				setElements(prev => {
+					const newElements = applyOps(prev, data.ops)
+					setHistory([newElements])
+					setHistoryStep(0)
+					return newElements
+				})
 			}
 		}
 
 		socket.on('whiteboard_update', handleWhiteboardUpdate)
-		socket.on('whiteboard_live_drawing', handleWhiteboardLiveDrawing)
-		socket.on('whiteboard_cursor_update', handleCursorUpdate)
+		socket.on('whiteboard_frame', handleWhiteboardFrame)
 		socket.on('whiteboard_cleared', handleWhiteboardCleared)
-		socket.on('whiteboard_sync', handleWhiteboardSync)
+		socket.on('whiteboard_ops', handleWhiteboardOps)
 
 		return () => {
 			socket.off('whiteboard_update', handleWhiteboardUpdate)
-			socket.off('whiteboard_live_drawing', handleWhiteboardLiveDrawing)
-			socket.off('whiteboard_cursor_update', handleCursorUpdate)
+			socket.off('whiteboard_frame', handleWhiteboardFrame)
 			socket.off('whiteboard_cleared', handleWhiteboardCleared)
-			socket.off('whiteboard_sync', handleWhiteboardSync)
+			socket.off('whiteboard_ops', handleWhiteboardOps)
 		}
 	}, [teamId, user.username])
 
-	// Загружаем whiteboard из БД
+	// Без сокета загружаем доску по REST (с сокетом снимок приходит в ответе на join_whiteboard)
 	useEffect(() => {
-		loadWhiteboard()
+		if (!socket?.socket?.connected) loadWhiteboard()
 	}, [teamId])
 
+	const resetElements = (newElements) => {
+		setElements(newElements)
+		setHistory([[...newElements]])
+		setHistoryStep(0)
+	}
+
 	const loadWhiteboard = async () => {
 		try {
 			const data = await apiFetch(`/teams/${teamId}/whiteboard`)
-			const parsedData = JSON.parse(data.data)
-			setElements(parsedData.elements || [])
-			setHistory([[...(parsedData.elements || [])]])
-			setHistoryStep(0)
+			resetElements(JSON.parse(data.data).elements || [])
 		} catch (error) {
 			console.error('Error loading whiteboard:', error)
 		}
 	}
 
-	const saveWhiteboard = async (elementsToSave) => {
-		try {
-			await apiFetch(`/teams/${teamId}/whiteboard`, {
-				method: 'PUT',
-				body: JSON.stringify({ data: JSON.stringify({ elements: elementsToSave }) }),
-			})
-		} catch (error) {
-			console.error('Error saving whiteboard:', error)
-		}
-	}
-
 	// Отправка live элемента (используем emit напрямую)
 	const sendLiveElement = (element) => {
 		if (socket?.socket?.connected) {
-			socket.emit('whiteboard_drawing', {
-				team_id: parseInt(teamId),
-				element,
-				username: user.username,
-			})
+			socket.sendWhiteboardDrawing(parseInt(teamId), element, user.username)
 		}
 	}
 
@@ -166,7 +246,9 @@ export const useWhiteboard = (teamId, user, socket) => {
 		}, 50)
 	}
 
-	const addElement = (element) => {
+	const addElement = (drawn) => {
+		const element = drawn.id ? drawn : { ...drawn, id: newElementId() }
+		// Сервер сам пишет элемент в журнал доски и рассылает его остальным
 		socket.sendWhiteboardDraw(parseInt(teamId), element, user.username)
 
 		// Добавляем локально
@@ -174,49 +256,27 @@ export const useWhiteboard = (teamId, user, socket) => {
 		setElements(newElements)
 		setHistory([...history.slice(0, historyStep + 1), newElements])
 		setHistoryStep(historyStep + 1)
-
-		// Сохраняем в БД
-		saveWhiteboard(newElements)
 	}
 
-	const undo = () => {
-		if (historyStep > 0) {
-			const newStep = historyStep - 1
-			const newElements = history[newStep]
-
-			setHistoryStep(newStep)
-			setElements(newElements)
+	// Переход по истории: в журнал и остальным уходит только разница
+	const goToHistoryStep = (newStep) => {
+		const newElements = history[newStep]
+		const ops = diffElements(elements, newElements)
 
-			saveWhiteboard(newElements)
+		setHistoryStep(newStep)
+		setElements(newElements)
 
-			if (socket?.socket?.connected) {
-				socket.emit('whiteboard_sync', {
-					team_id: parseInt(teamId),
-					elements: newElements,
-					username: user.username,
-				})
-			}
+		if (ops.length && socket?.socket?.connected) {
+			socket.sendWhiteboardOps(parseInt(teamId), ops)
 		}
 	}
 
-	const redo = () => {
-		if (historyStep < history.length - 1) {
-			const newStep = historyStep + 1
-			const newElements = history[newStep]
-
-			setHistoryStep(newStep)
-			setElements(newElements)
-
-			saveWhiteboard(newElements)
+	const undo = () => {
+		if (historyStep > 0) goToHistoryStep(historyStep - 1)
+	}
 
-			if (socket?.socket?.connected) {
-				socket.emit('whiteboard_sync', {
-					team_id: parseInt(teamId),
-					elements: newElements,
-					username: user.username,
-				})
-			}
-		}
+	const redo = () => {
+		if (historyStep < history.length - 1) goToHistoryStep(historyStep + 1)
 	}
 
 	const clear = () => {
@@ -227,7 +287,6 @@ export const useWhiteboard = (teamId, user, socket) => {
 		setLiveElements({})
 		setHistory([...history.slice(0, historyStep + 1), newElements])
 		setHistoryStep(historyStep + 1)
-		saveWhiteboard(newElements)
 	}
 
 	return {
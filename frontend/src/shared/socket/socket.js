@@ -1,13 +1,38 @@
 import { io } from 'socket.io-client'
 import { getToken } from '@shared/api/api'
+import { decodePayload, encodeElement, encodeOps } from '@shared/socket/strokeCodec'
 
 const SOCKET_URL = 'http://localhost:5000'
 
+// Элементы доски ходят в компактном бинарном виде (см. strokeCodec.js)
+const WHITEBOARD_CODEC = 'binary'
+// События, в которых элементы доски приходят закодированными
+const ELEMENT_EVENTS = new Set(['whiteboard_update', 'whiteboard_frame', 'whiteboard_ops'])
+
 class SocketService {
 	constructor() {
 		this.socket = null
 		this.connected = false
 		this.currentTeamId = null
+		this.decoders = new WeakMap()
+		// Для досылки пропущенного при переподключении: id последнего полученного
+		// сообщения по каждому чату и synced_at из последнего sync_complete
+		this.lastSeen = {}
+		this.syncedAt = null
+	}
+
+	// auth вычисляется заново при каждом (пере)подключении
+	authPayload() {
+		const auth = { token: getToken(), codec: WHITEBOARD_CODEC }
+		if (Object.keys(this.lastSeen).length) {
+			auth.resume = { ...this.lastSeen }
+			if (this.syncedAt) auth.since = this.syncedAt
+		}
+		return auth
+	}
+
+	markSeen(chatId, messageId) {
+		if (chatId != null && messageId > (this.lastSeen[chatId] || 0)) this.lastSeen[chatId] = messageId
 	}
 
 	connect() {
@@ -17,7 +42,7 @@ class SocketService {
 			transports: ['websocket'],
 			autoConnect: true,
 			upgrade: false,
-			auth: { token: getToken() },
+			auth: (cb) => cb(this.authPayload()),
 		})
 
 		this.socket.on('connect', () => {
@@ -28,6 +53,21 @@ class SocketService {
 			this.connected = false
 		})
 
+		this.socket.on('new_message', ({ chat_id, id }) => this.markSeen(chat_id, id))
+		this.socket.on('sync_batch', ({ chat_id, fields, rows }) => {
+			const idIndex = fields.indexOf('id')
+			if (rows.length) this.markSeen(chat_id, rows[rows.length - 1][idIndex])
+		})
+		this.socket.on('sync_complete', ({ synced_at }) => {
+			this.syncedAt = synced_at
+		})
+
+		// Состав чатов изменился: сервер уже перевёл сокеты своего воркера,
+		// повторный join_chat / leave_chat нужен сокетам на других воркерах
+		this.socket.on('chat_membership', ({ chat_id, member }) => {
+			this.socket.emit(member ? 'join_chat' : 'leave_chat', { chat_id })
+		})
+
 		return this.socket
 	}
 
@@ -38,6 +78,8 @@ class SocketService {
 			this.socket = null
 			this.connected = false
 			this.currentTeamId = null
+			this.lastSeen = {}
+			this.syncedAt = null
 		}
 	}
 
@@ -48,11 +90,18 @@ class SocketService {
 	}
 
 	on(event, callback) {
-		if (this.socket) this.socket.on(event, callback)
+		if (!this.socket) return
+		if (ELEMENT_EVENTS.has(event)) {
+			const decoded = (data) => callback(decodePayload(data))
+			this.decoders.set(callback, decoded)
+			this.socket.on(event, decoded)
+		} else {
+			this.socket.on(event, callback)
+		}
 	}
 
 	off(event, callback) {
-		if (this.socket) this.socket.off(event, callback)
+		if (this.socket) this.socket.off(event, this.decoders.get(callback) || callback)
 	}
 
 	// Team methods
@@ -94,8 +143,18 @@ class SocketService {
 	}
 
 	// Whiteboard methods
-	joinWhiteboard(teamId) {
-		this.emit('join_whiteboard', { team_id: teamId })
+	// onSnapshot получает доску сервера в области viewport: { version, elements, next_after }
+	joinWhiteboard(teamId, viewport, onSnapshot) {
+		if (this.socket?.connected) {
+			this.socket.emit('join_whiteboard', { team_id: teamId, viewport }, (snapshot) => onSnapshot(decodePayload(snapshot)))
+		}
+	}
+
+	// Догрузка элементов области viewport, кроме пересекающих уже загруженные прямоугольники loaded
+	requestWhiteboardViewport(teamId, viewport, loaded, after, onPage) {
+		if (this.socket?.connected) {
+			this.socket.emit('whiteboard_viewport', { team_id: teamId, viewport, loaded, after }, (page) => onPage(decodePayload(page)))
+		}
 	}
 
 	leaveWhiteboard(teamId) {
@@ -103,17 +162,21 @@ class SocketService {
 	}
 
 	sendWhiteboardDraw(teamId, element, username) {
-		this.emit('whiteboard_draw', { team_id: teamId, element, username })
+		this.emit('whiteboard_draw', { team_id: teamId, element: encodeElement(element), username })
 	}
 
 	sendWhiteboardDrawing(teamId, element, username) {
-		this.emit('whiteboard_drawing', { team_id: teamId, element, username })
+		this.emit('whiteboard_drawing', { team_id: teamId, element: encodeElement(element), username })
 	}
 
 	sendWhiteboardCursor(teamId, username, x, y) {
 		this.emit('whiteboard_cursor', { team_id: teamId, username, x, y })
 	}
 
+	sendWhiteboardOps(teamId, ops) {
+		this.emit('whiteboard_ops', { team_id: teamId, ops: encodeOps(ops) })
+	}
+
 	clearWhiteboard(teamId) {
 		this.emit('whiteboard_clear', { team_id: teamId })
 	}
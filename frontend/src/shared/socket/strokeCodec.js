@@ -0,0 +1,114 @@
+// Бинарный формат элементов доски — зеркало backend/stroke_codec.py:
+// [версия] [флаги] [varint длина заголовка] [заголовок JSON] [varint число точек] [zigzag dx, dy]...
+// Точки квантуются до 1/POINT_SCALE пикселя и пишутся разностью с предыдущей.
+
+const FORMAT_VERSION = 1
+const POINT_SCALE = 10
+const FLAG_POINTS = 1
+
+const textEncoder = new TextEncoder()
+const textDecoder = new TextDecoder()
+
+const writeVarint = (out, value) => {
+	// Без побитовых операций: координаты могут выйти за 32 бита после zigzag
+	while (value > 0x7f) {
+		out.push((value % 0x80) | 0x80)
+		value = Math.floor(value / 0x80)
+	}
+	out.push(value)
+}
+
+const readVarint = (bytes, state) => {
+	let result = 0
+	let multiplier = 1
+	while (state.pos < bytes.length) {
+		const byte = bytes[state.pos++]
+		result += (byte & 0x7f) * multiplier
+		if (byte < 0x80) return result
+		multiplier *= 0x80
+	}
+	throw new Error('Truncated varint')
+}
+
+const zigzag = (n) => (n >= 0 ? n * 2 : -n * 2 - 1)
+const unzigzag = (n) => (n % 2 === 0 ? n / 2 : -(n + 1) / 2)
+
+const isPackable = (points) =>
+	Array.isArray(points) &&
+	points.every(p => p && Object.keys(p).length === 2 &&
+		typeof p.x === 'number' && typeof p.y === 'number')
+
+export const encodeElement = (element) => {
+	const packed = isPackable(element.points)
+	const header = packed ? { ...element } : element
+	if (packed) delete header.points
+	const headerBytes = textEncoder.encode(JSON.stringify(header))
+
+	const out = [FORMAT_VERSION, packed ? FLAG_POINTS : 0]
+	writeVarint(out, headerBytes.length)
+	const prefix = out.length
+	const tail = []
+	if (packed) {
+		writeVarint(tail, element.points.length)
+		let px = 0
+		let py = 0
+		element.points.forEach(p => {
+			const x = Math.round(p.x * POINT_SCALE)
+			const y = Math.round(p.y * POINT_SCALE)
+			writeVarint(tail, zigzag(x - px))
+			writeVarint(tail, zigzag(y - py))
+			px = x
+			py = y
+		})
+	}
+
+	const result = new Uint8Array(prefix + headerBytes.length + tail.length)
+	result.set(out, 0)
+	result.set(headerBytes, prefix)
+	result.set(tail, prefix + headerBytes.length)
+	return result
+}
+
+export const decodeElement = (data) => {
+	const bytes = data instanceof Uint8Array ? data : new Uint8Array(data)
+	if (bytes.length < 2 || bytes[0] !== FORMAT_VERSION) throw new Error('Unknown element format')
+	const flags = bytes[1]
+	const state = { pos: 2 }
+	const length = readVarint(bytes, state)
+	const element = JSON.parse(textDecoder.decode(bytes.subarray(state.pos, state.pos + length)))
+	state.pos += length
+
+	if (flags & FLAG_POINTS) {
+		const count = readVarint(bytes, state)
+		const points = new Array(count)
+		let x = 0
+		let y = 0
+		for (let i = 0; i < count; i++) {
+			x += unzigzag(readVarint(bytes, state))
+			y += unzigzag(readVarint(bytes, state))
+			points[i] = { x: x / POINT_SCALE, y: y / POINT_SCALE }
+		}
+		element.points = points
+	}
+	return element
+}
+
+const isBinary = (value) => value instanceof ArrayBuffer || ArrayBuffer.isView(value)
+
+// Раскодирует все бинарные элементы в ответе сервера (element, elements[], ops[].element...)
+export const decodePayload = (payload) => {
+	if (isBinary(payload)) return decodeElement(payload)
+	if (Array.isArray(payload)) return payload.map(decodePayload)
+	if (payload && typeof payload === 'object') {
+		const result = {}
+		Object.entries(payload).forEach(([key, value]) => {
+			result[key] = decodePayload(value)
+		})
+		return result
+	}
+	return payload
+}
+
+// Кодирует элементы исходящих операций доски
+export const encodeOps = (ops) =>
+	ops.map(op => (op.element ? { ...op, element: encodeElement(op.element) } : op))
@@ -47,12 +47,33 @@ function ChatPanel({ teamId, teamData, chatId, socket }) {
 			}
 		}
 
+		// Досылка пропущенного после переподключения: новые сообщения, правки и удаления
+		const handleSyncBatch = (batch) => {
+			if (batch.chat_id !== chatId) return
+			if (batch.truncated) {
+				fetchMessages()
+				return
+			}
+			const toMessage = (row) => ({ chat_id: chatId, ...Object.fromEntries(batch.fields.map((field, i) => [field, row[i]])) })
+			const updated = new Map(batch.updated.map(row => [row[batch.fields.indexOf('id')], toMessage(row)]))
+			const deleted = new Set(batch.deleted)
+			setMessages(prev => {
+				const known = new Set(prev.map(m => m.id))
+				const kept = prev
+					.filter(m => !deleted.has(m.id))
+					.map(m => (updated.has(m.id) ? { ...m, ...updated.get(m.id) } : m))
+				return [...kept, ...batch.rows.map(toMessage).filter(m => !known.has(m.id))]
+			})
+		}
+
 		socket.on('new_message', handleNewMessage)
 		socket.on('user_typing', handleUserTyping)
+		socket.on('sync_batch', handleSyncBatch)
 
 		return () => {
 			socket.off('new_message', handleNewMessage)
 			socket.off('user_typing', handleUserTyping)
+			socket.off('sync_batch', handleSyncBatch)
 		}
 	}, [socket?.socket, chatId, user.username])
 
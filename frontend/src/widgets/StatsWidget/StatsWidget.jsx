@@ -47,20 +47,16 @@ function StatsWidget({
 			setStats(prev => ({ ...prev, onlineMembers: set.size }))
 		}
 
-		const handleUserOnline = (data) => {
+		const handlePresenceDelta = (data) => {
 			if (parseInt(data.team_id) !== parseInt(teamId)) return
-			onlineUsersRef.current.add(data.user_id)
-			setStats(prev => ({ ...prev, onlineMembers: onlineUsersRef.current.size }))
-		}
-
-		const handleUserOffline = (data) => {
-			if (parseInt(data.team_id) !== parseInt(teamId)) return
-			onlineUsersRef.current.delete(data.user_id)
+			data.added?.forEach(id => onlineUsersRef.current.add(id))
+			data.removed?.forEach(id => onlineUsersRef.current.delete(id))
 			setStats(prev => ({ ...prev, onlineMembers: onlineUsersRef.current.size }))
 		}
 
 		const handleNewMessage = (message) => {
-			if (!message) return
+			// Сокет получает сообщения всех своих чатов — считаем только чат этой команды
+			if (!message || parseInt(message.team_id) !== parseInt(teamId)) return
 			const today = new Date().toDateString()
 			const messageDate = message.created_at ? new Date(message.created_at).toDateString() : today
 			setStats(prev => ({
@@ -72,8 +68,7 @@ function StatsWidget({
 
 		socket.on('joined_team', handleJoinedTeam)
 		socket.on('online_users_list', handleOnlineList)
-		socket.on('user_online', handleUserOnline)
-		socket.on('user_offline', handleUserOffline)
+		socket.on('presence_delta', handlePresenceDelta)
 		socket.on('new_message', handleNewMessage)
 
 		socket.getOnlineUsers(teamId)
@@ -81,8 +76,7 @@ function StatsWidget({
 		return () => {
 			socket.off('joined_team', handleJoinedTeam)
 			socket.off('online_users_list', handleOnlineList)
-			socket.off('user_online', handleUserOnline)
-			socket.off('user_offline', handleUserOffline)
+			socket.off('presence_delta', handlePresenceDelta)
 			socket.off('new_message', handleNewMessage)
 		}
 	}, [socket, teamId])